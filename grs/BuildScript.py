@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+#
+#    BuildScript.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import re
+from grs.Constants import CONST
+
+class Directive():
+    """ One executable line of the build script.
+
+        line_number - The line number in the build script, used for progress stamps.
+        line        - The line without any leading +.
+        verb        - The first word on the line.
+        objs        - The remaining words on the line.
+        update      - True if the line had a leading +, ie. it is also done
+                      on an update run.
+        medium      - For hashit, the verb which produced the medium to hash.
+    """
+
+    def __init__(self, line_number, line, verb, objs, update, medium=None):
+        self.line_number = line_number
+        self.line = line
+        self.verb = verb
+        self.objs = objs
+        self.update = update
+        self.medium = medium
+
+    def __str__(self):
+        return '%02d %s %s' % (self.line_number, '+' if self.update else ' ', self.line)
+
+
+class BuildScript():
+    """ Compile the build script into a list of Directives before anything is
+        run.  Every line is checked up front: its verb, the number of objects,
+        that populate gets a cycle number, that runscript's script exists and
+        that hashit follows something to hash.  This way a bad script fails in
+        milliseconds rather than hours into a run.
+    """
+
+    # verb : the numbers of objects it can take
+    arities = {
+        'log'       : [1],
+        'mount'     : [0],
+        'unmount'   : [0],
+        'populate'  : [1],
+        'runscript' : [1],
+        'pivot'     : [1],
+        'kernel'    : [1],
+        'tarit'     : [0, 1],
+        'isoit'     : [0, 1],
+        'netbootit' : [0, 1, 2],
+        'hashit'    : [0]
+    }
+
+    # The verbs which produce a medium for hashit.
+    media = ['tarit', 'isoit', 'netbootit']
+
+    def __init__(self, libdir=CONST.LIBDIR):
+        self.libdir = libdir
+        self.build_script = os.path.join(libdir, 'build')
+        self.errors = []
+
+
+    def compile(self):
+        """ Return the list of Directives in the build script.  Any problems
+            found are collected in self.errors[], so we report them all at once.
+        """
+        self.errors = []
+        directives = []
+        try:
+            with open(self.build_script, 'r') as _file:
+                lines = _file.readlines()
+        except OSError as err:
+            self.errors.append('Cannot read %s: %s' % (self.build_script, err))
+            return directives
+
+        medium = None
+        for line_number, _line in enumerate(lines, start=1):
+            # Get rid of whitespace padding immediately
+            _line = _line.strip()
+
+            # Skip lines with initial # or blank lines.
+            if re.search(r'^(#).*$', _line) or _line == '' or _line == '+':
+                continue
+
+            # A leading + means the line is also done on an update run.
+            update = False
+            _match = re.search(r'^(\+)(.*)$', _line)
+            if _match:
+                update = True
+                _line = _match.group(2).strip()
+
+            # This is pretty simple syntax.  The first word on a line
+            # is a verb.  The remaining words are objcts.
+            sentence = _line.split()
+            verb = sentence[0]
+            objs = sentence[1:]
+
+            def error(msg):
+                self.errors.append('line %d: %s: %s' % (line_number, _line, msg))
+
+            if not verb in self.arities:
+                error('Unknown verb: %s' % verb)
+                continue
+            if not len(objs) in self.arities[verb]:
+                error('Number of parameters incorrect.')
+                continue
+
+            if verb == 'populate' and not objs[0].isdigit():
+                error('Cycle number must be an integer.')
+            elif verb == 'runscript':
+                script = os.path.join(self.libdir, 'scripts', objs[0])
+                if not os.path.isfile(script):
+                    error('No such script %s' % script)
+            elif verb == 'hashit' and not medium:
+                error('Unknown medium to hash.')
+
+            # Note: 'hashit' can only come after 'tarit', 'isoit' or 'netbootit'
+            # so that it knows the medium_name to hash, ie whether its a
+            # .tar.xz or a .iso, etc.
+            if verb in self.media:
+                medium = verb
+            directive_medium = medium if verb == 'hashit' else None
+            directives.append(Directive(line_number, _line, verb, objs, update, directive_medium))
+
+        return directives
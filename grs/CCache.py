@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+#    CCache.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import subprocess
+from grs.Constants import CONST
+from grs.Engine import Engine
+
+class CCache():
+    """ A compiler cache shared across runs.  The ccache_dir on the host is
+        bind mounted at /var/cache/ccache in the system's portage configroot
+        (see MountDirectories), and portage is told to use it in the scripts
+        we run there.  If the host has ccache to read them, the counters are
+        noted at the start of a run, and how much each grew is logged at the
+        end.  We don't zero them, since other systems may share the cache, but
+        what they compile meanwhile is counted too.
+    """
+
+    # Where the cache is in the system's portage configroot.
+    chroot_dir = '/var/cache/ccache'
+
+    def __init__(self, ccache_dir='', logfile=CONST.LOGFILE):
+        self.ccache_dir = ccache_dir
+        self.logfile = logfile
+        self.before = {}
+
+
+    def env(self):
+        """ The environment for running a script in the chroot. """
+        if not self.ccache_dir:
+            return {}
+        return {'FEATURES' : 'ccache', 'CCACHE_DIR' : self.chroot_dir}
+
+
+    def counters(self):
+        """ The statistics counters of our cache, from ccache --print-stats,
+            or {} if we have no cache or the host has no ccache.
+        """
+        if not self.ccache_dir or not shutil.which('ccache'):
+            return {}
+        os.makedirs(self.ccache_dir, mode=0o755, exist_ok=True)
+        try:
+            output = subprocess.check_output(
+                ['ccache', '--print-stats'], env=dict(os.environ, CCACHE_DIR=self.ccache_dir),
+                stderr=subprocess.DEVNULL, universal_newlines=True, timeout=60
+            )
+        except (subprocess.SubprocessError, OSError):
+            return {}
+        counters = {}
+        for line in output.splitlines():
+            words = line.split('\t')
+            if len(words) == 2 and words[1].strip().isdigit():
+                counters[words[0]] = int(words[1])
+        return counters
+
+
+    def begin(self):
+        """ Note the counters at the start of a run. """
+        self.before = self.counters()
+
+
+    def stats(self):
+        """ Log how much each counter grew during the run. """
+        after = self.counters()
+        if not after:
+            return
+        grown = ['%s=%d' % (k, after[k] - self.before.get(k, 0)) for k in sorted(after)
+                 if not k.endswith('_timestamp') and after[k] != self.before.get(k, 0)]
+        Engine.get().emit(self.logfile, 'grs', 'ccache: %s' % (' '.join(grown) or 'unchanged'))
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+#
+#    Cgroup.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import math
+import os
+import signal
+import sys
+import time
+
+from grs.Constants import CONST
+from grs.Execute import Execute
+
+
+class Cgroup():
+    """ The cgroup of a GRS system run, eg. /sys/fs/cgroup/grs/run-<name>.
+        The daemon and everything it spawns live in it, so we can tell when the
+        run is done, kill it and account for what it used.
+
+        On a host with the unified cgroup v2 hierarchy, grs is a child of its
+        root with the cpu, memory and io controllers enabled.  Processes are
+        moved by writing cgroup.procs, a run is killed at once by cgroup.kill,
+        and cpu.stat, memory.peak and io.stat give us its usage.  On a legacy
+        v1 host, we fall back to the named grs hierarchy, which has no
+        controllers of its own, and libcgroup for any cpu and memory limits.
+    """
+
+    def __init__(self, cgroupdir, unified=None):
+        self.cgroupdir = cgroupdir
+        if unified is None:
+            unified = self.is_unified()
+        self.unified = unified
+
+
+    @staticmethod
+    def is_unified():
+        """ Whether the host uses the unified cgroup v2 hierarchy. """
+        return os.path.isfile(os.path.join(CONST.CGROUPDIR, 'cgroup.controllers'))
+
+
+    @staticmethod
+    def setup():
+        """ Make sure the grs cgroup exists, and return a Cgroup for it. """
+        grs = Cgroup(CONST.GRS_CGROUPDIR)
+        if grs.unified:
+            os.makedirs(grs.cgroupdir, mode=0o755, exist_ok=True)
+            # Delegate whichever of the controllers we use are available down
+            # to the runs.  The parent has to delegate them to us first.
+            for cgroupdir in [CONST.CGROUPDIR, grs.cgroupdir]:
+                available = grs.read(os.path.join(cgroupdir, 'cgroup.controllers')).split()
+                wanted = ['+%s' % c for c in ['cpu', 'memory', 'io'] if c in available]
+                if wanted:
+                    grs.write(os.path.join(cgroupdir, 'cgroup.subtree_control'), ' '.join(wanted))
+        else:
+            os.makedirs(grs.cgroupdir, mode=0o555, exist_ok=True)
+            if not os.path.ismount(grs.cgroupdir):
+                cmd = 'mount -t cgroup -o none,name=%s %s %s' % (CONST.GRS_CGROUP, CONST.GRS_CGROUP, grs.cgroupdir)
+                Execute(cmd)
+        return grs
+
+
+    @staticmethod
+    def read(path):
+        with open(path, 'r') as _file:
+            return _file.read()
+
+
+    @staticmethod
+    def write(path, value):
+        with open(path, 'w') as _file:
+            _file.write(value)
+
+
+    @staticmethod
+    def cpus():
+        """ The number of cpus we may use.  Our affinity already reflects any
+            cpuset, and on v2, we're also capped by the cpu.max quota of our
+            own cgroup or any of its ancestors.
+        """
+        cpus = len(os.sched_getaffinity(0))
+        if not Cgroup.is_unified():
+            return cpus
+        try:
+            lines = Cgroup.read('/proc/self/cgroup').splitlines()
+        except FileNotFoundError:
+            return cpus
+        # On v2, this is a single line, eg. 0::/grs/run-desktop
+        paths = [line[3:] for line in lines if line.startswith('0::')]
+        if not paths:
+            return cpus
+        cgroupdir = os.path.join(CONST.CGROUPDIR, paths[0].lstrip('/'))
+        while cgroupdir.startswith(CONST.CGROUPDIR) and cgroupdir != CONST.CGROUPDIR:
+            try:
+                quota, period = Cgroup.read(os.path.join(cgroupdir, 'cpu.max')).split()
+                if quota != 'max':
+                    cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+            except (FileNotFoundError, ValueError):
+                pass
+            cgroupdir = os.path.dirname(cgroupdir)
+        return cpus
+
+
+    def child(self, name):
+        """ A Cgroup for a child of this one, eg. of grs for a run. """
+        return Cgroup(os.path.join(self.cgroupdir, name), self.unified)
+
+
+    def create(self):
+        os.makedirs(self.cgroupdir, exist_ok=True)
+
+
+    def attach(self, pid):
+        """ Move a process into this cgroup.  Its future children follow it. """
+        self.write(os.path.join(self.cgroupdir, 'cgroup.procs'), '%d' % pid)
+
+
+    def limit(self, pid, cpu_weight='', memory_max=''):
+        """ Apply a cpu weight, relative to the default of 100, and a memory
+            limit, eg. 16G, to this cgroup which already contains pid.
+        """
+        if self.unified:
+            # A controller's files only exist if our parent delegated it to
+            # us, which we can't do ourselves if grs's parent didn't either.
+            try:
+                available = self.read(os.path.join(self.cgroupdir, 'cgroup.controllers')).split()
+            except FileNotFoundError:
+                available = []
+            for controller, filename, value in [
+                    ('cpu', 'cpu.weight', '%d' % int(cpu_weight) if cpu_weight else ''),
+                    ('memory', 'memory.max', memory_max)]:
+                if not value:
+                    continue
+                if controller not in available:
+                    sys.stderr.write('%s: %s controller not available, ignoring %s\n' % \
+                        (self.cgroupdir, controller, filename))
+                    continue
+                self.write(os.path.join(self.cgroupdir, filename), value)
+            return
+
+        # With v1, these controllers are separate hierarchies, where we put
+        # pid in a cgroup of the same name as in the grs hierarchy.
+        controllers = []
+        settings = []
+        if cpu_weight:
+            # cpu.shares defaults to 1024 for a weight of 100.
+            controllers.append('cpu')
+            settings.append('-r cpu.shares=%d' % max(2, int(cpu_weight) * 1024 // 100))
+        if memory_max:
+            controllers.append('memory')
+            settings.append('-r memory.limit_in_bytes=%s' % memory_max)
+        if not controllers:
+            return
+        cgroup = os.path.relpath(self.cgroupdir, os.path.dirname(CONST.GRS_CGROUPDIR))
+        Execute('cgcreate -g %s:/%s' % (','.join(controllers), cgroup))
+        Execute('cgset %s %s' % (' '.join(settings), cgroup))
+        Execute('cgclassify -g %s:/%s %d' % (','.join(controllers), cgroup, pid))
+
+
+    def pids(self):
+        """ The processes in this cgroup. """
+        try:
+            return [int(pid) for pid in self.read(os.path.join(self.cgroupdir, 'cgroup.procs')).split()]
+        except FileNotFoundError:
+            return []
+
+
+    def populated(self):
+        """ Whether there are any processes in this cgroup. """
+        if self.unified:
+            try:
+                events = self.read(os.path.join(self.cgroupdir, 'cgroup.events'))
+            except FileNotFoundError:
+                return False
+            return 'populated 1' in events.splitlines()
+        return self.pids() != []
+
+
+    def kill(self):
+        """ SIGKILL everything in this cgroup except ourselves, and wait for it
+            to be gone.  On v2, we first step out into a sibling cgroup so that
+            cgroup.kill can take out the whole run in a single write.
+        """
+        mypid = os.getpid()
+        killfile = os.path.join(self.cgroupdir, 'cgroup.kill')
+        if self.unified and os.path.isfile(killfile):
+            aside = self.aside()
+            aside.create()
+            aside.attach(mypid)
+            self.write(killfile, '1')
+            while self.populated():
+                time.sleep(0.1)
+            return
+        # Else we have to kill them one at a time, until no more are forked.
+        while True:
+            pids = [pid for pid in self.pids() if pid != mypid]
+            if not pids:
+                break
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+
+    def aside(self):
+        """ The sibling cgroup kill() steps out into, eg. run-<name>.teardown. """
+        return Cgroup('%s.teardown' % self.cgroupdir, self.unified)
+
+
+    def remove(self):
+        """ Remove this cgroup, and the one kill() stepped aside into, once
+            there's nothing left in either.
+        """
+        for cgroupdir in [self.aside().cgroupdir, self.cgroupdir]:
+            try:
+                os.rmdir(cgroupdir)
+            except FileNotFoundError:
+                pass
+
+
+    def stats(self):
+        """ Return what this cgroup used so far as a dictionary of
+
+                cpu_usec, cpu_user_usec, cpu_system_usec - from cpu.stat,
+                memory_peak                              - from memory.peak,
+                io_rbytes, io_wbytes, io_rios, io_wios   - from io.stat.
+
+            Only what the kernel provides is given, which is nothing on v1.
+        """
+        stats = {}
+        if not self.unified:
+            return stats
+        names = {'usage_usec' : 'cpu_usec', 'user_usec' : 'cpu_user_usec', 'system_usec' : 'cpu_system_usec'}
+        try:
+            for line in self.read(os.path.join(self.cgroupdir, 'cpu.stat')).splitlines():
+                words = line.split()
+                if len(words) == 2 and words[0] in names:
+                    stats[names[words[0]]] = int(words[1])
+        except FileNotFoundError:
+            pass
+        try:
+            stats['memory_peak'] = int(self.read(os.path.join(self.cgroupdir, 'memory.peak')))
+        except (FileNotFoundError, ValueError):
+            pass
+        # io.stat has a line per device, eg.  8:0 rbytes=1 wbytes=2 rios=3 wios=4 ...
+        try:
+            for line in self.read(os.path.join(self.cgroupdir, 'io.stat')).splitlines():
+                for field in line.split()[1:]:
+                    key, _, value = field.partition('=')
+                    if key in ['rbytes', 'wbytes', 'rios', 'wios']:
+                        stats['io_%s' % key] = stats.get('io_%s' % key, 0) + int(value)
+        except FileNotFoundError:
+            pass
+        return stats
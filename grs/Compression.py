@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+#    Compression.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import re
+import shutil
+
+class Compression():
+    """ Select the compressor used for tarballs.  The codec, level and thread
+        count come from systems.conf, eg.
+
+        [my-cool-desktop]
+        compression : zstd
+        compression_level : 19
+        compression_threads : 0
+
+        A thread count of 0 means use all the cores available to us.  All the
+        codecs produce ordinary single stream files, so a stock 'tar -xf' on
+        the client can unpack them.
+    """
+
+    # codec : (tarball suffix, compressor, option for the number of threads,
+    #          single threaded compressor to use if the first isn't installed)
+    codecs = {
+        'xz'    : ('xz', 'xz', '-T%d', None),
+        'zstd'  : ('zst', 'zstd', '-T%d', None),
+        'gzip'  : ('gz', 'pigz', '-p %d', 'gzip'),
+        'bzip2' : ('bz2', 'lbzip2', '-n %d', 'bzip2')
+    }
+
+    # codec : the compression levels it takes.  zstd needs --ultra above 19,
+    # and xz may be given e for its extreme presets, eg. 9e.
+    levels = {
+        'xz'    : r'[0-9]e?',
+        'zstd'  : r'[1-9]|1[0-9]|2[0-2]',
+        'gzip'  : r'[1-9]',
+        'bzip2' : r'[1-9]'
+    }
+
+    def __init__(self, codec='xz', level=None, threads=0):
+        if not codec in self.codecs:
+            raise Exception('Unknown compression codec %s' % codec)
+        self.codec = codec
+        if level and not re.fullmatch(self.levels[codec], str(level)):
+            raise Exception('Invalid compression level %s for %s' % (level, codec))
+        self.level = level
+        self.threads = int(threads)
+        if self.threads <= 0:
+            self.threads = len(os.sched_getaffinity(0))
+
+
+    @staticmethod
+    def for_file(filename, threads=0):
+        """ Return a Compression for a tarball based on its suffix, or None
+            if it doesn't look compressed.  Since tar adds -d when it runs the
+            program, this is also what we use for parallel decompression.
+        """
+        for codec in Compression.codecs:
+            suffix = Compression.codecs[codec][0]
+            if filename.endswith('.tar.%s' % suffix):
+                return Compression(codec, threads=threads)
+        return None
+
+
+    def suffix(self):
+        """ The file suffix of a tarball compressed with this codec. """
+        return 'tar.%s' % self.codecs[self.codec][0]
+
+
+    def program(self):
+        """ The compressor with its options as a single command string. """
+        (suffix, program, threads_opt, fallback) = self.codecs[self.codec]
+        # gzip and bzip2 can't do threads, so only use them if pigz or
+        # lbzip2 aren't installed.
+        if fallback and not shutil.which(program):
+            cmd = fallback
+        else:
+            cmd = '%s %s' % (program, threads_opt % self.threads)
+        if self.level:
+            if self.codec == 'zstd' and int(self.level) > 19:
+                cmd += ' --ultra'
+            cmd += ' -%s' % self.level
+        return cmd
+
+
+    def tar_option(self):
+        """ The tar option which selects our compressor. """
+        return '--use-compress-program=\'%s\'' % self.program()
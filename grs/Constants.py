@@ -91,7 +91,33 @@ class Constants():
             'distfiles'           : '/var/cache/distfiles',
             'kernelroot'          : '/var/tmp/grs/%s/kernel',
             'portage_configroot'  : '/var/tmp/grs/%s/system',
-            'pidfile'             : '/run/grs-%s.pid'
+            'pidfile'             : '/run/grs-%s.pid',
+            'hash_inline'         : 'no',
+            'compression'         : 'xz',
+            'compression_level'   : '',
+            'compression_threads' : '0',
+            'stagedir'            : '/var/tmp/grs/stages',
+            'seedcache'           : '',
+            'gitcache'            : '/var/lib/grs/git',
+            'repo_depth'          : '0',
+            'parallel_directives' : '1',
+            'rootcache'           : '',
+            'rootcache_copy'      : 'no',
+            'rootcache_keep'      : '20',
+            'priority'            : '0',
+            'cpu_weight'          : '',
+            'memory_max'          : '',
+            'log_format'          : 'text',
+            'log_sync'            : 'batch',
+            'log_max_size'        : '0',
+            'log_compression'     : 'xz',
+            'log_keep'            : '20',
+            'log_budget'          : '0',
+            'mount_namespace'     : 'no',
+            'bind_mounts'         : '',
+            'tmpfs_mounts'        : '',
+            'ccache_dir'          : '',
+            'kernelcache'         : ''
         }
 
         # We add an 's' to each list for a particular constant,
@@ -168,10 +194,14 @@ CONST.DISTFILES = '/var/cache/distfiles'
 CONST.KERNELROOT = '/var/tmp/grs/kernel'
 CONST.PORTAGE_CONFIGROOT = '/var/tmp/grs/system'
 CONST.PIDFILE = '/run/grs.pid'
+CONST.STAGEDIR = '/var/tmp/grs/stages'
+CONST.SEEDCACHE = ''
+CONST.ROOTCACHE = ''
 
 # These are used by grsup and are hard coded values.
 CONST.PORTAGE_CONFIGDIR = '/etc/portage'
 CONST.PORTAGE_DIRTYFILE = '/etc/portage/.grs_dirty'
 CONST.WORLD_CONFIG = '/etc/grs/world.conf'
+CONST.CGROUPDIR = '/sys/fs/cgroup'
 CONST.GRS_CGROUP = 'grs'
 CONST.GRS_CGROUPDIR = '/sys/fs/cgroup/grs'
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+#
+#    Dispatcher.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import time
+
+from grs.Constants import CONST
+
+
+class Dispatcher():
+    """ Run the GRS systems from systems.conf a few at a time rather than all
+        at once.  Systems are queued in order of their priority, highest first,
+        and then in the order of systems.conf.  Whenever fewer than jobs are
+        running, the next one is started.  jobs <= 0 means no limit, which is
+        to start them all at once as we always did.
+
+        Each system can also be given a cpu_weight, relative to the default of
+        100, and a memory_max, eg. 16G, which are enforced through the cpu and
+        memory cgroup controllers, see Cgroup.limit().
+    """
+
+    def __init__(self, jobs=0, interval=10):
+        self.jobs = int(jobs)
+        self.interval = interval
+
+
+    @staticmethod
+    def order(run_numbers):
+        """ The run numbers by priority, highest first.  sorted() is stable,
+            so systems of equal priority keep their order.
+        """
+        return sorted(run_numbers, key=lambda count: -int(CONST.prioritys[count]))
+
+
+    def run(self, run_numbers, start, running):
+        """ Call start(count) for each system, keeping no more than self.jobs
+            of them going.  running(count) says whether one is still going.
+            We return as soon as the last one is started.
+        """
+        pending = self.order(run_numbers)
+        active = []
+        while pending:
+            active = [count for count in active if running(count)]
+            while pending and (self.jobs <= 0 or len(active) < self.jobs):
+                count = pending.pop(0)
+                start(count)
+                active.append(count)
+            if pending:
+                time.sleep(self.interval)
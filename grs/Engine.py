@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+#
+#    Engine.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import atexit
+import concurrent.futures
+import json
+import os
+import threading
+import time
+
+from grs.Rotator import Rotator
+from grs.Trace import Trace
+
+
+class Sink(Rotator):
+    """ A logfile shared by everything writing to it: the commands we run,
+        Log and Execute's own messages.  It is only ever written from the
+        Engine's thread, so lines never interleave.  Every line is a record
+        of where it came from:
+
+            stream    - stdout or stderr of a command, log for Log.log(), or
+                        grs for our own messages, eg. EXIT CODE,
+            line      - the line number of the directive, if any, and
+            directive - the directive itself.
+
+        In text mode, only the command output is stamped, with the monotonic
+        time it arrived and the line number, and Log messages are stamped with
+        the unix time, as they always were.  In json mode, each record is a
+        line of JSON with all of the above plus the system name and both
+        times.  How often we flush is up to the sync policy:
+
+            batch - about once a second, and when a command finishes,
+            flush - after every record,
+            fsync - after every record, and fsync() it to disk too.
+
+        If max_size > 0, the logfile is rotated, as for a new run, whenever
+        it grows past max_size bytes, keeping up to keep of them.  Then the
+        after_rotate callback, if any, is called, eg. to compress the old ones.
+    """
+
+    def __init__(
+            self, path, loop, system=None, json=False, sync='batch', max_size=0,
+            keep=20, after_rotate=None
+    ):
+        self.path = path
+        self.loop = loop
+        self.system = system
+        self.json = json
+        self.sync = sync
+        self.max_size = max_size
+        self.keep = keep
+        # Not rotated, which would hide Rotator.rotated().
+        self.after_rotate = after_rotate
+        self._file = None
+        self.dirty = False
+        self.reopen()
+
+
+    def reopen(self):
+        """ (Re)open the logfile if it was rotated away from under us. """
+        if self._file:
+            try:
+                if os.stat(self.path).st_ino == os.fstat(self._file.fileno()).st_ino:
+                    return
+            except FileNotFoundError:
+                pass
+            self._file.close()
+        self._file = open(self.path, 'a', buffering=1024*1024)
+
+
+    def emit(self, stream, text, context=None, monotonic=None, stamped=False):
+        """ Write text as one record per line. """
+        (line, directive) = context or (None, None)
+        for _text in text.splitlines() or ['']:
+            if self.json:
+                record = {
+                    'time' : time.time(),
+                    'monotonic' : monotonic or time.monotonic(),
+                    'system' : self.system,
+                    'line' : line,
+                    'directive' : directive,
+                    'stream' : stream,
+                    'msg' : _text
+                }
+                self._file.write('%s\n' % json.dumps(record))
+            elif stream in ['stdout', 'stderr']:
+                tag = '--' if line is None else '%02d' % line
+                self._file.write('[%f %s] %s\n' % (monotonic, tag, _text))
+            elif stamped:
+                self._file.write('[%f] %s\n' % (time.time(), _text))
+            else:
+                self._file.write('%s\n' % _text)
+
+        if self.sync == 'batch':
+            if not self.dirty:
+                self.dirty = True
+                self.loop.call_later(1.0, self.flush)
+        else:
+            self._file.flush()
+            if self.sync == 'fsync':
+                os.fsync(self._file.fileno())
+
+        if self.max_size > 0 and self._file.tell() >= self.max_size:
+            self._file.close()
+            self.full_rotate(self.path, upper_limit=self.keep)
+            self._file = open(self.path, 'a', buffering=1024*1024)
+            if self.after_rotate:
+                self.after_rotate()
+
+
+    def flush(self):
+        self.dirty = False
+        self._file.flush()
+
+
+class LineProtocol(asyncio.Protocol):
+    """ Read a pipe from a child and emit it to a Sink a line at a time,
+        each stamped with the monotonic time it arrived.
+    """
+
+    def __init__(self, sink, stream, context, done):
+        self.sink = sink
+        self.stream = stream
+        self.context = context
+        self.done = done
+        self.buffer = b''
+
+
+    def stamp(self, line):
+        text = line.decode('utf-8', 'replace')
+        self.sink.emit(self.stream, text, self.context, time.monotonic())
+
+
+    def data_received(self, data):
+        lines = (self.buffer + data).split(b'\n')
+        self.buffer = lines.pop()
+        for line in lines:
+            self.stamp(line)
+
+
+    def connection_lost(self, exc):
+        if self.buffer:
+            self.stamp(self.buffer)
+            self.buffer = b''
+        if not self.done.done():
+            self.done.set_result(None)
+
+
+class Engine():
+    """ An asyncio event loop, in a thread of its own, which streams the
+        stdout and stderr of any number of concurrent children into their
+        logfiles.  There's one Engine per process, see get().  Execute is the
+        usual way to use it:
+
+            engine = Engine.get()
+            proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            pump = engine.attach([('stdout', proc.stdout), ('stderr', proc.stderr)], logfile)
+            ... reap proc ...
+            engine.drain(pump, logfile)
+
+        The records are attributed to the directive which the calling thread
+        is executing, see Trace.
+    """
+
+    _engine = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get():
+        """ Return the Engine of this process, starting it if need be.  A
+            forked child, like the GRS daemon, gets its own.
+        """
+        with Engine._lock:
+            if Engine._engine is None or Engine._engine.pid != os.getpid():
+                Engine._engine = Engine()
+            return Engine._engine
+
+
+    @staticmethod
+    def context():
+        """ The (line number, directive) of the calling thread, or None. """
+        record = Trace.context()
+        if record is None:
+            return None
+        return (record['line'], record['directive'])
+
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.sinks = {}
+        self.options = {}
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        # Don't lose buffered output when we exit, eg. on SIGTERM.
+        atexit.register(self.flush)
+
+
+    def call(self, func, *args):
+        """ Run func(*args) in the Engine's thread and return its result. """
+        future = concurrent.futures.Future()
+        def run():
+            try:
+                future.set_result(func(*args))
+            except Exception as err:
+                future.set_exception(err)
+        self.loop.call_soon_threadsafe(run)
+        return future.result()
+
+
+    def configure(self, path, **options):
+        """ Set the options of the Sink for a logfile, see Sink. """
+        def configure():
+            self.options[path] = options
+            if path in self.sinks:
+                self.sinks[path].flush()
+                self.sinks[path].__dict__.update(options)
+        self.call(configure)
+
+
+    def sink(self, path):
+        """ The Sink for a logfile.  Only call this in the Engine's thread. """
+        if path not in self.sinks:
+            self.sinks[path] = Sink(path, self.loop, **self.options.get(path, {}))
+        return self.sinks[path]
+
+
+    def attach(self, pipes, logfile):
+        """ Start streaming a list of (stream, pipe) into logfile.  Returns a
+            future which is done when they have all been read to the end.
+        """
+        context = self.context()
+        async def pump():
+            sink = self.sink(logfile)
+            sink.reopen()
+            transports = []
+            waits = []
+            try:
+                for stream, pipe in pipes:
+                    done = self.loop.create_future()
+                    transport, _ = await self.loop.connect_read_pipe(
+                        lambda: LineProtocol(sink, stream, context, done), pipe
+                    )
+                    transports.append(transport)
+                    waits.append(done)
+                await asyncio.gather(*waits)
+            finally:
+                for transport in transports:
+                    transport.close()
+        return asyncio.run_coroutine_threadsafe(pump(), self.loop)
+
+
+    def drain(self, pump, logfile, timeout=5):
+        """ Wait for what's left in the pipes after the child has exited, then
+            flush the logfile.  If a grandchild still holds the pipes open, eg.
+            some daemon the command started, we stop reading after timeout.
+        """
+        try:
+            pump.result(timeout)
+        except concurrent.futures.TimeoutError:
+            pump.cancel()
+        except concurrent.futures.CancelledError:
+            pass
+        self.flush(logfile)
+
+
+    def emit(self, logfile, stream, text, stamped=False):
+        """ Write text to a logfile, in order with the output of children. """
+        context = self.context()
+        def emit():
+            sink = self.sink(logfile)
+            sink.reopen()
+            sink.emit(stream, text, context, time.monotonic(), stamped)
+        self.call(emit)
+
+
+    def flush(self, logfile=None):
+        """ Flush a logfile, or all of them. """
+        def flush():
+            for path in [logfile] if logfile else list(self.sinks):
+                if path in self.sinks:
+                    self.sinks[path].flush()
+        if self.pid == os.getpid() and self.loop.is_running():
+            self.call(flush)
@@ -21,61 +21,162 @@ import signal
 import shlex
 import subprocess
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from grs.Constants import CONST
+from grs.Engine import Engine
+from grs.Trace import Trace
 
 class Execute():
     """ Execute a shell command """
 
     def __init__(
-            self, cmd, timeout=1, extra_env={}, failok=False, shell=False, logfile=CONST.LOGFILE
+            self, cmd, timeout=1, extra_env={}, failok=False, shell=False, logfile=CONST.LOGFILE,
+            cwd=None
     ):
         """ Execute a shell command.
 
             cmd         - Simple string of the command to be execute as a
-                          fork()-ed child.
+                          fork()-ed child, or a list of its arguments.
             timeout     - The time in seconds to wait() on the child before
                           sending a SIGTERM.  timeout = None means wait indefinitely.
             extra_env   - Dictionary of extra environment variables for the fork()-ed
                           child.  Note that the child inherits all the env variables
                           of the grandparent shell in which grsrun/grsup was spawned.
             logfile     - A file to log output to.  If logfile = None, then we log
-                          to sys.stdout.
+                          to sys.stdout.  Each line of output is stamped with the
+                          monotonic time and the line number of the directive which
+                          ran the command, eg.
+
+                              [8123.402611 05] >>> Emerging (1 of 312) ...
+
+                          This goes through the Engine, so the output of commands
+                          running in parallel doesn't get mixed up.
+            cwd         - The directory to run the command in.  Use this rather than
+                          os.chdir() since directives may run in parallel threads.
+
+            After the command is done, self.returncode holds its exit code,
+            or None if it timed out.  This is only useful with failok=True.
         """
-        if shell:
+        if isinstance(cmd, list):
+            args = cmd
+            cmd = ' '.join(shlex.quote(arg) for arg in args)
+        elif shell:
             args = cmd
         else:
             args = shlex.split(cmd)
-        extra_env = dict(os.environ, **extra_env)
+        # Only copy our environment if we have to add to it.
+        env = None
+        if extra_env:
+            env = dict(os.environ, **extra_env)
 
         if logfile:
-            _file = open(logfile, 'a')
-            proc = subprocess.Popen(args, stdout=_file, stderr=_file, env=extra_env, shell=shell)
+            engine = Engine.get()
+            proc = subprocess.Popen(
+                args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, shell=shell, cwd=cwd
+            )
+            pump = engine.attach([('stdout', proc.stdout), ('stderr', proc.stderr)], logfile)
+            def report(msg):
+                engine.emit(logfile, 'grs', msg)
         else:
-            _file = sys.stderr
-            proc = subprocess.Popen(args, env=extra_env, shell=shell)
+            proc = subprocess.Popen(args, env=env, shell=shell, cwd=cwd)
+            report = sys.stderr.write
 
-        try:
-            proc.wait(timeout)
-            timed_out = False
-        except subprocess.TimeoutExpired:
-            proc.kill()
-            timed_out = True
+        # Reap the child through Trace so its rusage is accounted to the
+        # directive we're running.  A timer kills it if it runs too long.
+        # Only wait4() may reap it, so we don't use proc.kill(), which polls,
+        # and we wait for it to exit without reaping it first.  Until it's
+        # reaped, its pid can't be reused, so the timer can't kill anyone else.
+        expired = threading.Event()
+        exited = threading.Event()
+        lock = threading.Lock()
+        def expire():
+            with lock:
+                if exited.is_set():
+                    return
+                expired.set()
+                os.kill(proc.pid, signal.SIGKILL)
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, expire)
+            timer.daemon = True
+            timer.start()
+            os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+            with lock:
+                exited.set()
+            timer.cancel()
+        _rc = Trace.wait(proc)
+        timed_out = expired.is_set()
+        if logfile:
+            engine.drain(pump, logfile)
 
-        if not timed_out:
+        if timed_out:
             # _rc = None if we had a timeout
-            _rc = proc.returncode
-            if _rc != 0:
-                _file.write('EXIT CODE: %d\n' % _rc)
+            _rc = None
+            report('TIMEOUT ERROR: %s\n' % cmd)
+        elif _rc != 0:
+            report('EXIT CODE: %d\n' % _rc)
 
-        if timed_out:
-            _file.write('TIMEOUT ERROR: %s\n' % cmd)
+        self.returncode = _rc
 
         if not failok and (_rc != 0 or timed_out):
             pid = os.getpid()
-            _file.write('SENDING SIGTERM: %s\n' % pid)
-            _file.close()
+            Trace.fail()
+            report('SENDING SIGTERM: %s\n' % pid)
+            if logfile:
+                engine.flush(logfile)
             os.kill(pid, signal.SIGTERM)
 
-        # Only close a logfile, don't close sys.stderr!
-        if logfile:
-            _file.close()
+
+class ExecuteBatch():
+    """ Execute many commands, a bounded number at a time. """
+
+    def __init__(
+            self, cmds, jobs=0, timeout=60, extra_env={}, failok=False, logfile=CONST.LOGFILE,
+            cwd=None
+    ):
+        """ Execute a batch of commands, each as with Execute.
+
+            cmds        - A list of commands, each a list of its arguments, or a
+                          simple string as for Execute.
+            jobs        - The most to run at once.  jobs <= 0 means one per cpu
+                          we may run on.
+            timeout     - The time in seconds to wait on each command.
+
+            timeout, extra_env, logfile and cwd apply to each command.  Rather
+            than SIGTERMing on the first failure, all the commands are run, and
+            then any failures are reported together before the SIGTERM, unless
+            failok=True.
+
+            After the batch is done, self.returncodes holds the exit code of
+            each command, or None if it timed out, and self.failed lists the
+            (cmd, returncode) of those which failed.
+        """
+        if jobs <= 0:
+            jobs = len(os.sched_getaffinity(0))
+
+        # The commands are accounted to the directive of the calling thread.
+        record = Trace.context()
+        def run(cmd):
+            Trace.adopt(record)
+            return Execute(cmd, timeout, extra_env, True, False, logfile, cwd).returncode
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            self.returncodes = list(pool.map(run, cmds))
+        self.failed = [(c, rc) for c, rc in zip(cmds, self.returncodes) if rc != 0]
+
+        if self.failed and not failok:
+            pid = os.getpid()
+            msg = 'BATCH FAILED: %d of %d commands\n' % (len(self.failed), len(cmds))
+            for cmd, _rc in self.failed:
+                if isinstance(cmd, list):
+                    cmd = ' '.join(shlex.quote(arg) for arg in cmd)
+                msg += '    %s: %s\n' % ('TIMEOUT' if _rc is None else 'EXIT CODE %d' % _rc, cmd)
+            msg += 'SENDING SIGTERM: %s\n' % pid
+            if logfile:
+                Engine.get().emit(logfile, 'grs', msg)
+                Engine.get().flush(logfile)
+            else:
+                sys.stderr.write(msg)
+            Trace.fail()
+            os.kill(pid, signal.SIGTERM)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+#
+#    FileLock.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import fcntl
+import os
+
+class FileLock():
+    """ An exclusive lock on a lockfile, used to serialize work on something
+        shared between GRS systems, eg. a git mirror.  Use as
+
+            with FileLock('/path/to/something.lock'):
+                ... do the work ...
+
+        The lock is released when the process holding it dies, so a stale
+        lockfile can't block anyone.
+    """
+
+    def __init__(self, lockfile):
+        self.lockfile = lockfile
+        self._file = None
+
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.lockfile), mode=0o755, exist_ok=True)
+        self._file = open(self.lockfile, 'a')
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+
+    def __exit__(self, *args):
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
@@ -16,8 +16,15 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import os
+import shlex
+import signal
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from grs.Engine import Engine
 from grs.Execute import Execute
+from grs.Trace import Trace
 
 class HashIt():
     """ Create a DIGEST file for certain tarballs, or ISOs.  This class must
@@ -25,35 +32,140 @@ class HashIt():
         else we'll get an AttributeError exception.
     """
 
+    # The hashes in the order they appear in the DIGESTS file.  Each entry is
+    # the header, the hashlib name and a command to fall back on if hashlib
+    # can't provide the hash.  Whirlpool is only available in hashlib if
+    # openssl's legacy provider is loaded.
+    digests = [
+        ('MD5', 'md5', None),
+        ('SHA1', 'sha1', None),
+        ('SHA512', 'sha512', None),
+        ('WHIRLPOOL', 'whirlpool', 'whirlpooldeep -b')
+    ]
+
+    # Read the medium in 16 MB chunks, a multiple of the page size.
+    chunk_size = 16*1024*1024
+
+
+    @staticmethod
+    def fill(_in, view):
+        """ Read from _in until view is full or we hit EOF.  Reads from a pipe
+            return at most a pipe buffer at a time, so keep going.
+        """
+        total = 0
+        while total < len(view):
+            nbytes = _in.readinto(view[total:])
+            if not nbytes:
+                break
+            total += nbytes
+        return total
+
+
+    @staticmethod
+    def digest_stream(_in, algorithms, _outs=(), chunk_size=chunk_size):
+        """ Read the unbuffered stream _in to its end and feed every chunk to
+            all the hashlib algorithms.  Every chunk is also written to each of
+            the files in _outs.  Each algorithm, and writer, gets its own thread
+            since hashlib and file writes release the GIL, and we read the next
+            chunk into a second buffer while the current one is being consumed.
+            Returns a dictionary of algorithm : hexdigest.
+        """
+        hashers = [hashlib.new(algorithm) for algorithm in algorithms]
+        consumers = [hasher.update for hasher in hashers]
+        consumers.extend([_out.write for _out in _outs])
+        buffers = [bytearray(chunk_size), bytearray(chunk_size)]
+        with ThreadPoolExecutor(max_workers=len(consumers)) as pool:
+            pending = []
+            index = 0
+            while True:
+                view = memoryview(buffers[index])
+                nbytes = HashIt.fill(_in, view)
+                # Only then wait on the consumers working on the other buffer.
+                for future in pending:
+                    future.result()
+                if not nbytes:
+                    break
+                chunk = view[:nbytes]
+                pending = [pool.submit(consumer, chunk) for consumer in consumers]
+                index ^= 1
+        return dict(zip(algorithms, [hasher.hexdigest() for hasher in hashers]))
+
+
+    @staticmethod
+    def multidigest(medium_path, algorithms):
+        """ Read medium_path once and return a dictionary of algorithm : hexdigest. """
+        with open(medium_path, 'rb', buffering=0) as _file:
+            os.posix_fadvise(_file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            return HashIt.digest_stream(_file, algorithms)
+
+
+    def algorithms(self):
+        """ The hashes in self.digests[] which hashlib can compute. """
+        return [d[1] for d in self.digests if d[1] in hashlib.algorithms_available]
+
+
+    def hashed_write(self, cmd, medium_path, cwd=None, shell=False):
+        """ Run cmd which writes the medium to its stdout, and tee the stream
+            into medium_path while computing its digests.  hashit() then just
+            writes out the DIGESTS file without reading the medium back.  As
+            with Execute, stderr goes to the logfile and a failure SIGTERMs us.
+        """
+        if shell:
+            args = cmd
+        else:
+            args = shlex.split(cmd)
+        engine = Engine.get()
+        with open(medium_path, 'wb') as _file:
+            proc = subprocess.Popen(
+                args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, shell=shell, bufsize=0
+            )
+            pump = engine.attach([('stderr', proc.stderr)], self.logfile)
+            hexdigests = self.digest_stream(proc.stdout, self.algorithms(), [_file])
+            proc.stdout.close()
+            _rc = Trace.wait(proc)
+            engine.drain(pump, self.logfile)
+            if _rc != 0:
+                pid = os.getpid()
+                engine.emit(self.logfile, 'grs', 'EXIT CODE: %d\nSENDING SIGTERM: %s' % (_rc, pid))
+                engine.flush(self.logfile)
+                Trace.fail()
+                os.kill(pid, signal.SIGTERM)
+                return
+        # Remember which medium these digests belong to, since medium_name
+        # can change with the next tarit/isoit/netbootit.
+        self.hexdigests = (os.path.basename(medium_path), hexdigests)
+
+
     def hashit(self):
-        """ Generate various hash values.  We hijack the 'logfile' which will
-            actually be the file containing the hashes.
+        """ Generate various hash values.  If the medium was produced through
+            hashed_write(), we already have them.  Otherwise the medium is read
+            only once and all the hashes are computed in process.  The DIGESTS file has the
+            same format as the output of md5sum and friends, ie
+
+                # MD5 HASH
+                <hash>  <medium_name>
+                ...
         """
-        # We need to be in the parent of the system's portage configroot because
+        # The medium is in the parent of the system's portage configroot because
         # that's where we created the above tarball.  This should be the workdir,
         # but its probably safer to be pedantic here.
-        cwd = os.getcwd()
-        os.chdir(os.path.join(self.portage_configroot, '..'))
-
-        # Note: this first cmd clobbers the contents
-        cmd = 'echo "# MD5 HASH"'
-        Execute(cmd, logfile=self.digest_name)
-        cmd = 'md5sum %s' % self.medium_name
-        Execute(cmd, timeout=60, logfile=self.digest_name)
-
-        cmd = 'echo "# SHA1 HASH"'
-        Execute(cmd, logfile=self.digest_name)
-        cmd = 'sha1sum %s' % self.medium_name
-        Execute(cmd, timeout=60, logfile=self.digest_name)
-
-        cmd = 'echo "# SHA512 HASH"'
-        Execute(cmd, logfile=self.digest_name)
-        cmd = 'sha512sum %s' % self.medium_name
-        Execute(cmd, timeout=60, logfile=self.digest_name)
-
-        cmd = 'echo "# WHIRLPOOL HASH"'
-        Execute(cmd, logfile=self.digest_name)
-        cmd = 'whirlpooldeep %s' % self.medium_name
-        Execute(cmd, timeout=60, logfile=self.digest_name)
-
-        os.chdir(cwd)
+        medium_dir = os.path.join(self.portage_configroot, '..')
+        medium_path = os.path.join(medium_dir, self.medium_name)
+        digest_path = os.path.join(medium_dir, self.digest_name)
+
+        precomputed = getattr(self, 'hexdigests', None)
+        if precomputed and precomputed[0] == self.medium_name:
+            hexdigests = precomputed[1]
+        else:
+            hexdigests = self.multidigest(medium_path, self.algorithms())
+
+        # Note: this first open clobbers the contents
+        open(digest_path, 'w').close()
+        for header, algorithm, fallback in self.digests:
+            with open(digest_path, 'a') as _file:
+                _file.write('# %s HASH\n' % header)
+                if algorithm in hexdigests:
+                    _file.write('%s  %s\n' % (hexdigests[algorithm], self.medium_name))
+            if not algorithm in hexdigests:
+                cmd = '%s %s' % (fallback, medium_path)
+                Execute(cmd, timeout=None, logfile=digest_path)
@@ -32,12 +32,14 @@ class ISOIt(HashIt):
             libdir=CONST.LIBDIR,
             tmpdir=CONST.TMPDIR,
             portage_configroot=CONST.PORTAGE_CONFIGROOT,
-            logfile=CONST.LOGFILE
+            logfile=CONST.LOGFILE,
+            hash_inline=False
     ):
         self.libdir = libdir
         self.tmpdir = tmpdir
         self.portage_configroot = portage_configroot
         self.logfile = logfile
+        self.hash_inline = hash_inline
         # Prepare a year, month and day for a ISO name timestamp.
         self.year = str(datetime.now().year).zfill(4)
         self.month = str(datetime.now().month).zfill(2)
@@ -103,12 +105,9 @@ class ISOIt(HashIt):
 
         # cpio-gzip the initramfs root to the iso boot dir
         initramfs_path = os.path.join(isoboot_dir, 'initramfs')
-        cwd = os.getcwd()
-        os.chdir(initramfs_root)
         cmd = 'find . -print | cpio -H newc -o | gzip -9 > %s' % initramfs_path
         # Piped commands must be run in a shell.
-        Execute(cmd, timeout=600, logfile=self.logfile, shell=True)
-        os.chdir(cwd)
+        Execute(cmd, timeout=600, logfile=self.logfile, shell=True, cwd=initramfs_root)
 
 
     def isoit(self, alt_name=None):
@@ -156,5 +155,10 @@ class ISOIt(HashIt):
         args += '-boot-load-size 4 '            # 4x512-bit sectors for no-emulation mode
         args += '-boot-info-table '             # Create El Torito boot info table
         medium_path = os.path.join(self.tmpdir, self.medium_name)
-        cmd = 'mkisofs %s -o %s %s' % (args, medium_path, iso_dir)
-        Execute(cmd, timeout=None, logfile=self.logfile)
+        if self.hash_inline:
+            # Without -o, mkisofs writes the image to stdout.
+            cmd = 'mkisofs %s %s' % (args, iso_dir)
+            self.hashed_write(cmd, medium_path)
+        else:
+            cmd = 'mkisofs %s -o %s %s' % (args, medium_path, iso_dir)
+            Execute(cmd, timeout=None, logfile=self.logfile)
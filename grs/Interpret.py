@@ -17,23 +17,30 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import re
 import signal
 import sys
 
+from grs.BuildScript import BuildScript
+from grs.CCache import CCache
+from grs.Cgroup import Cgroup
+from grs.Compression import Compression
 from grs.Constants import CONST
 from grs.Daemon import Daemon
 from grs.ISOIt import ISOIt
+from grs.Journal import Journal
 from grs.Log import Log
 from grs.Kernel import Kernel
 from grs.MountDirectories import MountDirectories
 from grs.Netboot import Netboot
 from grs.PivotChroot import PivotChroot
+from grs.RootCache import RootCache
 from grs.Populate import Populate
 from grs.RunScript import RunScript
+from grs.Scheduler import Scheduler
 from grs.Synchronize import Synchronize
 from grs.Seed import Seed
 from grs.TarIt import TarIt
+from grs.Trace import Trace
 
 
 class Interpret(Daemon):
@@ -48,62 +55,131 @@ class Interpret(Daemon):
 
         # First we set up some inner methods:
         def handler(signum, frame):
-            """ On SIGTERM, propagate the signal to all processes in the cgroup/subcgroup
-                except yourself.  If a process won't terminate nicely, then kill it.
-                Finally unmount all the mounted filesystems.  Hopefully this will work
-                since there should be no more open files on those filesystems.
+            """ On SIGTERM, kill all processes in the cgroup/subcgroup except
+                yourself.  Finally unmount all the mounted filesystems.  Hopefully
+                this will work since there should be no more open files on those
+                filesystems.
             """
-            mypid = os.getpid()
-            while True:
-                with open(os.path.join(self.subcgroupdir, 'tasks'), 'r') as _file:
-                    lines = _file.readlines()
-                    if len(lines) <= 1:
-                        break
-                    for _pid in lines:
-                        pid = int(_pid.strip())
-                        if mypid == pid:
-                            continue
-                        try:
-                            os.kill(pid, signal.SIGKILL)
-                        except ProcessLookupError:
-                            pass
+            # Journal whatever other directives finished before we go down.
             try:
-                _md.umount_all()
+                _sc.drain(lambda _dir: _jo.record(keys[_dir.line_number], _dir))
+            except NameError:
+                pass
+            Cgroup(self.subcgroupdir).kill()
+            try:
+                _tr.abort(signum)
+            except NameError:
+                pass
+            try:
+                _md.teardown()
             except NameError:
                 pass
             sys.exit(signum + 128)
 
 
-        def semantic_action(_line, objs, nargs, func, *args):
+        def semantic_action(_line, func, *args):
             """ Execute the directive """
             err = None
-            if len(objs) == nargs:
-                if self.mock_run:
-                    _lo.log(_line)
-                    return
-                # We'll catch this exception to get in into the
-                # GRS system log rather than the daemon log.  Without
-                # the try-except, it would wind up in the daemon log.
-                try:
-                    func(*args)
-                except Exception as excpt:
-                    err = excpt
-            else:
-                err = 'Number of parameters incorrect.'
+            # We'll catch this exception to get in into the
+            # GRS system log rather than the daemon log.  Without
+            # the try-except, it would wind up in the daemon log.
+            try:
+                func(*args)
+            except Exception as excpt:
+                err = excpt
 
             if err:
                 pid = os.getpid()
                 _lo.log('Bad command:   %s' % _line)
                 _lo.log('Error message: %s' % err)
                 _lo.log('SENDING SIGTERM to %d' % pid)
+                Trace.fail()
                 os.kill(pid, signal.SIGTERM)
 
 
-        def stampit(progress):
-            """ Create an empty file to mark the progress through the
+        def execute(_dir):
+            """ This is where the semantics of the build script are implemented.
+                The BuildScript has already checked the verbs and their objects.
+            """
+            objs = _dir.objs
+            if _dir.verb == 'log':
+                if objs[0] == 'stamp':
+                    objs = ['='*80]
+                semantic_action(_dir.line, _lo.log, ' '.join(objs))
+            elif _dir.verb == 'mount':
+                semantic_action(_dir.line, _md.mount_all)
+            elif _dir.verb == 'unmount':
+                semantic_action(_dir.line, _md.umount_all)
+            elif _dir.verb == 'populate':
+                semantic_action(_dir.line, _po.populate, int(objs[0]))
+            elif _dir.verb == 'runscript':
+                semantic_action(_dir.line, _ru.runscript, objs[0])
+            elif _dir.verb == 'pivot':
+                semantic_action(_dir.line, _pc.pivot, objs[0], _md)
+            elif _dir.verb == 'kernel':
+                semantic_action(_dir.line, _ke.kernel, objs[0])
+            elif _dir.verb == 'tarit':
+                semantic_action(_dir.line, _bi.tarit, *objs)
+            elif _dir.verb == 'isoit':
+                semantic_action(_dir.line, _io.isoit, *objs)
+            elif _dir.verb == 'netbootit':
+                semantic_action(_dir.line, _nb.netbootit, *objs)
+            elif _dir.verb == 'hashit':
+                media = {'tarit' : _bi, 'isoit' : _io, 'netbootit' : _nb}
+                semantic_action(_dir.line, media[_dir.medium].hashit)
+
+
+        def traced(_dir):
+            """ Execute the directive, keeping a performance record of it.
+                Return whether it succeeded.
+            """
+            _tr.begin(_dir)
+            execute(_dir)
+            failed = Trace.failed()
+            _tr.end()
+            return not failed
+
+
+        def done(_dir):
+            """ Whether the journal says the directive is done. """
+            return _jo.done(keys[_dir.line_number])
+
+
+        def finished(_dir):
+            """ Journal that the directive is done.  If the root is now just
+                the product of the leading directives, snapshot it.
+            """
+            _jo.record(keys[_dir.line_number], _dir)
+            if _dir not in snapshots or _md.are_mounted()[0]:
+                return
+            if all(done(_prior) for _prior in directives[:directives.index(_dir)]):
+                if not _rc.has(keys[_dir.line_number]) and _rc.worthwhile():
+                    _lo.log('Snapshotting root after %s' % _dir)
+                    semantic_action(_dir.line, _rc.save, keys[_dir.line_number])
+
+
+        def pending(_dir):
+            """ Whether this run has to execute the directive.  For a release
+                run, execute every line of the build script that isn't already
+                done with the same inputs.  For an update run, execute only lines
+                with a leading +.
+            """
+            if self.update_run:
+                return _dir.update
+            return not done(_dir)
+
+
+        def enabled(value):
+            """ Interpret a yes/no value from systems.conf. """
+            return value.lower() in ['yes', 'true', 'on', '1']
+
+
+        def stampit(progress, content=''):
+            """ Create a file, usually empty, to mark the progress through the
                 build script.
             """
-            open(progress, 'w').close()
+            with open(progress, 'w') as _file:
+                _file.write(content)
 
 
         # Register the signals to terminate the entire process cgroup
@@ -123,29 +199,76 @@ class Interpret(Daemon):
         distfiles = CONST.distfiless[self.run_number]
         kernelroot = CONST.kernelroots[self.run_number]
         portage_configroot = CONST.portage_configroots[self.run_number]
+        stagedir = CONST.stagedirs[self.run_number]
+        seedcache = CONST.seedcaches[self.run_number]
+        gitcache = CONST.gitcaches[self.run_number]
+        repo_depth = CONST.repo_depths[self.run_number]
+        hash_inline = enabled(CONST.hash_inlines[self.run_number])
+        parallel_directives = CONST.parallel_directivess[self.run_number]
+        rootcache = CONST.rootcaches[self.run_number]
+        kernelcache = CONST.kernelcaches[self.run_number]
+        ccache_dir = CONST.ccache_dirs[self.run_number]
+        log_compression = CONST.log_compressions[self.run_number]
+        if log_compression in ['', 'none', 'no']:
+            log_compression = None
+        compression = Compression(
+            CONST.compressions[self.run_number],
+            CONST.compression_levels[self.run_number],
+            CONST.compression_threadss[self.run_number]
+        )
+
+        # If asked, run in our own mount namespace, so we don't have to clean
+        # up our mounts and don't contend with other systems for the host's
+        # mount table.  This has to be done before the Log starts any threads.
+        extra_mounts = MountDirectories.parse(
+            CONST.bind_mountss[self.run_number],
+            CONST.tmpfs_mountss[self.run_number],
+            ccache_dir
+        )
+        _md = MountDirectories(portage_configroot, package, portage, distfiles, logfile, extra_mounts)
+
+        # Unmount any existing bind mounts from a previous run that were not
+        # cleaned up.  They're the host's, so this has to be done before we
+        # unshare, since our own unmounts wouldn't propagate back.
+        _md.umount_all()
+        mount_namespace = enabled(CONST.mount_namespaces[self.run_number])
+        if mount_namespace:
+            _md.unshare()
 
         # Initialize all the classes that will run the directives from
         # the build script.  Note that we expect these classes to just
         # initialize some variables but not do any work in their initializers.
-        _lo = Log(logfile)
-        _sy = Synchronize(repo_uri, name, libdir, logfile)
-        _se = Seed(stage_uri, tmpdir, portage_configroot, package, logfile)
-        _md = MountDirectories(portage_configroot, package, portage, distfiles, logfile)
+        _lo = Log(
+            logfile, name,
+            CONST.log_formats[self.run_number] == 'json',
+            CONST.log_syncs[self.run_number],
+            Log.size(CONST.log_max_sizes[self.run_number]),
+            log_compression,
+            int(CONST.log_keeps[self.run_number]),
+            Log.size(CONST.log_budgets[self.run_number])
+        )
+        _sy = Synchronize(repo_uri, name, libdir, logfile, gitcache, repo_depth)
+        _se = Seed(stage_uri, tmpdir, portage_configroot, package, logfile, seedcache, stagedir)
         _po = Populate(libdir, workdir, portage_configroot, logfile)
-        _ru = RunScript(libdir, portage_configroot, logfile)
+        _cc = CCache(ccache_dir, logfile)
+        _ru = RunScript(libdir, portage_configroot, logfile, _cc.env())
         _pc = PivotChroot(tmpdir, portage_configroot, logfile)
-        _ke = Kernel(libdir, portage_configroot, kernelroot, package, logfile)
-        _bi = TarIt(name, portage_configroot, logfile)
-        _io = ISOIt(name, libdir, tmpdir, portage_configroot, logfile)
-        _nb = Netboot(name, libdir, tmpdir, portage_configroot, kernelroot, logfile)
+        _ke = Kernel(libdir, portage_configroot, kernelroot, package, logfile, compression, kernelcache)
+        _bi = TarIt(name, portage_configroot, logfile, hash_inline, compression)
+        _io = ISOIt(name, libdir, tmpdir, portage_configroot, logfile, hash_inline)
+        _nb = Netboot(name, libdir, tmpdir, portage_configroot, kernelroot, logfile, hash_inline)
+        _rc = RootCache(
+            rootcache, portage_configroot, package, logfile,
+            enabled(CONST.rootcache_copys[self.run_number]), CONST.rootcache_keeps[self.run_number]
+        )
 
         # Just in case /var/tmp/grs doesn't already exist.
         os.makedirs(tmpdir, mode=0o755, exist_ok=True)
 
-        # Rotate any prevously existing logs and make unmount any existing
-        # bind mounts from a previous run that were not cleaned up.
+        # Rotate any prevously existing logs.
         _lo.rotate_logs()
-        _md.umount_all()
+        if mount_namespace and not _md.private:
+            _lo.log('Could not unshare our mount namespace, using the host\'s')
 
         # Both sync() + seed() do not need build script directives.
         # sync() is done unconditionally for an update run.
@@ -155,126 +278,113 @@ class Interpret(Daemon):
                 _lo.log('sync')
             else:
                 _sy.sync()
-            stampit(progress)
+                stampit(progress)
+
+        # Compile the whole build script before doing any real work, so
+        # that a bad script fails now rather than hours into the run.
+        _bs = BuildScript(libdir)
+        directives = _bs.compile()
+        if _bs.errors:
+            pid = os.getpid()
+            for err in _bs.errors:
+                _lo.log('Bad build script: %s' % err)
+            _lo.log('SENDING SIGTERM to %d' % pid)
+            os.kill(pid, signal.SIGTERM)
 
-        # seed() is never done for an update run
-        progress = os.path.join(tmpdir, '.completed_seed')
-        if not os.path.exists(progress) and not self.update_run:
+        # If the root was wiped, it has to be seeded again.
+        seed_progress = os.path.join(tmpdir, '.completed_seed')
+        if not os.path.isdir(portage_configroot) and os.path.exists(seed_progress):
+            os.unlink(seed_progress)
+
+        # The stage in our root is the one recorded when we seeded it, else
+        # it's the one we'll seed from now.  Roots seeded before we recorded
+        # it are taken to be from the stage_uri, as they were then.  A mock
+        # run has nothing to seed, so it needn't fetch or hash anything.
+        if os.path.exists(seed_progress):
+            with open(seed_progress, 'r') as _file:
+                stage = _file.read().strip() or stage_uri
+        elif self.mock_run:
+            stage = stage_uri
+        else:
+            stage = _se.identity()
+
+        # Key each directive by the content of it, its inputs, what it
+        # depends on and the stage we seed from.
+        _jo = Journal(os.path.join(tmpdir, '.journal'), libdir, stage)
+        dependencies = Scheduler(directives).dependencies
+        keys = dict(zip([_dir.line_number for _dir in directives], _jo.keys(directives, dependencies)))
+
+        # Carry over the progress stamps of older versions, which only mean
+        # anything if the root they were for is still there.
+        if os.path.exists(seed_progress):
+            _jo.migrate(tmpdir, directives, keys, not self.mock_run)
+        elif not self.mock_run:
+            _jo.migrate(tmpdir, [], keys)
+
+        # With a rootcache, we can snapshot the root after each of the leading
+        # directives which change only it, and on a release run, skip ahead to
+        # the deepest of these for which some system already has a snapshot.
+        # That's only worth it if it takes us past where we are, and only safe
+        # if nothing after it is already done in our own root.
+        snapshots = []
+        restored = set()
+        if rootcache and not self.update_run:
+            snapshots = [_dir for _dir in RootCache.prefix(directives) if Scheduler.accesses[_dir.verb][1]]
+            cached = [_dir for _dir in snapshots if _rc.has(keys[_dir.line_number])]
+            if cached:
+                deepest = directives.index(cached[-1])
+                behind = not os.path.exists(seed_progress) or \
+                    not all(done(_dir) for _dir in directives[:deepest+1])
+                ahead = any(done(_dir) for _dir in directives[deepest+1:])
+                if behind and not ahead:
+                    restored = set(_dir.line_number for _dir in directives[:deepest+1])
+                    _lo.log('Restoring root snapshot %s after %s' % (keys[cached[-1].line_number], cached[-1]))
+                    if not self.mock_run:
+                        # The old root is gone, and with it what the journal says.
+                        _rc.restore(keys[cached[-1].line_number])
+                        _jo.reset()
+                        for _dir in directives[:deepest+1]:
+                            _jo.record(keys[_dir.line_number], _dir)
+                        stampit(seed_progress, stage)
+
+        # seed() is never done for an update run.  A fresh root has none of
+        # the directives done, whatever the journal says.
+        if not os.path.exists(seed_progress) and not self.update_run and not restored:
             if self.mock_run:
                 _lo.log('seed')
             else:
                 _se.seed()
-            stampit(progress)
-
-        # Read the build script and execute a line at a time.
-        build_script = os.path.join(libdir, 'build')
-        with open(build_script, 'r') as _file:
-            line_number = 0
-            medium_type = None
-            for _line in _file.readlines():
-                # Get rid of whitespace padding immediately
-                _line = _line.strip()
-
-                # Increment the line number by one and create the name of the
-                # file for the progress stamp.
-                line_number += 1
-                progress = os.path.join(tmpdir, '.completed_%02d' % line_number)
-
-                # Do nothing for lines with initial # or blank lines.  Create
-                # a progress stamp only if we are not doing an update run.
-                if re.search(r'^(#).*$', _line) or _line == '' or _line == '+':
-                    if not self.update_run:
-                        stampit(progress)
-                    continue
-
-                # For a release run, execute every line of the build script.
-                # For an update run, exexute only lines with a leading +.
-                ignore_stamp = False
-                _match = re.search(r'^(\+)(.*)$', _line)
-                if _match:
-                    # There is a leading +, so remove it and ignore any progress
-                    # stamp if its an update run.
-                    ignore_stamp = self.update_run
-                    _line = _match.group(2)
-                else:
-                    # There is no leading +, so skip if this is an update run
-                    if self.update_run:
-                        continue
-
-                # Skip a line if the progres stamp exists, or ignore it
-                # because its an update run.
-                if os.path.exists(progress) and not ignore_stamp:
-                    continue
-
-                # This is pretty simple syntax.  The first word on a line
-                # is a verb.  The remaining words are objcts.
-                sentence = _line.split()
-                verb = sentence[0]
-                objs = sentence[1:]
-
-                # This long concatenated if is where the semantics of the
-                # build script are implemented.  Note: 'hashit' can only come
-                # after 'tarit' or 'isoit' so that it knows the medium_name
-                # to hash, ie whether its a .tar.xz or a .iso
-                if verb == 'log':
-                    if objs[0] == 'stamp':
-                        objs[0] = '='*80
-                    semantic_action(_line, objs, 1, _lo.log, ' '.join(objs))
-                elif verb == 'mount':
-                    semantic_action(_line, objs, 0, _md.mount_all)
-                elif verb == 'unmount':
-                    semantic_action(_line, objs, 0, _md.umount_all)
-                elif verb == 'populate':
-                    semantic_action(_line, objs, 1, _po.populate, int(objs[0]))
-                elif verb == 'runscript':
-                    semantic_action(_line, objs, 1, _ru.runscript, objs[0])
-                elif verb == 'pivot':
-                    semantic_action(_line, objs, 1, _pc.pivot, objs[0], _md)
-                elif verb == 'kernel':
-                    semantic_action(_line, objs, 1, _ke.kernel, objs[0])
-                elif verb == 'tarit':
-                    # 'tarit' can either be just a verb, or a 'verb obj' pair.
-                    if len(objs):
-                        semantic_action(_line, objs, 1, _bi.tarit, objs[0])
-                    else:
-                        semantic_action(_line, objs, 0, _bi.tarit)
-                    medium_type = 'tarit'
-                elif verb == 'isoit':
-                    # 'isoit' can either be just a verb, or a 'verb obj' pair.
-                    if len(objs):
-                        semantic_action(_line, objs, 1, _io.isoit, objs[0])
-                    else:
-                        semantic_action(_line, objs, 0, _io.isoit)
-                    medium_type = 'isoit'
-                elif verb == 'netbootit':
-                    # 'netbootit' can either be just a 'verb', 'verb obj' or 'verb obj obj'
-                    if len(objs) == 2:
-                        semantic_action(_line, objs, 2, _nb.netbootit, objs[0], objs[1])
-                    elif len(objs) == 1:
-                        semantic_action(_line, objs, 1, _nb.netbootit, objs[0])
-                    else:
-                        semantic_action(_line, objs, 0, _nb.netbootit)
-                    medium_type = 'netbootit'
-                elif verb == 'hashit':
-                    if medium_type == 'tarit':
-                        semantic_action(_line, objs, 0, _bi.hashit)
-                    elif medium_type == 'isoit':
-                        semantic_action(_line, objs, 0, _io.hashit)
-                    elif medium_type == 'netbootit':
-                        semantic_action(_line, objs, 0, _nb.hashit)
-                    else:
-                        raise Exception('Unknown medium to hash.')
-                else:
-                    _lo.log('Bad command: %s' % _line)
-                    _lo.log('Unknown verb: %s' % verb)
-                    _lo.log('SENDING SIGTERM\n')
-                    os.kill(os.getpid(), signal.SIGTERM)
+                _jo.reset()
+                stampit(seed_progress, stage)
 
-                stampit(progress)
+        # Leave out the directives the journal says are done.
+        plan = [_dir for _dir in directives if pending(_dir) and _dir.line_number not in restored]
+
+        # For a mock run, just log the plan.
+        if self.mock_run:
+            for _dir in plan:
+                _lo.log(str(_dir))
+            return
+
+        # Execute the plan, running independent directives in parallel if
+        # we're allowed to, and journal our progress as each one finishes.
+        # Each directive's timing and resource usage goes to the tracefile.
+        _tr = Trace(os.path.join(tmpdir, 'trace.jsonl'))
+        _tr.rotate_traces(int(CONST.log_keeps[self.run_number]))
+        _sc = Scheduler(plan, parallel_directives)
+        _cc.begin()
+        _sc.run(traced, finished)
+        _cc.stats()
+
+        # Account for what the whole run used, from its cgroup.
+        usage = Cgroup(self.subcgroupdir).stats()
+        if usage:
+            _lo.log('Usage: %s' % ' '.join('%s=%d' % (k, usage[k]) for k in sorted(usage)))
+            _tr.totals(usage)
 
         # Just in case the build script lacks a final unmount, if we
         # are done, then let's make sure we clean up after ourselves.
         try:
-            _md.umount_all()
+            _md.teardown()
         except NameError:
             pass
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+#
+#    Journal.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import glob
+import hashlib
+import os
+import re
+import threading
+from grs.Constants import CONST
+from grs.Scheduler import Scheduler
+
+class Journal():
+    """ Record the progress through a build script by content rather than by
+        line number.  Each directive gets a key which hashes
+
+            1. the directive itself, less any leading + and its line number,
+            2. its inputs from the GRS repo, eg. the script for a runscript, the
+               core/ files selected for a populate cycle or the kernel config,
+            3. the keys of the earlier directives it depends on, leaving out
+               those which write nothing, like log, since they can't change
+               the outcome of anything that follows,
+            4. the stage the system is seeded from.
+
+        Because of 3, when a directive has to be redone, so has everything that
+        follows from it, but nothing else.  So editing a script under scripts/
+        reruns that runscript and what comes after it, while inserting a comment
+        or a log line into the build script reruns nothing at all.
+
+        The journal is a file with one line per completed directive:
+
+            <key> <line number> <directive>
+
+        Only the key matters; the rest is for us humans.
+    """
+
+    # The files under libdir which are inputs to each verb, besides the
+    # runscript's script and the populate's core/ tree.
+    scripts = {
+        'kernel'    : ['scripts/kernel-config', 'scripts/busybox-config', 'scripts/genkernel.conf'],
+        'isoit'     : ['scripts/busybox-config', 'scripts/initramfs-init', 'scripts/menu.lst'],
+        'netbootit' : ['scripts/init.netboot']
+    }
+
+    def __init__(self, journalfile, libdir=CONST.LIBDIR, seed=''):
+        self.journalfile = journalfile
+        self.libdir = libdir
+        self.seed = seed
+        # Reentrant, since the SIGTERM handler may record while our thread
+        # was already recording, see Scheduler.drain().
+        self.lock = threading.RLock()
+        self.completed = set()
+        if os.path.isfile(journalfile):
+            with open(journalfile, 'r') as _file:
+                for line in _file:
+                    if line.strip():
+                        self.completed.add(line.split()[0])
+
+
+    @staticmethod
+    def hash_file(_hash, path, name):
+        """ Feed the name, type and contents of a file into a hash.  Missing
+            files are hashed too, so that adding them changes the key.
+        """
+        _hash.update(name.encode() + b'\0')
+        if os.path.islink(path):
+            _hash.update(b'l' + os.readlink(path).encode() + b'\0')
+        elif os.path.isfile(path):
+            _hash.update(b'f%o\0' % (os.stat(path).st_mode & 0o7777))
+            with open(path, 'rb') as _file:
+                for chunk in iter(lambda: _file.read(1024*1024), b''):
+                    _hash.update(chunk)
+        else:
+            _hash.update(b'-\0')
+
+
+    def core_files(self, cycle):
+        """ The files under core/ which a populate of this cycle installs. """
+        core = os.path.join(self.libdir, 'core')
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(core):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.git'))
+            for _file in sorted(filenames):
+                if _file.startswith('.git'):
+                    continue
+                _match = re.search(r'\.CYCLE\.(\d+)', _file)
+                if _match and int(_match.group(1)) != cycle:
+                    continue
+                paths.append(os.path.join(dirpath, _file))
+        return paths
+
+
+    def inputs(self, _dir):
+        """ The files under libdir which are inputs to the directive. """
+        if _dir.verb == 'runscript':
+            return [os.path.join(self.libdir, 'scripts', _dir.objs[0])]
+        if _dir.verb == 'populate':
+            return self.core_files(int(_dir.objs[0]))
+        return [os.path.join(self.libdir, s) for s in self.scripts.get(_dir.verb, [])]
+
+
+    def keys(self, directives, dependencies):
+        """ Return the keys of a compiled build script, given the indices of
+            the directives each one depends on, see Scheduler.infer().
+        """
+        keys = []
+        seen = {}
+        for _dir, waits in zip(directives, dependencies):
+            _hash = hashlib.sha256(('%s\0' % self.seed).encode())
+            _hash.update(('%s %s\0' % (_dir.verb, ' '.join(_dir.objs))).encode())
+            for path in self.inputs(_dir):
+                self.hash_file(_hash, path, os.path.relpath(path, self.libdir))
+            for i in sorted(waits):
+                if Scheduler.accesses[directives[i].verb][1]:
+                    _hash.update(keys[i].encode())
+            key = _hash.hexdigest()
+            # Identical directives with identical dependencies, like two log
+            # lines in a row, are told apart by their occurrence.
+            seen[key] = seen.get(key, 0) + 1
+            if seen[key] > 1:
+                key = hashlib.sha256(('%s %d' % (key, seen[key])).encode()).hexdigest()
+            keys.append(key)
+        return keys
+
+
+    def done(self, key):
+        """ Whether the directive with this key has been completed. """
+        return key in self.completed
+
+
+    def reset(self):
+        """ Forget everything, eg. when the root is seeded afresh and so none
+            of the completed directives are in it any more.
+        """
+        with self.lock:
+            open(self.journalfile, 'w').close()
+            self.completed = set()
+
+
+    def migrate(self, stampdir, directives, keys, persist=True):
+        """ Older versions marked each completed directive with a stamp file,
+            stampdir/.completed_NN, where NN is its line number.  If we don't
+            have a journal yet, seed it from those, so a run in progress picks
+            up where it left off, and then remove the stamps.  If not persist,
+            eg. for a mock run, just take them into account and leave them be.
+        """
+        stamps = glob.glob(os.path.join(stampdir, '.completed_[0-9]*'))
+        if not stamps:
+            return
+        if not os.path.isfile(self.journalfile):
+            for _dir in directives:
+                if os.path.exists(os.path.join(stampdir, '.completed_%02d' % _dir.line_number)):
+                    if persist:
+                        self.record(keys[_dir.line_number], _dir)
+                    else:
+                        self.completed.add(keys[_dir.line_number])
+        if persist:
+            for stamp in stamps:
+                os.unlink(stamp)
+
+
+    def record(self, key, _dir):
+        """ Record that a directive has been completed.  This is safe to call
+            from parallel threads.
+        """
+        with self.lock:
+            with open(self.journalfile, 'a') as _file:
+                _file.write('%s %02d %s\n' % (key, _dir.line_number, _dir.line))
+                _file.flush()
+                os.fsync(_file.fileno())
+            self.completed.add(key)
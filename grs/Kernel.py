@@ -16,12 +16,16 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import os
 import re
 import shutil
 
+from grs.Cgroup import Cgroup
+from grs.Compression import Compression
 from grs.Constants import CONST
-from grs.Execute import Execute
+from grs.Execute import Execute, ExecuteBatch
+from grs.FileLock import FileLock
 
 
 class Kernel():
@@ -33,13 +37,17 @@ class Kernel():
             portage_configroot=CONST.PORTAGE_CONFIGROOT,
             kernelroot=CONST.KERNELROOT,
             package=CONST.PACKAGE,
-            logfile=CONST.LOGFILE
+            logfile=CONST.LOGFILE,
+            compression=None,
+            kernelcache=''
     ):
         self.libdir = libdir
         self.portage_configroot = portage_configroot
         self.kernelroot = kernelroot
         self.package = package
         self.logfile = logfile
+        self.compression = compression or Compression()
+        self.kernelcache = kernelcache
         self.kernel_config = os.path.join(self.libdir, 'scripts/kernel-config')
         self.busybox_config = os.path.join(self.libdir, 'scripts/busybox-config')
         self.genkernel_config = os.path.join(self.libdir, 'scripts/genkernel.conf')
@@ -80,46 +88,118 @@ class Kernel():
         return (gentoo_version, pkg_name, has_modules)
 
 
+    def key(self, pkg_name, arch, firmware_dir):
+        """ The key of a kernel build in the kernelcache: the sha256 of the
+            kernel, busybox and genkernel configs, the source package atom, the
+            arch, the tarball suffix and the firmware which genkernel copies in.
+        """
+        _hash = hashlib.sha256(('%s\0%s\0%s\0' % (pkg_name, arch, self.compression.suffix())).encode())
+        for path in [self.kernel_config, self.busybox_config, self.genkernel_config]:
+            if os.path.isfile(path):
+                with open(path, 'rb') as _file:
+                    _hash.update(hashlib.sha256(_file.read()).digest())
+            else:
+                _hash.update(b'-')
+        # The firmware is hashed by content, since it was emerged at different
+        # times in different systems.  It's seconds against a kernel build.
+        for dirpath, dirnames, filenames in os.walk(firmware_dir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                relpath = os.path.relpath(path, firmware_dir)
+                if os.path.islink(path):
+                    _hash.update(('%s -> %s\0' % (relpath, os.readlink(path))).encode())
+                    continue
+                _hash.update(('%s %d\0' % (relpath, os.path.getsize(path))).encode())
+                with open(path, 'rb') as _file:
+                    for chunk in iter(lambda: _file.read(1024*1024), b''):
+                        _hash.update(chunk)
+        return _hash.hexdigest()
+
+
     def kernel(self, arch='x86_64'):
         """ This emerges the kernel sources to a directory outside of the
             fledgeling system's portage configroot, builds and installs it
             to yet another external directory, bundles the kernel and modules
             as a .tar.xz in the packages directory for downloads via grsup,
             and finally installs it to the system's portage configroot.
+            If we have a kernelcache, a kernel built with the same configs
+            by any system is just reused from there.
         """
         # Grab the parsed verison and pkg atom.
         (gentoo_version, pkg_name, has_modules) = self.parse_kernel_config()
 
-        # Prepare the paths to where we'll emerge and build the kernel,
-        # as well as paths for genkernel.
-        kernel_source = os.path.join(self.kernelroot, 'usr/src/linux')
+        # Where we'll build and install the kernel.
         image_dir = os.path.join(self.kernelroot, gentoo_version)
-        boot_dir = os.path.join(image_dir, 'boot')
-        modprobe_dir = os.path.join(image_dir, 'etc/modprobe.d')
-        modules_dir = os.path.join(image_dir, 'lib/modules')
 
         # The firmware directory, if it exists, will be in self.portage_configroot
         firmware_dir = os.path.join(self.portage_configroot, 'lib/firmware')
 
-        # Prepare tarball filename and path.  If the tarball already exists,
-        # don't rebuild/reinstall it.  Note: It should have been installed to
-        # the system's portage configroot when it was first built, so no need
-        # to reinstall it.
+        # Prepare tarball filename and path.  If the tarball already exists
+        # and was built from the same configs, don't rebuild/reinstall it.
+        # Note: It should have been installed to the system's portage
+        # configroot when it was first built, so no need to reinstall it.
         linux_images = os.path.join(self.package, 'linux-images')
-        tarball_name = 'linux-image-%s.tar.xz' % gentoo_version
+        tarball_name = 'linux-image-%s.%s' % (gentoo_version, self.compression.suffix())
         tarball_path = os.path.join(linux_images, tarball_name)
-        if os.path.isfile(tarball_path):
-            return
+        key = self.key(pkg_name, arch, firmware_dir)
+        keyfile = '%s.key' % image_dir
+        if os.path.isfile(tarball_path) and os.path.isfile(keyfile):
+            with open(keyfile, 'r') as _file:
+                if _file.read().strip() == key:
+                    return
+
+        if not self.kernelcache:
+            self.build(gentoo_version, pkg_name, has_modules, firmware_dir, tarball_path)
+        else:
+            # Only one system at a time builds a kernel with this key.  Any
+            # other waits here and then finds it in the cache.
+            cached = os.path.join(self.kernelcache, key)
+            os.makedirs(self.kernelcache, mode=0o755, exist_ok=True)
+            with FileLock('%s.lock' % cached):
+                if os.path.isdir(cached):
+                    self.restore(cached, tarball_path)
+                else:
+                    self.build(gentoo_version, pkg_name, has_modules, firmware_dir, tarball_path)
+                    self.save(cached, image_dir, tarball_path)
+
+        with open(keyfile, 'w') as _file:
+            _file.write('%s\n' % key)
+
+
+    def build(self, gentoo_version, pkg_name, has_modules, firmware_dir, tarball_path):
+        """ Build the kernel, install it to the system's portage configroot and
+            tar it up to tarball_path.  The sources of each version are kept in
+            the kernelroot, and built out of tree in a build directory of the
+            version which is also kept, so only what a change to the config
+            affects is rebuilt next time.
+        """
+        # Prepare the paths to where we'll emerge and build the kernel,
+        # as well as paths for genkernel.
+        kernel_source = os.path.join(self.kernelroot, 'usr/src/linux-%s' % gentoo_version)
+        output_dir = os.path.join(self.kernelroot, 'build', gentoo_version)
+        image_dir = os.path.join(self.kernelroot, gentoo_version)
+        boot_dir = os.path.join(image_dir, 'boot')
+        modprobe_dir = os.path.join(image_dir, 'etc/modprobe.d')
+        modules_dir = os.path.join(image_dir, 'lib/modules')
 
         # Remove any old kernel image directory and create a boot directory.
         # Note genkernel assumes a boot directory is present.
         shutil.rmtree(image_dir, ignore_errors=True)
         os.makedirs(boot_dir, mode=0o755, exist_ok=True)
 
-        # emerge the kernel source.
-        cmd = 'emerge --nodeps -1n %s' % pkg_name
-        emerge_env = {'USE' : 'symlink', 'ROOT' : self.kernelroot, 'ACCEPT_KEYWORDS' : '**'}
-        Execute(cmd, timeout=600, extra_env=emerge_env, logfile=self.logfile)
+        # emerge the kernel source, unless we already have it.  Note: no -n,
+        # since the sources may still be in the vdb after being removed from
+        # disk, and then emerge would think there's nothing to do.  We never
+        # fall back on the usr/src/linux symlink, which may well point to the
+        # sources of some other version.
+        if not os.path.isdir(kernel_source):
+            cmd = 'emerge --nodeps -1 %s' % pkg_name
+            emerge_env = {'USE' : 'symlink', 'ROOT' : self.kernelroot, 'ACCEPT_KEYWORDS' : '**'}
+            Execute(cmd, timeout=600, extra_env=emerge_env, logfile=self.logfile)
+        if not os.path.isdir(kernel_source):
+            raise Exception('%s did not install %s' % (pkg_name, kernel_source))
+        os.makedirs(output_dir, mode=0o755, exist_ok=True)
 
         # Build and install the image outside the portage configroot so
         # we can both rsync it in *and* tarball it for downloads via grsup.
@@ -128,7 +208,10 @@ class Kernel():
         cmd = 'genkernel '
         cmd += '--logfile=/dev/null '
         cmd += '--no-save-config '
-        cmd += '--makeopts=-j9 '
+        cmd += '--makeopts=-j%d '           % Cgroup.cpus()
+        cmd += '--no-clean '
+        cmd += '--no-mrproper '
+        cmd += '--kernel-outputdir=%s '      % output_dir
         cmd += '--symlink '
         cmd += '--no-mountboot '
         cmd += '--kernel-config=%s '         % self.kernel_config
@@ -149,23 +232,54 @@ class Kernel():
 
         Execute(cmd, timeout=None, logfile=self.logfile)
 
-        # Strip the modules to shrink their size enormously!
+        # Strip the modules to shrink their size enormously!  They're all
+        # independent so we strip them in parallel, one per cpu.
         # This will do nothing if there is not modules_dir
+        cmds = []
         for dirpath, dirnames, filenames in os.walk(modules_dir):
             for filename in filenames:
                 if filename.endswith('.ko'):
                     module = os.path.join(dirpath, filename)
-                    cmd = 'objcopy -v --strip-unneeded %s' % module
-                    Execute(cmd)
+                    cmds.append(['objcopy', '-v', '--strip-unneeded', module])
+        ExecuteBatch(cmds, timeout=60, logfile=self.logfile)
 
         # Copy the newly compiled kernel image and modules to portage configroot
         cmd = 'rsync -aK %s/ %s' % (image_dir, self.portage_configroot)
         Execute(cmd, timeout=60, logfile=self.logfile)
 
         # Tar up the kernel image and modules and place them in package/linux-images
-        os.makedirs(linux_images, mode=0o755, exist_ok=True)
-        cwd = os.getcwd()
-        os.chdir(image_dir)
-        cmd = 'tar -Jcf %s .' % tarball_path
+        os.makedirs(os.path.dirname(tarball_path), mode=0o755, exist_ok=True)
+        cmd = 'tar %s -cf %s .' % (self.compression.tar_option(), tarball_path)
+        Execute(cmd, timeout=600, logfile=self.logfile, cwd=image_dir)
+
+
+    @staticmethod
+    def link(src, dst):
+        """ Hardlink src to dst, or copy it if they're on different filesystems. """
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+
+    def save(self, cached, image_dir, tarball_path):
+        """ File the image and tarball we just built in the kernelcache. """
+        staging = '%s.staging-%d' % (cached, os.getpid())
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging, mode=0o755)
+        self.link(tarball_path, os.path.join(staging, os.path.basename(tarball_path)))
+        cmd = 'cp -a --reflink=auto %s %s' % (image_dir, os.path.join(staging, 'image'))
         Execute(cmd, timeout=600, logfile=self.logfile)
-        os.chdir(cwd)
+        os.rename(staging, cached)
+
+
+    def restore(self, cached, tarball_path):
+        """ Install a kernel from the kernelcache to the system's portage
+            configroot and link its tarball into package/linux-images.
+        """
+        cmd = 'rsync -aK %s/ %s' % (os.path.join(cached, 'image'), self.portage_configroot)
+        Execute(cmd, timeout=60, logfile=self.logfile)
+        os.makedirs(os.path.dirname(tarball_path), mode=0o755, exist_ok=True)
+        self.link(os.path.join(cached, os.path.basename(tarball_path)), tarball_path)
@@ -1,31 +1,135 @@
 #!/usr/bin/env python
 
-import datetime
+import glob
 import os
+import shlex
+import shutil
+import subprocess
+import threading
 
+from grs.Compression import Compression
 from grs.Constants import CONST
+from grs.Engine import Engine
 from grs.Rotator import Rotator
 
 class Log(Rotator):
-    """ Initilize logs, log messages, or rotate logs.  """
+    """ Initilize logs, log messages, or rotate logs.  The logfile is written
+        through the Engine's Sink for it, which it shares with the commands we
+        run.  See Sink for the json, sync and max_size options.  Note that our
+        default is to flush every message, since we may be used outside of a
+        build run, whereas Interpret uses what systems.conf says.
 
-    def __init__(self, logfile=CONST.LOGFILE):
+        We keep up to keep rotated logs.  If we're given a compression codec,
+        eg. xz or zstd, the rotated logs are compressed in the background, and
+        if we're given a budget > 0, the oldest are dropped until all of them
+        together take no more than budget bytes.
+    """
+
+    # Only one thread at a time tidies up the rotated logs.
+    tidy_lock = threading.Lock()
+
+    def __init__(
+            self, logfile=CONST.LOGFILE, name=None, json=False, sync='flush', max_size=0,
+            compression=None, keep=20, budget=0
+    ):
         self.logfile = logfile
+        # Catch a bad codec now, rather than in the background when we
+        # first compress a log.
+        if compression:
+            Compression(compression)
+        self.compression = compression
+        self.keep = keep
+        self.budget = budget
         # Make sure the log directory exists
         os.makedirs(os.path.dirname(self.logfile), exist_ok=True)
         open(self.logfile, 'a').close()
+        Engine.get().configure(
+            logfile, system=name, json=json, sync=sync, max_size=max_size,
+            keep=keep, after_rotate=self.retire
+        )
+
+
+    @staticmethod
+    def size(value):
+        """ Parse a size from systems.conf, eg. 500M or 1.5G, into bytes. """
+        units = {'K' : 1024, 'M' : 1024**2, 'G' : 1024**3}
+        value = value.strip().upper()
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(float(value or 0))
+
 
     def log(self, msg, stamped=True):
         # If requested, stamp a log message with the unix time.
-        if stamped:
-            current_time = datetime.datetime.now(datetime.timezone.utc)
-            unix_timestamp = current_time.timestamp()
-            msg = '[%f] %s' % (unix_timestamp, msg)
-        with open(self.logfile, 'a') as _file:
-            _file.write('%s\n' % msg)
+        Engine.get().emit(self.logfile, 'log', msg, stamped)
 
 
-    def rotate_logs(self, upper_limit=20):
-        # Rotate all the previous logs
+    def rotate_logs(self, upper_limit=None):
+        # Rotate all the previous logs.  This is just renaming, anything
+        # which takes time is done in the background.
+        if upper_limit is None:
+            upper_limit = self.keep
+        engine = Engine.get()
+        engine.flush(self.logfile)
         self.full_rotate(self.logfile, upper_limit=upper_limit)
         open(self.logfile, 'a').close()
+        self.retire()
+
+
+    def retire(self):
+        """ Start compressing and pruning the rotated logs in the background. """
+        if self.compression or self.budget > 0:
+            threading.Thread(target=self.tidy, daemon=True).start()
+
+
+    def tidy(self):
+        """ Compress the rotated logs, oldest first, then drop the oldest until
+            we're within our budget.
+        """
+        with self.tidy_lock:
+            # Clean up after a compression which never finished.
+            dirname, basename = os.path.split(self.logfile)
+            for tmp in glob.glob(os.path.join(dirname, '.%s.*.tmp' % glob.escape(basename))):
+                os.unlink(tmp)
+            if self.compression:
+                for _count, path in reversed(self.rotated(self.logfile)):
+                    if os.path.isfile(path) and not path.endswith(tuple(self.suffixes)):
+                        self.compress(path)
+            if self.budget > 0:
+                with self.lock:
+                    rotated = [path for _count, path in self.rotated(self.logfile)]
+                    total = sum(os.path.getsize(path) for path in rotated)
+                    while rotated and total > self.budget:
+                        path = rotated.pop()
+                        total -= os.path.getsize(path)
+                        os.unlink(path)
+
+
+    def compress(self, path):
+        """ Compress one rotated log, at low priority so as not to slow down
+            the build.  The log may be rotated again while we're at it, so we
+            find where it went by its inode before putting the result there.
+        """
+        _compression = Compression(self.compression, threads=1)
+        suffix = _compression.codecs[self.compression][0]
+        dirname, basename = os.path.split(self.logfile)
+        cmd = self.idle('%s -c' % _compression.program())
+        # Take the inode from what we opened, not from path, which may have
+        # been rotated onto another log in between.
+        try:
+            _in = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        with _in:
+            inode = os.fstat(_in.fileno()).st_ino
+            tmp = os.path.join(dirname, '.%s.%d.tmp' % (basename, inode))
+            with open(tmp, 'wb') as _out:
+                _rc = subprocess.call(shlex.split(cmd), stdin=_in, stdout=_out, stderr=subprocess.DEVNULL)
+        with self.lock:
+            current = [p for _count, p in self.rotated(self.logfile) if os.stat(p).st_ino == inode]
+            if _rc != 0 or not current:
+                os.unlink(tmp)
+                return
+            shutil.copystat(current[0], tmp)
+            os.rename(tmp, '%s.%s' % (current[0], suffix))
+            os.unlink(current[0])
@@ -16,19 +16,42 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import ctypes
+import ctypes.util
 import os
+import re
+import signal
 from copy import deepcopy
+from grs.CCache import CCache
 from grs.Constants import CONST
-from grs.Execute import Execute
+from grs.Engine import Engine
+from grs.Trace import Trace
 
 class MountDirectories():
     """ This controls the mounting/unmounting of directories under the system's
-        portage configroot.
+        portage configroot.  We mount and unmount with the syscalls directly,
+        rather than forking mount and umount, and read the mount table once
+        per call rather than once per directory, keeping it up to date with
+        our own mounts and unmounts as we go.
     """
 
+    # From <sched.h> and <sys/mount.h>
+    CLONE_NEWNS = 0x00020000
+    MS_BIND = 4096
+    MS_REC = 16384
+    MS_SLAVE = 1 << 19
+    MNT_FORCE = 1
+
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.mount.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_ulong, ctypes.c_void_p]
+    libc.umount2.argtypes = [ctypes.c_char_p, ctypes.c_int]
+    libc.unshare.argtypes = [ctypes.c_int]
+
     def __init__(self, portage_configroot=CONST.PORTAGE_CONFIGROOT, \
-            package=CONST.PACKAGE, portage=CONST.PORTAGE, distfiles=CONST.DISTFILES, logfile=CONST.LOGFILE):
+            package=CONST.PACKAGE, portage=CONST.PORTAGE, distfiles=CONST.DISTFILES, logfile=CONST.LOGFILE, \
+            extra=()):
         # The order is respected.  Note that 'dev' needs to be mounted beore 'dev/pts'.
+        # Any extra mounts from systems.conf, see parse(), come last.
         self.directories = [
             'dev',
             'dev/pts',
@@ -39,35 +62,126 @@ class MountDirectories():
             [portage, 'var/db/repos/gentoo'],
             [package, 'var/cache/binpkgs'],
             [distfiles, 'var/cache/distfiles']
-        ]
+        ] + list(extra)
         # Once initiated, we only work with one portage_configroot
         self.portage_configroot = portage_configroot
         self.portage = portage
         self.package = package
         self.distfiles = distfiles
         self.logfile = logfile
+        # Whether we're in our own mount namespace, see unshare().
+        self.private = False
         # We need to umount in the reverse order
         self.rev_directories = deepcopy(self.directories)
         self.rev_directories.reverse()
 
 
-    def ismounted(self, mountpoint):
+    @staticmethod
+    def parse(bind_mounts='', tmpfs_mounts='', ccache_dir=''):
+        """ Turn the bind_mounts, tmpfs_mounts and ccache_dir from systems.conf
+            into extra self.directories[].  These are whitespace separated
+            lists of
+
+                bind_mounts  : /host/directory:relative/target ...
+                tmpfs_mounts : relative/target[:size] ...
+
+            eg. 'var/tmp/portage:8G' builds in a tmpfs of up to 8G.
+        """
+        extra = []
+        for bind_mount in bind_mounts.split():
+            source_directory, target_directory = bind_mount.split(':', 1)
+            extra.append([source_directory, target_directory.strip('/')])
+        for tmpfs_mount in tmpfs_mounts.split():
+            target_directory, _, size = tmpfs_mount.partition(':')
+            options = 'size=%s' % size if size else None
+            extra.append({target_directory.strip('/') : ('tmpfs', 'tmpfs', options)})
+        if ccache_dir:
+            extra.append([ccache_dir, CCache.chroot_dir.strip('/')])
+        return extra
+
+
+    @staticmethod
+    def mountpoints():
         """ Obtain all the current mountpoints.  Since python's os.path.ismount()
-            fails for for bind mounts, we obtain these ourselves from /proc/mounts.
+            fails for for bind mounts, we obtain these ourselves from the fifth
+            field of /proc/self/mountinfo, where spaces etc. are octal escaped.
         """
-        mountpoints = []
-        for line in open('/proc/mounts', 'r').readlines():
-            mountpoints.append(line.split()[1])
+        mountpoints = set()
+        with open('/proc/self/mountinfo', 'r') as _file:
+            for line in _file:
+                mountpoint = line.split(' ', 5)[4]
+                mountpoints.add(re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), mountpoint))
+        return mountpoints
+
+
+    def ismounted(self, mountpoint, mountpoints=None):
+        """ Is mountpoint mounted?  Pass in mountpoints() if checking many. """
+        if mountpoints is None:
+            mountpoints = self.mountpoints()
         # Let's make sure mountoint is canonical real path, no sym links, since that's
-        # what /proc/mounts reports.  Otherwise we can get a false negative on matching.
+        # what the mount table reports.  Otherwise we can get a false negative on matching.
         mountpoint = os.path.realpath(mountpoint)
         return mountpoint in mountpoints
 
 
+    def unshare(self):
+        """ Move ourselves, and so everything we run from now on, into our own
+            mount namespace.  Mounts from the host still propagate to us, but
+            ours don't propagate back, and they all go away when the last of
+            us exits.  So there is nothing to clean up when we're done, or
+            killed.  This must be done before we start any threads.  Returns
+            whether we succeeded, eg. it fails without CAP_SYS_ADMIN.
+        """
+        if self.libc.unshare(self.CLONE_NEWNS) != 0:
+            return False
+        # We inherit the host's shared propagation, so make everything a slave.
+        if self.libc.mount(None, b'/', None, self.MS_REC | self.MS_SLAVE, None) != 0:
+            return False
+        self.private = True
+        return True
+
+
+    def teardown(self):
+        """ Unmount everything when we're done, unless it goes away anyhow
+            because we're in our own mount namespace.
+        """
+        if not self.private:
+            self.umount_all()
+
+
+    def fail(self, msg):
+        """ Like a failed Execute, log why and SIGTERM ourselves. """
+        pid = os.getpid()
+        engine = Engine.get()
+        engine.emit(self.logfile, 'grs', '%s\nSENDING SIGTERM: %s\n' % (msg, pid))
+        engine.flush(self.logfile)
+        Trace.fail()
+        os.kill(pid, signal.SIGTERM)
+
+
+    def mount(self, source, target, vfstype=None, flags=0, options=None):
+        """ mount(2) source on target, or fail as mount(8) would. """
+        _rc = self.libc.mount(
+            source.encode(), target.encode(), vfstype.encode() if vfstype else None, flags,
+            options.encode() if options else None
+        )
+        if _rc != 0:
+            errno = ctypes.get_errno()
+            self.fail('MOUNT FAILED: %s on %s: %s' % (source, target, os.strerror(errno)))
+
+
+    def umount(self, target):
+        """ umount2(2) target with MNT_FORCE, or fail as umount(8) would. """
+        if self.libc.umount2(target.encode(), self.MNT_FORCE) != 0:
+            errno = ctypes.get_errno()
+            self.fail('UMOUNT FAILED: %s: %s' % (target, os.strerror(errno)))
+
+
     def are_mounted(self):
         """ Return whether some or all of the self.directories[] are mounted.  """
         some_mounted = False
         all_mounted = True
+        mountpoints = self.mountpoints()
         for mount in self.directories:
             if isinstance(mount, str):
                 target_directory = mount
@@ -77,7 +191,7 @@ class MountDirectories():
                 tmp = list(mount.keys())
                 target_directory = tmp[0]
             target_directory = os.path.join(self.portage_configroot, target_directory)
-            if self.ismounted(target_directory):
+            if self.ismounted(target_directory, mountpoints):
                 some_mounted = True
             else:
                 all_mounted = False
@@ -105,12 +219,14 @@ class MountDirectories():
                 target_directory = mount[1]
             elif isinstance(mount, dict):
                 # In this case, we are given the mountpoint, type and name,
-                # so we just go right ahead and mount -t type name mountpoint.
+                # and maybe options, so we just go right ahead and
+                # mount -t type -o options name mountpoint.
                 # This is useful for tmpfs filesystems.
                 tmp = list(mount.values())
                 tmp = tmp[0]
                 vfstype = tmp[0]
                 vfsname = tmp[1]
+                options = tmp[2] if len(tmp) > 2 else None
                 tmp = list(mount.keys())
                 target_directory = tmp[0]
             # Let's make sure the target_directory exists.
@@ -118,17 +234,17 @@ class MountDirectories():
             os.makedirs(target_directory, mode=0o755, exist_ok=True)
             # Okay now we're ready to do the actual mounting.
             if isinstance(mount, str):
-                cmd = 'mount --bind /%s %s' % (source_directory, target_directory)
+                self.mount('/%s' % source_directory, target_directory, flags=self.MS_BIND)
             elif isinstance(mount, list):
-                cmd = 'mount --bind %s %s' % (source_directory, target_directory)
+                self.mount(source_directory, target_directory, flags=self.MS_BIND)
             elif isinstance(mount, dict):
-                cmd = 'mount -t %s %s %s' % (vfstype, vfsname, target_directory)
-            Execute(cmd, timeout=60, logfile=self.logfile)
+                self.mount(vfsname, target_directory, vfstype, options=options)
 
 
     def umount_all(self):
         """ Unmount all the self.directories[]. """
         # We must unmount in the opposite order that we mounted.
+        mountpoints = self.mountpoints()
         for mount in self.rev_directories:
             if isinstance(mount, str):
                 target_directory = mount
@@ -138,6 +254,8 @@ class MountDirectories():
                 tmp = list(mount.keys())
                 target_directory = tmp[0]
             target_directory = os.path.join(self.portage_configroot, target_directory)
-            if self.ismounted(target_directory):
-                cmd = 'umount --force %s' % target_directory
-                Execute(cmd, timeout=60, logfile=self.logfile)
+            # Something may be mounted over something else, so refresh
+            # the mount table after each unmount.
+            if self.ismounted(target_directory, mountpoints):
+                self.umount(target_directory)
+                mountpoints = self.mountpoints()
@@ -33,13 +33,15 @@ class Netboot(HashIt):
             tmpdir=CONST.TMPDIR,
             portage_configroot=CONST.PORTAGE_CONFIGROOT,
             kernelroot=CONST.KERNELROOT,
-            logfile=CONST.LOGFILE
+            logfile=CONST.LOGFILE,
+            hash_inline=False
     ):
         self.libdir = libdir
         self.tmpdir = tmpdir
         self.portage_configroot = portage_configroot
         self.kernelroot = kernelroot
         self.logfile = logfile
+        self.hash_inline = hash_inline
         # Prepare a year, month and day for a name timestamp.
         year = str(datetime.now().year).zfill(4)
         month = str(datetime.now().month).zfill(2)
@@ -71,11 +73,7 @@ class Netboot(HashIt):
         # We will use gzip compression
         initramfs_src = os.path.join(self.portage_configroot, 'boot/initramfs')
         cmd = 'cat %s | gunzip | cpio -idv' % (initramfs_src)
-
-        cwd = os.getcwd()
-        os.chdir(initramfs_root)
-        Execute(cmd, timeout=600, logfile=self.logfile, shell=True)
-        os.chdir(cwd)
+        Execute(cmd, timeout=600, logfile=self.logfile, shell=True, cwd=initramfs_root)
 
         ''' The issue here was that busybox was build in the host env like the
         kernel and that means that we are using the host's ARCH and the cpuflags
@@ -109,12 +107,12 @@ class Netboot(HashIt):
 
         # 5. Repack
         initramfs_dst = os.path.join(self.tmpdir, self.medium_name)
-        cmd = 'find . -print | cpio -H newc -o | gzip -9 -f > %s' % initramfs_dst
-
-        cwd = os.getcwd()
-        os.chdir(initramfs_root)
-        Execute(cmd, timeout=600, logfile=self.logfile, shell=True)
-        os.chdir(cwd)
+        if self.hash_inline:
+            cmd = 'find . -print | cpio -H newc -o | gzip -9 -f'
+            self.hashed_write(cmd, initramfs_dst, cwd=initramfs_root, shell=True)
+        else:
+            cmd = 'find . -print | cpio -H newc -o | gzip -9 -f > %s' % initramfs_dst
+            Execute(cmd, timeout=600, logfile=self.logfile, shell=True, cwd=initramfs_root)
 
         # 6. If do_cd='cd' then we package a bootable CD image
         # TODO: This code is rushed and we need a better way of
@@ -43,10 +43,10 @@ class PivotChroot(Rotator):
         if some_mounted:
             _md.umount_all()
 
-        # Move the system's portage configroot out of the way to system.0,
-        # then pivot the inner chroot to system.
-        self.full_rotate(self.portage_configroot)
-        inner_chroot = os.path.join('%s.0' % self.portage_configroot, subchroot)
+        # Move the system's portage configroot out of the way to its next
+        # generation, system.N, then pivot the inner chroot to system.
+        previous = self.generation_rotate(self.portage_configroot)
+        inner_chroot = os.path.join(previous, subchroot)
         shutil.move(inner_chroot, os.path.join(self.tmpdir, 'system'))
 
         # Be conservative: only if all the directories were mounted on the old
@@ -16,14 +16,20 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 import os
 import re
+import shutil
+import stat
 from grs.Constants import CONST
-from grs.Execute import Execute
+from grs.Engine import Engine
 
 class Populate():
     """ Copy the core files from the GRS repo to the system's portage configroot
-        for a particular cycle number.
+        for a particular cycle number.  Rather than copying the whole core/
+        tree every time, we build a manifest of what it should install and
+        remember in the workdir what we installed, so another populate only
+        copies what changed since.
     """
 
     def __init__(
@@ -37,61 +43,177 @@ class Populate():
         self.workdir = workdir
         self.portage_configroot = portage_configroot
         self.logfile = logfile
+        self.manifest_path = os.path.join(self.workdir, '.manifest')
 
 
     def populate(self, cycle=True):
-        """ Copy the core files from the GRS repo, to a local workdir and
-            then to the system's portage configroot, selecting for a paricular
-            cycle number.
+        """ Copy the core files from the GRS repo straight to the system's
+            portage configroot, selecting for a paricular cycle number.  A file
+            is copied unless both its source is unchanged and what we installed
+            last time is still there untouched.  A file we installed whose
+            source is gone from core/ is removed, again only if untouched, else
+            something else in the system now owns it.
         """
-        # rsync from the GRS repo to the workdir, removing the .git directory
-        cmd = 'rsync -av --delete --exclude=\'.git*\' %s/core/ %s' % (self.libdir, self.workdir)
-        Execute(cmd, timeout=60, logfile=self.logfile)
+        core = os.path.join(self.libdir, 'core')
+        directories, files, known = self.manifest(core, cycle)
+        installed = self.load()
 
-        # Select the cycle
-        if cycle:
-            self.select_cycle(cycle)
+        # Directories first, so the files have somewhere to go.
+        for relpath in sorted(directories):
+            self.install_directory(directories[relpath], self.target(relpath))
 
-        # Copy from the workdir to the system's portage configroot.
-        cmd = 'rsync -av %s/ %s' % (self.workdir, self.portage_configroot)
-        Execute(cmd, timeout=60, logfile=self.logfile)
+        copied = 0
+        for relpath in sorted(files):
+            source = files[relpath]
+            target = self.target(relpath)
+            signature = self.signature(source)
+            last = installed.pop(relpath, None)
+            if last and last['source'] == signature and last['target'] == self.signature(target):
+                installed[relpath] = last
+                continue
+            self.install_file(source, target)
+            installed[relpath] = {'source' : signature, 'target' : self.signature(target)}
+            copied += 1
 
+        removed = 0
+        for relpath in sorted(installed):
+            if relpath in files:
+                continue
+            target = self.target(relpath)
+            last = installed.pop(relpath)
+            if relpath in known:
+                # Just not selected for this cycle, leave it as the last cycle had it.
+                continue
+            if last['target'] == self.signature(target):
+                os.unlink(target)
+                removed += 1
 
-    def select_cycle(self, cycle):
-        """ Select files with the matching cycle number.  If a file has form
+        self.save(installed)
+        Engine.get().emit(
+            self.logfile, 'grs',
+            'populate %s: %d copied, %d removed, %d unchanged\n' % (cycle, copied, removed, len(files) - copied)
+        )
+
+
+    def target(self, relpath):
+        """ Where relpath goes in the system's portage configroot. """
+        return os.path.join(self.portage_configroot, relpath)
+
+
+    @staticmethod
+    def signature(path):
+        """ What we compare to tell whether a file changed, or None if it's gone. """
+        try:
+            _st = os.lstat(path)
+        except FileNotFoundError:
+            return None
+        return [_st.st_ino, _st.st_mode, _st.st_uid, _st.st_gid, _st.st_size, _st.st_mtime_ns]
+
+
+    def load(self):
+        """ What the last populate installed: { relpath : {source, target}, ...} """
+        try:
+            with open(self.manifest_path, 'r') as _file:
+                return json.load(_file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+
+    def save(self, installed):
+        """ Remember what we installed for the next populate. """
+        os.makedirs(self.workdir, mode=0o755, exist_ok=True)
+        tmp = '%s.tmp' % self.manifest_path
+        with open(tmp, 'w') as _file:
+            json.dump(installed, _file)
+        os.replace(tmp, self.manifest_path)
+
+
+    @staticmethod
+    def install_directory(source, target):
+        """ Make the target directory like the source, as rsync -a would. """
+        _st = os.stat(source)
+        if os.path.lexists(target) and not os.path.isdir(target):
+            os.unlink(target)
+        os.makedirs(target, exist_ok=True)
+        _tt = os.stat(target)
+        if stat.S_IMODE(_tt.st_mode) != stat.S_IMODE(_st.st_mode):
+            os.chmod(target, stat.S_IMODE(_st.st_mode))
+        if (_tt.st_uid, _tt.st_gid) != (_st.st_uid, _st.st_gid):
+            os.chown(target, _st.st_uid, _st.st_gid)
+
+
+    @staticmethod
+    def install_file(source, target):
+        """ Copy a file or symlink with its mode, times and ownership, as
+            rsync -a would.  We copy to a temporary file and rename it into
+            place, so anything running the target never sees half of it.
+        """
+        if os.path.isdir(target) and not os.path.islink(target):
+            shutil.rmtree(target)
+        tmp = os.path.join(os.path.dirname(target), '.%s.grs' % os.path.basename(target))
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        if os.path.islink(source):
+            os.symlink(os.readlink(source), tmp)
+        else:
+            shutil.copy2(source, tmp)
+        _st = os.lstat(source)
+        os.chown(tmp, _st.st_uid, _st.st_gid, follow_symlinks=False)
+        os.replace(tmp, target)
+
+
+    @staticmethod
+    def manifest(core, cycle):
+        """ Return the directories and files under core/ which a populate of
+            cycle installs, as { relpath : source }, leaving out anything
+            .git*, and the set of files a populate of any cycle installs.  A file with the form
                 filename.CYCLE.d
-            where d is an integer, then we delete all the other filename.CYCLE.x
-            where x != d and we rename filename.CYCLE.d to just filename.
-            Note: if a cycle number is not given, then cycle default to True
-            and we choose the filename with the largest cycle number.
+            where d is an integer, is installed as just filename if d is the
+            cycle number, and not at all otherwise.  Note: if a cycle number
+            is not given, then cycle default to True and we choose the files
+            with the largest cycle number.
         """
+        directories = {}
+        files = {}
         # The cycled_files dictionary will have form:
-        # { 1:['/path/to', 'a'], 1:['/path/to', 'b'], 2:...}
+        # { 1:[('path/to/a', source)], 2:... }
         cycled_files = {}
-        for dirpath, dirnames, filenames in os.walk(self.workdir):
-            for _file in filenames:
+        for dirpath, dirnames, filenames in os.walk(core):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.git')]
+            reldir = os.path.relpath(dirpath, core)
+            # A symlink to a directory is installed as the symlink, as rsync -a
+            # does, so it's a file to us, and we don't walk into it.
+            links = [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]
+            dirnames[:] = [d for d in dirnames if d not in links]
+            for dirname in dirnames:
+                directories[os.path.normpath(os.path.join(reldir, dirname))] = os.path.join(dirpath, dirname)
+            for _file in filenames + links:
+                if _file.startswith('.git'):
+                    continue
+                source = os.path.join(dirpath, _file)
+                relpath = os.path.normpath(os.path.join(reldir, _file))
                 _match = re.search(r'^(.+)\.CYCLE\.(\d+)', _file)
-                if _match:
-                    filename = _match.group(1)
-                    cycle_no = int(_match.group(2))
-                    cycled_files.setdefault(cycle_no, [])
-                    cycled_files[cycle_no].append([dirpath, filename])
+                if not _match:
+                    files[relpath] = source
+                    continue
+                filename = _match.group(1)
+                cycle_no = int(_match.group(2))
+                cycled_files.setdefault(cycle_no, [])
+                if _file == '%s.CYCLE.%d' % (filename, cycle_no):
+                    relpath = os.path.normpath(os.path.join(reldir, filename))
+                    cycled_files[cycle_no].append((relpath, source))
+                else:
+                    # Not quite a cycled file, so it's installed as is.
+                    files[relpath] = source
         # If cycle is just a boolean, then default to the maximum cycle number.
         if isinstance(cycle, bool):
-            cycle_no = max(cycled_files)
+            cycle_no = max(cycled_files, default=0)
         else:
             cycle_no = cycle
-        # Go through cycled_files dictionary and either
-        #     1. rename the file if it matches the desired cycle number,
-        #     2. delete the file otherwise.
+        # A cycled file of the selected cycle replaces any plain one.
+        known = set(files)
         for _cycle in cycled_files:
-            for _file in cycled_files[_cycle]:
-                dirpath = _file[0]
-                filename = _file[1]
-                new_file = os.path.join(dirpath, filename)
-                old_file = "%s.CYCLE.%d" % (new_file, _cycle)
-                if os.path.isfile(old_file):
-                    if _cycle == cycle_no:
-                        os.rename(old_file, new_file)
-                    else:
-                        os.remove(old_file)
+            known.update(relpath for relpath, source in cycled_files[_cycle])
+        for relpath, source in cycled_files.get(cycle_no, []):
+            files[relpath] = source
+        return directories, files, known
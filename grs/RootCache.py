@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+#
+#    RootCache.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+
+from grs.Constants import CONST
+from grs.FileLock import FileLock
+from grs.Rotator import Rotator
+from grs.Scheduler import Scheduler
+from grs.Snapshot import Snapshot
+
+
+class RootCache(Rotator):
+    """ Keep snapshots of a system's portage configroot, along with its package
+        directory which is bind mounted into it, as the build script proceeds.
+        Each snapshot is filed under the Journal key of the directive which
+        produced it.  Since that key hashes the stage, the directive, its inputs
+        and everything before it, another system whose build script starts the
+        same way, or a rerun of this one, can start from the deepest snapshot
+        it shares rather than emerging it all over again.
+
+        Only the leading directives which change nothing but the root can be
+        snapshotted.  After a kernel or a medium, the state of the build is no
+        longer all in the root.  Nor do we snapshot while anything is mounted
+        on the root, since a restored root would lack those mounts although
+        the journal says they're done.  So a build script which mounts early
+        and unmounts only at the end gets a snapshot only before its mount.
+
+        The snapshots are Snapshot clones, which are cheap on btrfs or with
+        reflinks.  Otherwise each one would be a full copy of the root, so we
+        don't snapshot at all unless we're told to copy.  Only the keep most
+        recently saved or restored snapshots are kept.
+    """
+
+    def __init__(
+            self,
+            rootcache=CONST.ROOTCACHE,
+            portage_configroot=CONST.PORTAGE_CONFIGROOT,
+            package=CONST.PACKAGE,
+            logfile=CONST.LOGFILE,
+            copy=False,
+            keep=20
+    ):
+        self.rootcache = rootcache
+        self.portage_configroot = portage_configroot
+        self.package = package
+        self.logfile = logfile
+        self.copy = copy
+        self.keep = int(keep)
+        self.lockfile = os.path.join(rootcache, '.lock')
+        self._cheap = None
+        self._sn = Snapshot(logfile)
+
+
+    @staticmethod
+    def prefix(directives):
+        """ The leading directives which write to nothing but the root. """
+        _prefix = []
+        for _dir in directives:
+            if not set(Scheduler.accesses[_dir.verb][1]) <= set(['root']):
+                break
+            _prefix.append(_dir)
+        return _prefix
+
+
+    def path(self, key):
+        """ Where the snapshot for a key is, if we have it. """
+        return os.path.join(self.rootcache, key)
+
+
+    def has(self, key):
+        """ Whether we have a snapshot for a key. """
+        return os.path.isdir(self.path(key))
+
+
+    def worthwhile(self):
+        """ Whether to snapshot at all: only if we can clone the root and
+            package directory cheaply, or we're told to copy them.
+        """
+        if self.copy:
+            return True
+        if self._cheap is None:
+            self._cheap = all(
+                self._sn.cheap(directory, self.rootcache) for directory in [self.portage_configroot, self.package]
+            )
+        return self._cheap
+
+
+    def save(self, key):
+        """ Snapshot the root and package directory under key.  We clone into a
+            staging directory and rename it, so that other systems sharing the
+            rootcache never see a partial snapshot.
+        """
+        if self.has(key) or not self.worthwhile():
+            return
+        staging = os.path.join(self.rootcache, '.staging-%d' % os.getpid())
+        self.discard(staging)
+        os.makedirs(staging, mode=0o755)
+        self._sn.clone(self.portage_configroot, os.path.join(staging, 'root'))
+        self._sn.clone(self.package, os.path.join(staging, 'package'))
+        if self.has(key):
+            # Another system made the same snapshot while we were at it.
+            self.discard(staging)
+        else:
+            os.rename(staging, self.path(key))
+        self.evict()
+
+
+    def restore(self, key):
+        """ Rotate the root and package directory out of the way, as a seed
+            would, and replace them with clones of the snapshot.
+        """
+        for directory in [self.portage_configroot, self.package]:
+            self.generation_rotate(directory)
+        # Hold off evict() while we clone, and mark the snapshot as used.
+        with FileLock(self.lockfile):
+            os.utime(self.path(key))
+            self._sn.clone(os.path.join(self.path(key), 'root'), self.portage_configroot)
+            self._sn.clone(os.path.join(self.path(key), 'package'), self.package)
+
+
+    def evict(self):
+        """ Discard all but the keep most recently saved or restored snapshots. """
+        with FileLock(self.lockfile):
+            snapshots = [
+                self.path(key) for key in os.listdir(self.rootcache) if not key.startswith('.')
+            ]
+            snapshots.sort(key=lambda snapshot: os.stat(snapshot).st_mtime, reverse=True)
+            for snapshot in snapshots[self.keep:]:
+                self.discard(snapshot)
+
+
+    def discard(self, snapshot):
+        """ Remove a snapshot or a staging directory. """
+        for tree in ['root', 'package']:
+            self._sn.remove(os.path.join(snapshot, tree))
+        self._sn.remove(snapshot)
@@ -20,10 +20,34 @@ import glob
 import re
 import os
 import shutil
+import subprocess
+import threading
+import time
 
 class Rotator():
     """ Super class for rotating files or directories.  """
 
+    # The suffixes a rotated file may have gained by being compressed.
+    suffixes = ['xz', 'zst', 'gz', 'bz2']
+
+    # Rotations may happen in more than one thread, eg. a log rotated for size
+    # while older logs are compressed in the background, so serialize them.
+    lock = threading.RLock()
+
+    def rotated(self, obj):
+        """ Return a list of (d, path) of the objects obj.(d+), possibly with a
+            compression suffix, ie. obj.(d+).xz, sorted by d.
+        """
+        pattern = r'^%s\.(\d+)(\.(%s))?$' % (re.escape(obj), '|'.join(self.suffixes))
+        objs = []
+        for _obj in glob.glob('%s.[0-9]*' % glob.escape(obj)):
+            _match = re.search(pattern, _obj)
+            if _match:
+                objs.append((int(_match.group(1)), _obj))
+        objs.sort()
+        return objs
+
+
     def rotate(self, obj, upper_limit=20):
         """ Does the work of rotating objects fitting the pattern obj.(d+).
 
@@ -36,36 +60,115 @@ class Rotator():
                 Old Name        New Name
                 log             (untouched)
                 log.0           log.1
-                log.1           log.2
+                log.1.xz        log.2.xz
                 log.3           log.4 (Note the gap is preserved.)
                 log.4           log.5
 
-            obj's paste an upper limit are deleted.
+            obj's paste an upper limit are deleted, directories in the
+            background, see trash().  Any compression suffix is kept.
         """
-        objs = glob.glob('%s.[0-9]*' % obj)
-        indexed_obj = {}
-        for _obj in objs:
-            _match = re.search(r'^.+\.(\d+)$', _obj)
-            if (_match.group(1)):
-                indexed_obj[int(_match.group(1))] = _obj
-        count = list(indexed_obj.keys())
-        count.sort()
-        count.reverse()
-        for _count in count:
-            current_obj = indexed_obj[_count]
-            if _count >= upper_limit:
-                try:
-                    shutil.rmtree(current_obj)
-                except NotADirectoryError:
-                    os.unlink(current_obj)
-                continue
-            _match = re.search(r'^(.+)\.\d+$', current_obj)
-            next_obj = '%s.%d' % (_match.group(1), _count+1)
-            shutil.move(current_obj, next_obj)
+        with self.lock:
+            for _count, current_obj in reversed(self.rotated(obj)):
+                if _count >= upper_limit:
+                    if os.path.isdir(current_obj):
+                        self.trash(current_obj)
+                    else:
+                        os.unlink(current_obj)
+                    continue
+                suffix = current_obj[len('%s.%d' % (obj, _count)):]
+                next_obj = '%s.%d%s' % (obj, _count+1, suffix)
+                shutil.move(current_obj, next_obj)
 
 
     def full_rotate(self, obj, upper_limit=20):
         """ Rotate both obj and obj.(d+). """
-        self.rotate(obj, upper_limit=upper_limit)
-        if os.path.exists(obj):
-            shutil.move(obj, '%s.0' % obj)
+        with self.lock:
+            self.rotate(obj, upper_limit=upper_limit)
+            if os.path.exists(obj):
+                shutil.move(obj, '%s.0' % obj)
+
+
+    def generation_rotate(self, obj, upper_limit=20):
+        """ Rotate a directory obj by giving it the next generation number,
+            which is one more than the highest of any obj.(d+).  Unlike
+            full_rotate(), this is a single rename no matter how many older
+            generations there are, and the newest generation has the highest
+            number.  So obj itself is always the current generation, and
+
+                Old Name        New Name
+                system          system.7
+                system.6        (untouched)
+                system.5        (untouched)
+
+            Only the newest upper_limit generations are kept, the rest are
+            moved to the trash.  Returns the path of the generation obj was
+            moved to, or None if there was no obj.
+
+            Older versions used full_rotate() here, where obj.0 is the newest.
+            The first time through we renumber any such obj.(d+), see
+            renumber().
+        """
+        with self.lock:
+            legacy = self.renumber(obj)
+            generations = self.rotated(obj)
+            moved = None
+            if os.path.lexists(obj):
+                generation = max(generations[-1][0] if generations else -1, legacy) + 1
+                moved = '%s.%d' % (obj, generation)
+                os.rename(obj, moved)
+                generations.append((generation, moved))
+            for _generation, expired in generations[:max(0, len(generations) - upper_limit)]:
+                self.trash(expired)
+            return moved
+
+
+    def renumber(self, obj):
+        """ Renumber obj.(d+) left by full_rotate(), where 0 is the newest, so
+            that the newest has the highest number as generation_rotate()
+            expects.  We mark obj as using generations with a .obj.generations
+            file beside it holding the highest legacy number, M, or -1 if there
+            were none.  Any obj.N with N <= M is then legacy and becomes
+            obj.(2M+1-N), above all the legacy numbers, so an interrupted
+            renumbering just picks up where it left off the next time.  Returns
+            M, at or below which no new generation is numbered.
+        """
+        dirname, basename = os.path.split(obj)
+        marker = os.path.join(dirname, '.%s.generations' % basename)
+        if not os.path.isfile(marker):
+            generations = self.rotated(obj)
+            with open(marker, 'w') as _file:
+                _file.write('%d\n' % (generations[-1][0] if generations else -1))
+        with open(marker, 'r') as _file:
+            legacy = int(_file.read())
+        for _count, current_obj in reversed(self.rotated(obj)):
+            if _count <= legacy:
+                suffix = current_obj[len('%s.%d' % (obj, _count)):]
+                os.rename(current_obj, '%s.%d%s' % (obj, 2*legacy + 1 - _count, suffix))
+        return legacy
+
+
+    @staticmethod
+    def idle(cmd):
+        """ Prefix cmd to run at the lowest cpu and, if we can, io priority. """
+        cmd = 'nice -n 19 %s' % cmd
+        if shutil.which('ionice'):
+            cmd = 'ionice -c 3 %s' % cmd
+        return cmd
+
+
+    def trash(self, obj):
+        """ Rename obj into a .trash directory next to it, which is O(1) since
+            it's on the same filesystem, and start a detached low priority rm
+            to empty the trash.  Removing a whole system root can take minutes,
+            so we don't wait for it.  If a previous rm never finished, eg.
+            because we were killed, this one picks up where it left off.
+        """
+        trashdir = os.path.join(os.path.dirname(obj), '.trash')
+        os.makedirs(trashdir, mode=0o700, exist_ok=True)
+        os.rename(obj, os.path.join(trashdir, '%s.%d' % (os.path.basename(obj), time.time_ns())))
+        cmd = self.idle('rm -rf --one-file-system --')
+        subprocess.Popen(
+            cmd.split() + [os.path.join(trashdir, t) for t in os.listdir(trashdir)],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
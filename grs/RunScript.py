@@ -28,11 +28,14 @@ class RunScript():
             self,
             libdir=CONST.LIBDIR,
             portage_configroot=CONST.PORTAGE_CONFIGROOT,
-            logfile=CONST.LOGFILE
+            logfile=CONST.LOGFILE,
+            extra_env=None
     ):
         self.libdir = libdir
         self.portage_configroot = portage_configroot
         self.logfile = logfile
+        # Any extra environment for the script, eg. to use a CCache.
+        self.extra_env = extra_env
 
     def runscript(self, script_name):
         # Copy the script form the GRS repo to the system's portage configroot's /tmp.
@@ -43,7 +46,7 @@ class RunScript():
         # Mark the script as excutable and execute it.
         os.chmod(script_dst, 0o0755)
         cmd = 'chroot %s /tmp/script' % self.portage_configroot
-        Execute(cmd, timeout=None, logfile=self.logfile)
+        Execute(cmd, timeout=None, extra_env=self.extra_env, logfile=self.logfile)
         # In the case of a clean script, it can delete itself, so
         # check if the script exists before trying to delete it.
         if os.path.isfile(script_dst):
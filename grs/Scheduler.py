@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+#
+#    Scheduler.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import queue
+import threading
+
+class Scheduler():
+    """ Run the directives of a build script plan concurrently, as far as it
+        is safe.  Each directive reads and/or writes some trees:
+
+            root      - the system's portage configroot, including what is
+                        mounted on it,
+            kernel    - the kernelroot and the linux-images in the package dir,
+            tarit, isoit, netbootit
+                      - the media these produce in the tmpdir, along with the
+                        scratch directories used to make them.
+
+        A directive must wait for every earlier directive which writes a tree it
+        reads or writes, and for every earlier directive which reads a tree it
+        writes.  Eg. isoit and netbootit only read the finished root, so they
+        can run together, but the next runscript must wait for them both.
+        Unless netbootit also makes a cd, since that's named just like the
+        isoit's cd, so it's as if it writes the isoit medium too.
+    """
+
+    # verb : (trees read, trees written).  hashit reads the medium it hashes.
+    accesses = {
+        'log'       : (['root'], []),
+        'mount'     : ([], ['root']),
+        'unmount'   : ([], ['root']),
+        'populate'  : ([], ['root']),
+        'runscript' : ([], ['root']),
+        'pivot'     : ([], ['root']),
+        'kernel'    : ([], ['root', 'kernel']),
+        'tarit'     : (['root'], ['tarit']),
+        'isoit'     : (['root'], ['isoit']),
+        'netbootit' : (['root'], ['kernel', 'netbootit']),
+        'hashit'    : ([], [])
+    }
+
+    def __init__(self, plan, jobs=1):
+        self.plan = plan
+        self.jobs = max(1, int(jobs))
+        self.dependencies = self.infer()
+        # What has finished but may not have been done() yet, see drain().
+        self.finished = None
+        self.completed = set()
+        self.recorded = set()
+
+
+    def trees(self, _dir):
+        """ Return the sets of trees read and written by a directive. """
+        (reads, writes) = self.accesses[_dir.verb]
+        reads = set(reads)
+        writes = set(writes)
+        if _dir.verb == 'hashit':
+            reads.add(_dir.medium)
+        if _dir.verb == 'netbootit' and _dir.objs[:1] == ['cd']:
+            writes.add('isoit')
+        return (reads, writes)
+
+
+    def infer(self):
+        """ Return a list whose ith element is the set of indices into the
+            plan of the directives that the ith directive must wait for.
+        """
+        trees = [self.trees(_dir) for _dir in self.plan]
+        dependencies = []
+        for i, (reads, writes) in enumerate(trees):
+            waits = set()
+            for j in range(i):
+                (earlier_reads, earlier_writes) = trees[j]
+                if writes & (earlier_reads | earlier_writes) or reads & earlier_writes:
+                    waits.add(j)
+            dependencies.append(waits)
+        return dependencies
+
+
+    def run(self, execute, done):
+        """ Call execute(directive) for every directive in the plan, with up to
+            self.jobs at a time, each in its own thread.  done(directive) is
+            called in our thread as each one finishes, eg. to journal progress.
+            With only one job, everything is just done in order in our thread.
+            If execute() returns False, the directive failed and has SIGTERMed
+            us, so it isn't done(), and we just wait for the SIGTERM handler.
+        """
+        if self.jobs == 1:
+            for _dir in self.plan:
+                if execute(_dir) is not False:
+                    done(_dir)
+            return
+
+        # The workers are daemon threads so that they don't keep us alive
+        # if a failed directive makes us exit.
+        self.finished = finished = queue.Queue()
+        def worker(i):
+            try:
+                if execute(self.plan[i]) is not False:
+                    finished.put((i, None))
+            except BaseException as err:
+                finished.put((i, err))
+
+        remaining = list(range(len(self.plan)))
+        completed = self.completed
+        running = 0
+        while remaining or running:
+            # Start whatever is ready, in the order of the build script.
+            for i in list(remaining):
+                if running >= self.jobs:
+                    break
+                if self.dependencies[i] <= completed:
+                    remaining.remove(i)
+                    threading.Thread(target=worker, args=(i,), daemon=True).start()
+                    running += 1
+            (i, err) = finished.get()
+            running -= 1
+            if err:
+                raise err
+            completed.add(i)
+            done(self.plan[i])
+            self.recorded.add(i)
+
+
+    def drain(self, record):
+        """ Call record(directive) for every directive which has finished but
+            which run() hasn't done() yet.  A failed directive SIGTERMs us while
+            others may have just finished, so call this from the handler, which
+            runs in our thread, before going down, so their work isn't lost.
+        """
+        if self.finished:
+            while True:
+                try:
+                    (i, err) = self.finished.get_nowait()
+                except queue.Empty:
+                    break
+                if not err:
+                    self.completed.add(i)
+        for i in sorted(self.completed - self.recorded):
+            record(self.plan[i])
+            self.recorded.add(i)
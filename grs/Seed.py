@@ -17,16 +17,83 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import shutil
+import re
+import shlex
+import signal
+import subprocess
+import urllib.error
 import urllib.request
 
+from grs.Compression import Compression
 from grs.Constants import CONST
-from grs.Execute import Execute
+from grs.Engine import Engine
+from grs.FileLock import FileLock
+from grs.HashIt import HashIt
 from grs.Rotator import Rotator
+from grs.Snapshot import Snapshot
+from grs.Trace import Trace
+
+
+class StageStream():
+    """ A readable stream of the stage tarball.  Any bytes we already have on
+        disk are read back first.  Then the rest comes from the network, and is
+        appended to the partial download as it arrives so an interrupted
+        download can be resumed later.
+    """
+
+    def __init__(self, localpath, response=None, resume=False):
+        self.response = response
+        self.local = None
+        self.download = None
+        if not response:
+            self.local = open(localpath, 'rb', buffering=0)
+        elif resume:
+            self.local = open(localpath, 'rb', buffering=0)
+            self.download = open(localpath, 'ab')
+        else:
+            self.download = open(localpath, 'wb')
+
+
+    def readinto(self, view):
+        if self.local:
+            nbytes = self.local.readinto(view)
+            if nbytes:
+                return nbytes
+            self.local.close()
+            self.local = None
+        if not self.response:
+            return 0
+        nbytes = self.response.readinto(view)
+        if nbytes:
+            self.download.write(view[:nbytes])
+        return nbytes
+
+
+    def close(self):
+        for _file in [self.local, self.download, self.response]:
+            if _file:
+                _file.close()
 
 
 class Seed(Rotator):
-    """ Download a stage tarball and unpack it into an empty system portage configroot. """
+    """ Download a stage tarball and unpack it into an empty system portage configroot.
+        The tarball is downloaded into the stagedir, which all systems share,
+        under a name and a lock for the whole stage_uri.  So when several
+        systems share a stage, the first one fetches it and the others wait
+        and reuse it.  Without a stagedir, each system downloads into its own
+        tmpdir, as it used to.
+
+        If we have a seedcache, the stage is also unpacked there once, keyed by
+        the sha512 of the tarball, and every seed after that is just a Snapshot
+        clone of the unpacked tree.
+
+        Next to the tarball, we record the upstream digest it was checked
+        against.  If upstream publishes a new stage at the same uri, eg. a
+        latest-stage3.tar.xz, the old tarball is stale and downloaded again.
+    """
+
+    # The hashes we'll check from an upstream DIGESTS file, best first.
+    algorithms = ['sha512', 'blake2b', 'sha1', 'md5']
 
     def __init__(
             self,
@@ -34,28 +101,271 @@ class Seed(Rotator):
             tmpdir=CONST.TMPDIR,
             portage_configroot=CONST.PORTAGE_CONFIGROOT,
             package=CONST.PACKAGE,
-            logfile=CONST.LOGFILE
+            logfile=CONST.LOGFILE,
+            seedcache=CONST.SEEDCACHE,
+            stagedir=CONST.STAGEDIR
     ):
         self.stage_uri = stage_uri
         self.portage_configroot = portage_configroot
         self.package = package
-        filename = os.path.basename(stage_uri)
-        self.filepath = os.path.join(tmpdir, filename)
+        # Where we used to download the tarball, see adopt().
+        self.legacypath = os.path.join(tmpdir, os.path.basename(stage_uri))
+        if stagedir:
+            # Name the tarball after the whole uri, since different uris may
+            # well have the same basename, eg. latest-stage3.tar.xz
+            filename = re.sub(r'[^\w.-]', '_', stage_uri)
+            self.filepath = os.path.join(stagedir, filename)
+        else:
+            self.filepath = self.legacypath
+        self.partpath = '%s.part' % self.filepath
+        self.digestpath = '%s.digest' % self.filepath
         self.logfile = logfile
+        self.seedcache = seedcache
+        self._sn = Snapshot(logfile)
+        self._digest = None
+
+
+    def upstream_digest(self):
+        """ Fetch the DIGESTS file published next to the stage tarball and
+            return (algorithm, hexdigest) for the best hash we can check, or
+            (None, None) if there is no such file.  It's only fetched once.
+        """
+        if self._digest is None:
+            self._digest = self.fetch_digest()
+        return self._digest
+
+
+    def fetch_digest(self):
+        try:
+            request = urllib.request.urlopen('%s.DIGESTS' % self.stage_uri, timeout=60)
+            lines = request.read().decode('utf-8', 'replace').splitlines()
+        except (urllib.error.URLError, OSError):
+            return (None, None)
+        # The DIGESTS file has the same format as the ones we produce in HashIt.
+        filename = os.path.basename(self.stage_uri)
+        hashes = {}
+        algorithm = None
+        for line in lines:
+            _match = re.search(r'^#\s+(\S+)\s+HASH', line)
+            if _match:
+                algorithm = _match.group(1).lower()
+                continue
+            words = line.split()
+            if algorithm and len(words) == 2 and words[1] == filename:
+                hashes[algorithm] = words[0].lower()
+        for algorithm in self.algorithms:
+            if algorithm in hashes:
+                return (algorithm, hashes[algorithm])
+        return (None, None)
+
+
+    def identity(self):
+        """ What identifies the stage we'd seed from, so that a new stage at
+            the same uri, eg. a latest-stage3.tar.xz, is told apart from the
+            old one.  That's its upstream digest if there is one, else the
+            sha512 of the tarball if we already have it, else just the uri.
+        """
+        (algorithm, expected) = self.upstream_digest()
+        if algorithm:
+            return '%s:%s' % (algorithm, expected)
+        if os.path.isfile(self.filepath):
+            return 'sha512:%s' % HashIt.multidigest(self.filepath, ['sha512'])['sha512']
+        return self.stage_uri
+
+
+    def open_stage(self):
+        """ Return a StageStream for the stage tarball.  If we have a partial
+            download, ask the server for just the remainder.  If the server
+            doesn't honor the Range request, we start over from scratch.
+        """
+        if os.path.isfile(self.filepath):
+            return StageStream(self.filepath)
+        offset = 0
+        if os.path.isfile(self.partpath):
+            offset = os.path.getsize(self.partpath)
+        request = urllib.request.Request(self.stage_uri)
+        if offset:
+            request.add_header('Range', 'bytes=%d-' % offset)
+        try:
+            response = urllib.request.urlopen(request, timeout=60)
+        except urllib.error.HTTPError as err:
+            # 416 means the range is bad, eg. the partial download is complete
+            # but was never verified.  Just download the whole thing again.
+            if err.code != 416:
+                raise
+            offset = 0
+            response = urllib.request.urlopen(self.stage_uri, timeout=60)
+        resume = offset > 0 and response.status == 206
+        return StageStream(self.partpath, response, resume)
+
+
+    def fail(self, msg):
+        """ Like a failed Execute, log why and SIGTERM ourselves. """
+        pid = os.getpid()
+        engine = Engine.get()
+        engine.emit(self.logfile, 'grs', '%s\nSENDING SIGTERM: %s' % (msg, pid))
+        engine.flush(self.logfile)
+        os.kill(pid, signal.SIGTERM)
+
+
+    def extract(self, directory, algorithm, expected, algorithms=()):
+        """ Extract the stage tarball into directory as it is downloaded, and
+            verify it against the expected upstream hash, if we have one.  Also
+            compute any of the other hashlib algorithms.  Returns a dictionary of
+            algorithm : hexdigest, or None if we failed.
+        """
+        algorithms = set(algorithms)
+        if algorithm:
+            algorithms.add(algorithm)
+
+        # Because python's tarfile sucks, we pipe the stage into tar as it
+        # downloads.  Decompression is done by a parallel (de)compressor.
+        tar_opts = '--xattrs'
+        compression = Compression.for_file(self.filepath)
+        if compression:
+            tar_opts += ' %s' % compression.tar_option()
+        cmd = 'tar %s -xf - -C %s' % (tar_opts, directory)
+
+        downloading = not os.path.isfile(self.filepath)
+        stream = self.open_stage()
+        engine = Engine.get()
+        # A buffered stdin, unlike a raw pipe, never silently writes only part
+        # of a chunk.
+        proc = subprocess.Popen(
+            shlex.split(cmd), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        pump = engine.attach([('stdout', proc.stdout), ('stderr', proc.stderr)], self.logfile)
+        try:
+            hexdigests = HashIt.digest_stream(stream, list(algorithms), [proc.stdin])
+        except BrokenPipeError:
+            # tar died early, its exit code will tell us why.
+            hexdigests = {}
+        finally:
+            stream.close()
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                hexdigests = {}
+        _rc = Trace.wait(proc)
+        engine.drain(pump, self.logfile)
+
+        if _rc != 0:
+            err = 'EXIT CODE: %d' % _rc
+        elif algorithm and hexdigests.get(algorithm) != expected:
+            err = 'DIGEST MISMATCH: %s %s' % (algorithm.upper(), self.stage_uri)
+        else:
+            if downloading:
+                os.rename(self.partpath, self.filepath)
+                self.record(algorithm, expected)
+            return hexdigests
+
+        # Don't keep a bad tarball around to be reused by the next run.
+        for path in [self.filepath, self.partpath, self.digestpath]:
+            if os.path.isfile(path):
+                os.unlink(path)
+        self.fail(err)
+        return None
 
 
     def seed(self):
         # Rotate the old portage_configroot and package out of the way
         for directory in [self.portage_configroot, self.package]:
-            self.full_rotate(directory)
+            self.generation_rotate(directory)
             os.makedirs(directory, mode=0o755, exist_ok=False)
 
-        # Download a stage tarball if we don't have one
-        if not os.path.isfile(self.filepath):
-            request = urllib.request.urlopen(self.stage_uri)
-            with open(self.filepath, 'wb') as _file:
-                shutil.copyfileobj(request, _file)
+        # Get the upstream hash before we start, so we can check it on the fly.
+        (algorithm, expected) = self.upstream_digest()
+
+        # Only one system at a time gets to download this stage, or unpack
+        # it into the seed cache.  Anyone else waits here and then finds it
+        # downloaded, or in the cache.
+        os.makedirs(os.path.dirname(self.filepath), mode=0o755, exist_ok=True)
+        with FileLock('%s.lock' % self.filepath):
+            self.adopt()
+            self.refresh(algorithm, expected)
+            if self.seedcache:
+                cached = self.cache(algorithm, expected)
+                if cached:
+                    self._sn.clone(cached, self.portage_configroot)
+                return
+            # Without a seed cache, just extract into the portage configroot.
+            # Once the download is complete, that needn't hold up anyone else.
+            if not os.path.isfile(self.filepath):
+                self.extract(self.portage_configroot, algorithm, expected)
+                return
+        self.extract(self.portage_configroot, algorithm, expected)
+
+
+    def adopt(self):
+        """ Move a tarball downloaded into our tmpdir, before we had a stagedir,
+            to where we now expect it, rather than download it again.
+        """
+        if self.filepath == self.legacypath or os.path.isfile(self.filepath):
+            return
+        if os.path.isfile(self.legacypath):
+            try:
+                os.rename(self.legacypath, self.filepath)
+            except OSError:
+                pass
+
+
+    def record(self, algorithm, expected):
+        """ Note which upstream digest the tarball we have was checked against. """
+        if not algorithm:
+            return
+        with open(self.digestpath, 'w') as _file:
+            _file.write('%s:%s\n' % (algorithm, expected))
+
+
+    def refresh(self, algorithm, expected):
+        """ Throw away the tarball we have if upstream has since published a
+            different stage at the same uri, so it's downloaded again.  If we
+            didn't record what it was checked against, eg. it was downloaded by
+            an older grs, we hash it once to find out.
+        """
+        if not algorithm or not os.path.isfile(self.filepath):
+            return
+        try:
+            with open(self.digestpath, 'r') as _file:
+                recorded = _file.read().strip()
+        except FileNotFoundError:
+            hexdigest = HashIt.multidigest(self.filepath, [algorithm])[algorithm]
+            recorded = '%s:%s' % (algorithm, hexdigest)
+            if hexdigest == expected:
+                self.record(algorithm, expected)
+        if recorded == '%s:%s' % (algorithm, expected):
+            return
+        for path in [self.filepath, self.partpath, self.digestpath]:
+            if os.path.isfile(path):
+                os.unlink(path)
+
+
+    def cache(self, algorithm, expected):
+        """ Make sure the stage is unpacked in the seedcache and return where,
+            or None if we failed.
+        """
+        # If we already know the sha512 of the stage, we may not even
+        # need the tarball since it may already be unpacked in the cache.
+        key = None
+        if algorithm == 'sha512':
+            key = expected
+        elif os.path.isfile(self.filepath):
+            key = HashIt.multidigest(self.filepath, ['sha512'])['sha512']
+        if key and os.path.isdir(os.path.join(self.seedcache, key)):
+            return os.path.join(self.seedcache, key)
 
-        # Because python's tarfile sucks
-        cmd = 'tar --xattrs -xf %s -C %s' % (self.filepath, self.portage_configroot)
-        Execute(cmd, timeout=120, logfile=self.logfile)
+        # Else unpack into a staging tree and file it under its sha512.
+        staging = os.path.join(self.seedcache, '.staging-%d' % os.getpid())
+        self._sn.remove(staging)
+        self._sn.create(staging)
+        hexdigests = self.extract(staging, algorithm, expected, ['sha512'])
+        if hexdigests is None:
+            self._sn.remove(staging)
+            return None
+        cached = os.path.join(self.seedcache, hexdigests['sha512'])
+        if os.path.isdir(cached):
+            # A different uri for the same stage was unpacked meanwhile.
+            self._sn.remove(staging)
+        else:
+            os.rename(staging, cached)
+        return cached
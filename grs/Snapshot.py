@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+#    Snapshot.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+
+from grs.Constants import CONST
+from grs.Execute import Execute
+
+
+class Snapshot():
+    """ Create directory trees which can later be cheaply cloned, and clone
+        them.  We use whatever the filesystem supports, in order of preference:
+
+            1. btrfs subvolume snapshots, which are O(1),
+            2. reflink copies, which share data blocks copy-on-write,
+            3. plain copies, as a last resort.
+
+        Hardlinks are never used since anything writing a file in place,
+        rather than replacing it, would then corrupt the original.
+    """
+
+    def __init__(self, logfile=CONST.LOGFILE):
+        self.logfile = logfile
+
+
+    @staticmethod
+    def run(cmd):
+        """ Try cmd and return whether it succeeded, without SIGTERMing on
+            failure.  These are just probes, so we don't log anything.
+        """
+        return Execute(cmd, timeout=None, failok=True, logfile='/dev/null').returncode == 0
+
+
+    def create(self, directory):
+        """ Create an empty directory which we can later clone, a btrfs
+            subvolume if we're on btrfs, else a plain directory.
+        """
+        os.makedirs(os.path.dirname(directory), mode=0o755, exist_ok=True)
+        if shutil.which('btrfs') and self.run('btrfs -q subvolume create %s' % directory):
+            return
+        os.makedirs(directory, mode=0o755, exist_ok=False)
+
+
+    def is_subvolume(self, directory):
+        """ The root of a btrfs subvolume always has inode number 256. """
+        return os.stat(directory).st_ino == 256 and shutil.which('btrfs')
+
+
+    def remove(self, directory):
+        """ Remove a directory created by create() or clone(). """
+        if os.path.isdir(directory) and self.is_subvolume(directory):
+            if self.run('btrfs -q subvolume delete %s' % directory):
+                return
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+    def cheap(self, src, dstdir):
+        """ Whether clone() can clone src into dstdir without copying it all,
+            ie. src is a btrfs subvolume, or we can reflink files from its
+            filesystem into dstdir.  We probe with a file next to src, or in
+            it if it's the root of another filesystem.
+        """
+        if self.is_subvolume(src):
+            return True
+        probedir = os.path.dirname(src)
+        if os.stat(probedir).st_dev != os.stat(src).st_dev:
+            probedir = src
+        os.makedirs(dstdir, mode=0o755, exist_ok=True)
+        probe = os.path.join(probedir, '.reflink-probe-%d' % os.getpid())
+        copy = os.path.join(dstdir, '.reflink-probe-%d' % os.getpid())
+        try:
+            with open(probe, 'w') as _file:
+                _file.write('probe\n')
+            return self.run('cp --reflink=always %s %s' % (probe, copy))
+        finally:
+            for path in [probe, copy]:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+    def clone(self, src, dst):
+        """ Clone the tree src to dst.  dst may exist but must be empty. """
+        if os.path.isdir(dst):
+            os.rmdir(dst)
+        if self.is_subvolume(src):
+            if self.run('btrfs -q subvolume snapshot %s %s' % (src, dst)):
+                return
+        # cp falls back to a plain copy if the filesystem can't do reflinks.
+        os.makedirs(dst, mode=0o755)
+        cmd = 'cp -a --reflink=auto %s/. %s' % (src, dst)
+        Execute(cmd, timeout=None, logfile=self.logfile)
@@ -17,35 +17,177 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
+import shlex
+import subprocess
 from grs.Constants import CONST
 from grs.Execute import Execute
+from grs.FileLock import FileLock
 
 class Synchronize():
-    """ Either clone or pull a remote git repository for a GRS system.  """
+    """ Either clone or pull a remote git repository for a GRS system.
 
-    def __init__(self, remote_repo, branch, libdir=CONST.LIBDIR, logfile=CONST.LOGFILE):
+        If a gitcache directory is given, all systems with the same remote_repo
+        share one bare mirror of it there.  Only the mirror talks to the remote,
+        so a repo is fetched once however many systems use it, and each system's
+        local repo is a clone of the mirror with objects of its own.  Clones
+        made with --shared before borrow their objects from the mirror, so it
+        must never prune objects, even if no branch refers to them anymore.  If
+        depth is non-zero, we only keep that much history.
+    """
+
+    def __init__(
+            self,
+            remote_repo,
+            branch,
+            libdir=CONST.LIBDIR,
+            logfile=CONST.LOGFILE,
+            gitcache='',
+            depth=0
+    ):
         self.remote_repo = remote_repo
         self.branch = branch
         self.local_repo = libdir
         self.logfile = logfile
+        self.depth = int(depth)
+        self.mirror = None
+        if gitcache:
+            mirror_name = re.sub(r'[^\w.-]', '_', remote_repo)
+            self.mirror = os.path.join(gitcache, '%s.git' % mirror_name)
+
+
+    @staticmethod
+    def query(cmd):
+        """ Run a git command which only queries something and return its
+            output, or None if it fails.
+        """
+        try:
+            return subprocess.check_output(
+                shlex.split(cmd), stderr=subprocess.DEVNULL, universal_newlines=True, timeout=60
+            ).strip()
+        except (subprocess.SubprocessError, OSError):
+            return None
+
+
+    def remote_head(self, repo):
+        """ The commit at the tip of our branch in repo, as seen by ls-remote. """
+        heads = self.query('git ls-remote %s refs/heads/%s' % (repo, self.branch))
+        if heads:
+            return heads.split()[0]
+        return None
+
+
+    def sync_mirror(self):
+        """ Bring the shared mirror up to date.  Whoever gets the lock first
+            does the fetch, and the rest find the mirror is already current.
+        """
+        depth_opt = '--depth %d' % self.depth if self.depth else ''
+        with FileLock('%s.lock' % self.mirror):
+            if not os.path.isdir(self.mirror):
+                cmd = 'git clone --mirror %s %s %s' % (depth_opt, self.remote_repo, self.mirror)
+                Execute(cmd, timeout=600, logfile=self.logfile)
+                self.keep_objects()
+                return
+            # Mirrors made before we kept their objects are fixed up here.
+            self.keep_objects()
+            mirror_head = self.query(
+                'git -C %s rev-parse -q --verify refs/heads/%s' % (self.mirror, self.branch)
+            )
+            if mirror_head and mirror_head == self.remote_head(self.remote_repo):
+                return
+            cmd = 'git -C %s fetch --prune %s origin' % (self.mirror, depth_opt)
+            Execute(cmd, timeout=600, logfile=self.logfile)
+
+
+    def keep_objects(self):
+        """ Let gc repack the mirror, but never prune any object from it. """
+        cmd = 'git -C %s config gc.pruneExpire never' % self.mirror
+        Execute(cmd, timeout=60, logfile=self.logfile)
+
+
+    def uptodate(self, upstream):
+        """ Return True if the local repo is on our branch, its HEAD is the
+            same commit as upstream's branch, and there's nothing to clean.
+        """
+        if not self.isgitdir():
+            return False
+        head = self.query('git -C %s rev-parse HEAD' % self.local_repo)
+        branch = self.query('git -C %s symbolic-ref --short HEAD' % self.local_repo)
+        if not head or branch != self.branch or head != self.remote_head(upstream):
+            return False
+        status = self.query('git -C %s status --porcelain --ignored' % self.local_repo)
+        return status == ''
+
+
+    def submodules_uptodate(self, repo, branch):
+        """ Return True if every submodule of repo, and theirs in turn, is at
+            the tip of the remote branch it follows, as git submodule update
+            --remote would leave it.  branch is that of repo, which a submodule
+            follows if its branch is '.', else it follows the remote HEAD.
+        """
+        modulesfile = os.path.join(repo, '.gitmodules')
+        if not os.path.isfile(modulesfile):
+            return True
+        paths = self.query('git config -f %s --get-regexp \'^submodule\\..*\\.path$\'' % modulesfile)
+        if not paths:
+            return False
+        for line in paths.splitlines():
+            key, path = line.split(None, 1)
+            name = key[len('submodule.'):-len('.path')]
+            submodule = os.path.join(repo, path)
+            if not os.path.exists(os.path.join(submodule, '.git')):
+                return False
+            follows = self.query('git config -f %s submodule.%s.branch' % (modulesfile, name))
+            if follows == '.':
+                follows = branch
+            ref = 'refs/heads/%s' % follows if follows else 'HEAD'
+            url = self.query('git -C %s remote get-url origin' % submodule)
+            head = self.query('git -C %s rev-parse HEAD' % submodule)
+            tip = self.query('git ls-remote %s %s' % (url, ref)) if url else None
+            if not head or not tip or tip.split()[0] != head:
+                return False
+            if not self.submodules_uptodate(submodule, follows):
+                return False
+        return True
+
 
     def sync(self):
-        if self.isgitdir():
-            # If the local repo exists, then make it pristine an pull
+        # With a mirror, we sync it and then sync the local repo from it.
+        # A shallow mirror can't lend its objects, so it must be cloned
+        # as if it were remote.
+        if self.mirror:
+            self.sync_mirror()
+            upstream = self.mirror
+            if self.depth:
+                upstream = 'file://%s' % self.mirror
+        else:
+            upstream = self.remote_repo
+        depth_opt = '--depth %d' % self.depth if self.depth else ''
+
+        if self.uptodate(upstream):
+            # Nothing changed upstream and the local repo is pristine, so we
+            # needn't touch it, but submodules may have moved on their own.
+            if self.submodules_uptodate(self.local_repo, self.branch):
+                return
+        elif self.isgitdir():
+            # If the local repo exists, then make it pristine and fetch.
             cmd = 'git -C %s reset HEAD --hard' % self.local_repo
             Execute(cmd, timeout=60, logfile=self.logfile)
             cmd = 'git -C %s clean -f -x -d' % self.local_repo
             Execute(cmd, timeout=60, logfile=self.logfile)
-            cmd = 'git -C %s pull' % self.local_repo
+            # Repos cloned before we had a mirror are repointed to it.
+            if self.query('git -C %s remote get-url origin' % self.local_repo) != upstream:
+                cmd = 'git -C %s remote set-url origin %s' % (self.local_repo, upstream)
+                Execute(cmd, timeout=60, logfile=self.logfile)
+            cmd = 'git -C %s fetch --prune %s origin' % (self.local_repo, depth_opt)
             Execute(cmd, timeout=60, logfile=self.logfile)
+            self.checkout()
         else:
-            # else clone afresh.
-            cmd = 'git clone %s %s' % (self.remote_repo, self.local_repo)
+            # else clone afresh.  From a full mirror, that just hardlinks its
+            # objects, so the clone doesn't depend on the mirror.
+            cmd = 'git clone --no-single-branch %s %s %s' % (depth_opt, upstream, self.local_repo)
             Execute(cmd, timeout=60, logfile=self.logfile)
-
-        # Make sure we're on the correct branch for the desired GRS system.
-        cmd = 'git -C %s checkout %s' % (self.local_repo, self.branch)
-        Execute(cmd, timeout=60, logfile=self.logfile)
+            self.checkout()
 
         # If there is a .gitmodules, then init/update the submodules
         git_modulesfile = os.path.join(self.local_repo, '.gitmodules')
@@ -55,6 +197,15 @@ class Synchronize():
             Execute(cmd, timeout=60, logfile=self.logfile)
 
 
+    def checkout(self):
+        """ Make sure we're on the correct branch for the desired GRS system,
+            and that it is exactly the upstream branch.  Unlike a pull, this
+            also works for a shallow repo.
+        """
+        cmd = 'git -C %s checkout -q -B %s origin/%s' % (self.local_repo, self.branch, self.branch)
+        Execute(cmd, timeout=60, logfile=self.logfile)
+
+
     def isgitdir(self):
         """ If there is a .git/config file, assume its a local git repository. """
         git_configdir = os.path.join(self.local_repo, '.git')
@@ -18,6 +18,7 @@
 
 import os
 from datetime import datetime
+from grs.Compression import Compression
 from grs.Constants import CONST
 from grs.Execute import Execute
 from grs.HashIt import HashIt
@@ -29,29 +30,36 @@ class TarIt(HashIt):
         self,
         name,
         portage_configroot=CONST.PORTAGE_CONFIGROOT,
-        logfile=CONST.LOGFILE
+        logfile=CONST.LOGFILE,
+        hash_inline=False,
+        compression=None
     ):
         self.portage_configroot = portage_configroot
         self.logfile = logfile
+        self.hash_inline = hash_inline
+        self.compression = compression or Compression()
         # Prepare a year, month and day for a tarball name timestamp.
         year = str(datetime.now().year).zfill(4)
         month = str(datetime.now().month).zfill(2)
         day = str(datetime.now().day).zfill(2)
-        self.medium_name = '%s-%s%s%s.tar.xz' % (name, year, month, day)
+        self.medium_name = '%s-%s%s%s.%s' % (name, year, month, day, self.compression.suffix())
         self.digest_name = '%s.DIGESTS' % self.medium_name
 
 
     def tarit(self, alt_name=None):
         # Create the tarball with the default name unless an alt_name is given.
         if alt_name:
-            self.medium_name = '%s.tar.xz' % alt_name
+            self.medium_name = '%s.%s' % (alt_name, self.compression.suffix())
             self.digest_name = '%s.DIGESTS' % self.medium_name
-        # We have to cd into the system's portage configroot and then out again.
-        cwd = os.getcwd()
-        os.chdir(self.portage_configroot)
-        tarball_path = os.path.join('..', self.medium_name)
         # TODO: This needs to be generalized for systems that don't support xattrs
         xattr_opts = '--xattrs --xattrs-include=security.capability --xattrs-include=user.pax.flags'
-        cmd = 'tar %s -Jcf %s .' % (xattr_opts, tarball_path)
-        Execute(cmd, timeout=None, logfile=self.logfile)
-        os.chdir(cwd)
+        # If we hash inline, tar writes to stdout and we tee it to the tarball.
+        if self.hash_inline:
+            tarball_path = os.path.join(self.portage_configroot, '..', self.medium_name)
+            cmd = 'tar %s %s -cf - .' % (xattr_opts, self.compression.tar_option())
+            self.hashed_write(cmd, tarball_path, cwd=self.portage_configroot)
+            return
+        # We have to run tar in the system's portage configroot.
+        tarball_path = os.path.join('..', self.medium_name)
+        cmd = 'tar %s %s -cf %s .' % (xattr_opts, self.compression.tar_option(), tarball_path)
+        Execute(cmd, timeout=None, logfile=self.logfile, cwd=self.portage_configroot)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+#
+#    Trace.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+import resource
+import threading
+import time
+
+from grs.Rotator import Rotator
+
+class Trace(Rotator):
+    """ Keep a performance record of each directive and append it as a line
+        of JSON to a tracefile, next to the progress journal.  Each record has
+
+            line         - the line number of the directive in the build script,
+            directive    - the directive itself,
+            started      - the unix time when it started,
+            wall         - how long it took in seconds,
+            utime, stime - the user and system cpu seconds, both of our thread
+                           running the directive and of all the commands it ran,
+            maxrss       - the peak resident set size in bytes of the biggest of
+                           those commands, or of us,
+            read_bytes, write_bytes
+                         - the bytes read from and written to block devices,
+            commands     - how many commands were run,
+            status       - 0 if the directive finished, the first non-zero exit
+                           code of its commands (only possible for those allowed
+                           to fail) or 128 + the signal if we were terminated.
+
+        Commands are accounted from their wait4() rusage.  This is exact even
+        when directives run in parallel threads, which the rusage of our cgroup
+        or of all our children would not be.  At the end of the run, totals()
+        adds a record for line 0 with the usage of the whole run from its cgroup.
+
+        Each run starts a new tracefile, the previous ones are rotated like the
+        logs, see rotate_traces().
+    """
+
+    # The record of the directive being executed by each thread.
+    _local = threading.local()
+    # Serializes accounting into a record shared by several threads.
+    _account_lock = threading.Lock()
+
+    def __init__(self, tracefile):
+        self.tracefile = tracefile
+        # Reentrant, since abort() is called from a signal handler.
+        self.lock = threading.RLock()
+        self.active = {}
+        self.started = time.time()
+
+
+    def rotate_traces(self, upper_limit=20):
+        """ Rotate the tracefiles of previous runs, keeping up to upper_limit. """
+        self.full_rotate(self.tracefile, upper_limit=upper_limit)
+
+
+    @staticmethod
+    def account(rusage, returncode):
+        """ Add the rusage of a reaped command to the record of the directive
+            which the calling thread is executing, if any.
+        """
+        record = getattr(Trace._local, 'record', None)
+        if record is None:
+            return
+        with Trace._account_lock:
+            record['utime'] += rusage.ru_utime
+            record['stime'] += rusage.ru_stime
+            record['maxrss'] = max(record['maxrss'], rusage.ru_maxrss * 1024)
+            record['read_bytes'] += rusage.ru_inblock * 512
+            record['write_bytes'] += rusage.ru_oublock * 512
+            record['commands'] += 1
+            if record['status'] == 0 and returncode:
+                record['status'] = returncode
+
+
+    @staticmethod
+    def context():
+        """ The record of the calling thread, to hand to helper threads. """
+        return getattr(Trace._local, 'record', None)
+
+
+    @staticmethod
+    def fail():
+        """ Mark the directive which the calling thread is executing as failed,
+            just before it SIGTERMs us.  In a worker thread, it would otherwise
+            carry on as if it succeeded, see Scheduler.run().
+        """
+        record = getattr(Trace._local, 'record', None)
+        if record is not None:
+            record['failed'] = True
+
+
+    @staticmethod
+    def failed():
+        """ Whether the directive of the calling thread has failed so far. """
+        record = getattr(Trace._local, 'record', None)
+        return record is not None and record.get('failed', False)
+
+
+    @staticmethod
+    def adopt(record):
+        """ Account what the calling thread runs to another thread's record,
+            see context().
+        """
+        Trace._local.record = record
+
+
+    @staticmethod
+    def wait(proc):
+        """ Wait for a subprocess.Popen to finish, like proc.wait(), but reap
+            it with wait4() so its rusage is accounted.
+        """
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        Trace.account(rusage, proc.returncode)
+        return proc.returncode
+
+
+    def begin(self, _dir):
+        """ Start the record for a directive in the calling thread. """
+        record = {
+            'line' : _dir.line_number,
+            'directive' : _dir.line,
+            'started' : time.time(),
+            'wall' : 0.0,
+            'utime' : 0.0,
+            'stime' : 0.0,
+            'maxrss' : 0,
+            'read_bytes' : 0,
+            'write_bytes' : 0,
+            'commands' : 0,
+            'status' : 0
+        }
+        Trace._local.record = record
+        Trace._local.start = (time.monotonic(), resource.getrusage(resource.RUSAGE_THREAD))
+        with self.lock:
+            self.active[id(record)] = record
+
+
+    def end(self):
+        """ Finish the record for the directive of the calling thread and
+            write it out.
+        """
+        record = Trace._local.record
+        Trace._local.record = None
+        (start, before) = Trace._local.start
+        after = resource.getrusage(resource.RUSAGE_THREAD)
+        record['wall'] = time.monotonic() - start
+        record['utime'] += after.ru_utime - before.ru_utime
+        record['stime'] += after.ru_stime - before.ru_stime
+        # ru_maxrss of a thread is that of the whole process.
+        record['maxrss'] = max(record['maxrss'], after.ru_maxrss * 1024)
+        record['read_bytes'] += (after.ru_inblock - before.ru_inblock) * 512
+        record['write_bytes'] += (after.ru_oublock - before.ru_oublock) * 512
+        self.write(record)
+
+
+    def abort(self, signum):
+        """ We're being terminated, so write out whatever directives are in
+            progress, marking them with the signal.  Their timing is only
+            approximate since we don't have the rusage of their threads.
+        """
+        with self.lock:
+            records = list(self.active.values())
+        now = time.time()
+        for record in records:
+            record['wall'] = now - record['started']
+            record['status'] = 128 + signum
+            self.write(record)
+
+
+    def totals(self, usage):
+        """ Append the usage of the whole run, eg. from its cgroup, as a record
+            for line 0.
+        """
+        record = dict(usage, line=0, directive='run', started=self.started)
+        record['wall'] = time.time() - self.started
+        with self.lock:
+            self.active[id(record)] = record
+        self.write(record)
+
+
+    def write(self, record):
+        """ Append a record to the tracefile as a line of JSON. """
+        with self.lock:
+            if self.active.pop(id(record), None) is None:
+                return
+            with open(self.tracefile, 'a') as _file:
+                _file.write('%s\n' % json.dumps(record, sort_keys=True))
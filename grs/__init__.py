@@ -16,21 +16,33 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from grs.BuildScript import BuildScript, Directive
+from grs.CCache import CCache
+from grs.Cgroup import Cgroup
 from grs.Constants import CONST
+from grs.Compression import Compression
 from grs.Daemon import Daemon
-from grs.Execute import Execute
+from grs.Dispatcher import Dispatcher
+from grs.Engine import Engine
+from grs.Execute import Execute, ExecuteBatch
+from grs.FileLock import FileLock
 from grs.HashIt import HashIt
 from grs.Interpret import Interpret
 from grs.ISOIt import ISOIt
+from grs.Journal import Journal
 from grs.Log import Log
 from grs.Kernel import Kernel
 from grs.MountDirectories import MountDirectories
 from grs.Netboot import Netboot
 from grs.PivotChroot import PivotChroot
 from grs.Populate import Populate
+from grs.RootCache import RootCache
 from grs.Rotator import Rotator
 from grs.RunScript import RunScript
+from grs.Scheduler import Scheduler
 from grs.Synchronize import Synchronize
 from grs.Seed import Seed
+from grs.Snapshot import Snapshot
 from grs.TarIt import TarIt
+from grs.Trace import Trace
 from grs.WorldConf import WorldConf
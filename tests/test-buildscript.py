@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+#    test-buildscript.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import shutil
+from grs import BuildScript
+
+libdir = '/tmp/test-buildscript'
+
+good_script = """# A comment and a blank line
+
+log stamp
++ mount
+populate 1
+runscript emerge-world
++runscript emerge-world
+unmount
+tarit
+hashit
+netbootit cd my-netboot
++hashit
+"""
+
+bad_script = """log stamp
+frobnicate
+populate one
+runscript missing-script
+mount now
+hashit
+"""
+
+def compile_script(script):
+    with open(os.path.join(libdir, 'build'), 'w') as f:
+        f.write(script)
+    bs = BuildScript(libdir)
+    return bs, bs.compile()
+
+if __name__ == "__main__":
+    if os.path.isdir(libdir):
+        shutil.rmtree(libdir)
+    os.makedirs(os.path.join(libdir, 'scripts'))
+    open(os.path.join(libdir, 'scripts/emerge-world'), 'w').close()
+
+    bs, plan = compile_script(good_script)
+    assert(bs.errors == [])
+    assert([d.line_number for d in plan] == [3, 4, 5, 6, 7, 8, 9, 10, 11, 12])
+    assert([d.verb for d in plan if d.update] == ['mount', 'runscript', 'hashit'])
+    assert(plan[1].line == 'mount')
+    assert(plan[9].objs == [])
+    assert(plan[8].objs == ['cd', 'my-netboot'])
+    assert(plan[7].medium == 'tarit')
+    assert(plan[9].medium == 'netbootit')
+
+    # Every error is found at once, not just the first.
+    bs, plan = compile_script(bad_script)
+    assert(len(bs.errors) == 5)
+    for line_number in [2, 3, 4, 5, 6]:
+        assert(any(e.startswith('line %d:' % line_number) for e in bs.errors))
+
+    # No build script at all.
+    os.unlink(os.path.join(libdir, 'build'))
+    bs = BuildScript(libdir)
+    assert(bs.compile() == [])
+    assert(len(bs.errors) == 1)
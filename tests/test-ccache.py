@@ -0,0 +1,59 @@
+#!/usr/bin/python
+#
+#    test-ccache.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import shutil
+from grs import CCache, Engine
+
+testdir = '/tmp/test-ccache'
+bindir = os.path.join(testdir, 'bin')
+ccache_dir = os.path.join(testdir, 'ccache')
+logfile = os.path.join(testdir, 'test.log')
+
+def counters(hits, misses, stamp):
+    # What our fake ccache --print-stats reports, with the counters of any
+    # other system sharing the cache.
+    with open(os.path.join(testdir, 'stats'), 'w') as _file:
+        _file.write('stats_updated_timestamp\t%d\ndirect_cache_hit\t%d\ncache_miss\t%d\n' % (stamp, hits, misses))
+
+if __name__ == "__main__":
+    shutil.rmtree(testdir, ignore_errors=True)
+    os.makedirs(bindir)
+    with open(os.path.join(bindir, 'ccache'), 'w') as _file:
+        _file.write('#!/bin/sh\n[ "$1" = --print-stats ] && [ -d "$CCACHE_DIR" ] && cat %s/stats\n' % testdir)
+    os.chmod(os.path.join(bindir, 'ccache'), 0o755)
+    os.environ['PATH'] = '%s:%s' % (bindir, os.environ['PATH'])
+    Engine.get().configure(logfile, sync='flush')
+
+    # Without a cache, there's nothing to do.
+    assert(CCache('', logfile).env() == {})
+    assert(CCache('', logfile).counters() == {})
+
+    # We log how much the counters grew, without zeroing them.
+    _cc = CCache(ccache_dir, logfile)
+    assert(_cc.env() == {'FEATURES' : 'ccache', 'CCACHE_DIR' : '/var/cache/ccache'})
+    counters(100, 50, 1)
+    _cc.begin()
+    assert(_cc.before == {'stats_updated_timestamp' : 1, 'direct_cache_hit' : 100, 'cache_miss' : 50})
+    counters(130, 50, 2)
+    _cc.stats()
+    with open(logfile, 'r') as _file:
+        assert(_file.read() == 'ccache: direct_cache_hit=30\n')
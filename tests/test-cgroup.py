@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+#    test-cgroup.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import shutil
+import subprocess
+import time
+from grs import CONST, Cgroup
+
+fakedir = '/tmp/test-cgroup'
+
+def fake(name, content):
+    with open(os.path.join(fakedir, name), 'w') as _file:
+        _file.write(content)
+
+if __name__ == "__main__":
+    # Parse the accounting of a v2 cgroup.
+    shutil.rmtree(fakedir, ignore_errors=True)
+    os.makedirs(fakedir)
+    fake('cpu.stat', 'usage_usec 3000\nuser_usec 2000\nsystem_usec 1000\nnr_periods 0\n')
+    fake('memory.peak', '4096\n')
+    fake('io.stat', '8:0 rbytes=10 wbytes=20 rios=1 wios=2 dbytes=0 dios=0\n8:16 rbytes=5 wbytes=5 rios=1 wios=1\n')
+    fake('cgroup.events', 'populated 0\nfrozen 0\n')
+    cg = Cgroup(fakedir, True)
+    assert(cg.stats() == {
+        'cpu_usec' : 3000, 'cpu_user_usec' : 2000, 'cpu_system_usec' : 1000,
+        'memory_peak' : 4096,
+        'io_rbytes' : 15, 'io_wbytes' : 25, 'io_rios' : 2, 'io_wios' : 3
+    })
+    assert(not cg.populated())
+    fake('cgroup.events', 'populated 1\nfrozen 0\n')
+    assert(cg.populated())
+    os.unlink(os.path.join(fakedir, 'memory.peak'))
+    assert('memory_peak' not in cg.stats())
+    assert(Cgroup(fakedir, False).stats() == {})
+
+    # Limits are only written for the controllers we were delegated.
+    fake('cgroup.controllers', 'memory io\n')
+    cg.limit(os.getpid(), '200', '16G')
+    assert(not os.path.exists(os.path.join(fakedir, 'cpu.weight')))
+    assert(Cgroup.read(os.path.join(fakedir, 'memory.max')) == '16G')
+    os.unlink(os.path.join(fakedir, 'cgroup.controllers'))
+    os.unlink(os.path.join(fakedir, 'memory.max'))
+    cg.limit(os.getpid(), '200', '16G')
+    assert(not os.path.exists(os.path.join(fakedir, 'memory.max')))
+
+    # Kill a real run, if we may.
+    if os.getuid() != 0:
+        sys.exit(0)
+    mycgroup = [line[3:] for line in Cgroup.read('/proc/self/cgroup').splitlines() if line.startswith('0::')]
+    run = Cgroup.setup().child('test-cgroup')
+    run.create()
+    pid = os.fork()
+    if not pid:
+        run.attach(os.getpid())
+        for i in range(10):
+            subprocess.Popen(['sleep', '60'])
+        time.sleep(60)
+        os._exit(0)
+    while len(run.pids()) < 11:
+        time.sleep(0.1)
+    assert(run.populated())
+    run.kill()
+    assert(not run.populated())
+    os.waitpid(pid, 0)
+
+    # Once we're gone from it too, the run and its teardown cgroup are removed.
+    if run.unified:
+        Cgroup(os.path.join(CONST.CGROUPDIR, mycgroup[0].lstrip('/')), True).attach(os.getpid())
+    run.remove()
+    assert(not os.path.exists(run.cgroupdir))
+    assert(not os.path.exists(run.aside().cgroupdir))
+
+    # We never use more cpus than we're allowed to run on.
+    assert(1 <= Cgroup.cpus() <= len(os.sched_getaffinity(0)))
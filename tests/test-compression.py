@@ -0,0 +1,89 @@
+#!/usr/bin/python
+#
+#    test-compression.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import shutil
+import subprocess
+from grs import Compression
+
+testdir = '/tmp/test-compression'
+
+if __name__ == "__main__":
+    shutil.rmtree(testdir, ignore_errors=True)
+    os.makedirs(os.path.join(testdir, 'src/etc'))
+    with open(os.path.join(testdir, 'src/etc/issue'), 'w') as _file:
+        _file.write('This is GRS\n' * 1000)
+
+    # Unknown codecs are refused.
+    try:
+        Compression('lzma')
+        assert(False)
+    except Exception as excpt:
+        assert(str(excpt) == 'Unknown compression codec lzma')
+
+    # So are levels the codec doesn't take.
+    for codec, level in [('zstd', '23'), ('zstd', '0'), ('xz', '10'), ('xz', '9x'), ('gzip', '0'), ('bzip2', '10')]:
+        try:
+            Compression(codec, level)
+            assert(False)
+        except Exception as excpt:
+            assert(str(excpt) == 'Invalid compression level %s for %s' % (level, codec))
+    for codec, level in [('zstd', '1'), ('zstd', '22'), ('xz', '0'), ('xz', '9e'), ('gzip', '9'), ('bzip2', 1)]:
+        assert(Compression(codec, level).level == level)
+
+    # Thread counts of 0 or less mean all our cores.
+    assert(Compression('xz').threads == len(os.sched_getaffinity(0)))
+    assert(Compression('xz', threads=-1).threads == len(os.sched_getaffinity(0)))
+    assert(Compression('xz', threads='3').threads == 3)
+
+    # The command line of the compressor.
+    assert(Compression('xz', threads=4).program() == 'xz -T4')
+    assert(Compression('zstd', level='19', threads=2).program() == 'zstd -T2 -19')
+    assert(Compression('zstd', level='22', threads=2).program() == 'zstd -T2 --ultra -22')
+    assert(Compression('xz', level='9e', threads=2).program() == 'xz -T2 -9e')
+    assert(Compression('zstd', threads=2).tar_option() == '--use-compress-program=\'zstd -T2\'')
+    if shutil.which('pigz'):
+        assert(Compression('gzip', level='9', threads=2).program() == 'pigz -p 2 -9')
+    else:
+        assert(Compression('gzip', level='9', threads=2).program() == 'gzip -9')
+
+    # Suffixes and telling the codec from a tarball.
+    assert(Compression('bzip2').suffix() == 'tar.bz2')
+    assert(Compression.for_file('stage3-amd64.tar.zst', threads=2).program() == 'zstd -T2')
+    assert(Compression.for_file('stage3-amd64.tar.xz').codec == 'xz')
+    assert(Compression.for_file('stage3-amd64.tar') is None)
+    assert(Compression.for_file('stage3-amd64.xz') is None)
+
+    # Round trip a tarball through each codec we have.
+    for codec in Compression.codecs:
+        _compression = Compression(codec, threads=2)
+        if not shutil.which(_compression.program().split()[0]):
+            continue
+        tarball = os.path.join(testdir, 'test.%s' % _compression.suffix())
+        cmd = 'tar %s -cf %s -C %s .' % (_compression.tar_option(), tarball, os.path.join(testdir, 'src'))
+        assert(subprocess.call(cmd, shell=True) == 0)
+        assert(os.path.getsize(tarball) < len('This is GRS\n' * 1000))
+        dst = os.path.join(testdir, 'dst-%s' % codec)
+        os.makedirs(dst)
+        cmd = 'tar %s -xf %s -C %s' % (Compression.for_file(tarball).tar_option(), tarball, dst)
+        assert(subprocess.call(cmd, shell=True) == 0)
+        with open(os.path.join(dst, 'etc/issue'), 'r') as _file:
+            assert(_file.read() == 'This is GRS\n' * 1000)
@@ -22,7 +22,7 @@ sys.path.append(os.path.abspath('..'))
 
 import signal
 import time
-from grs import Daemon, Execute
+from grs import Cgroup, Daemon
 
 class MyDaemon(Daemon):
     def run(self):
@@ -45,21 +45,9 @@ if __name__ == "__main__":
     daemon1 = MyDaemon(mypid1, value='test1')
     daemon2 = MyDaemon(mypid2, value='test2')
 
-    cgroupdir      = '/sys/fs/cgroup'
-    grs_cgroup     = 'grs'
-    grs_cgroupdir  = os.path.join(cgroupdir, grs_cgroup)
-
-    os.makedirs(grs_cgroupdir, mode=0o755, exist_ok=True)
-    if not os.path.ismount(grs_cgroupdir):
-        cmd = 'mount -t cgroup -o none,name=grs grs %s' % grs_cgroupdir
-        Execute(cmd)
-
-    subcgroup    = 'test-daemon'
-    subcgroupdir = os.path.join(grs_cgroupdir, subcgroup)
-    os.makedirs(subcgroupdir, exist_ok=True)
-
-    cmd = 'cgclassify -g name=%s:/%s %d' % (grs_cgroup, subcgroup, os.getpid())
-    Execute(cmd)
+    subcgroup = Cgroup.setup().child('test-daemon')
+    subcgroup.create()
+    subcgroup.attach(os.getpid())
 
     if len(sys.argv) != 2:
         print('%s [start1 start2 start12 pids killall]' % sys.argv[0])
@@ -83,17 +71,12 @@ if __name__ == "__main__":
             print('daemon2:\n%s' % open(mypid2, 'r').read())
         except FileNotFoundError:
             pass
-        try:
-            print('cgroup:\n%s' % open(os.path.join(subcgroupdir, 'tasks'), 'r').read())
-        except FileNotFoundError:
-            pass
+        print('cgroup:\n%s' % '\n'.join(str(pid) for pid in subcgroup.pids()))
     elif 'killall' == sys.argv[1]:
-        with open(os.path.join(subcgroupdir, 'tasks'), 'r') as f:
-            for p in f.readlines():
-                pd = int(p.strip())
-                if pd == os.getpid():
-                    continue
-                os.kill(pd, signal.SIGTERM)
+        for pd in subcgroup.pids():
+            if pd == os.getpid():
+                continue
+            os.kill(pd, signal.SIGTERM)
     else:
         print("Unknown command")
         sys.exit(2)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+#
+#    test-dispatcher.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+configfile = '/tmp/test-dispatcher.conf'
+with open(configfile, 'w') as _file:
+    _file.write('[a]\n\n[b]\npriority : 10\n\n[c]\n\n[d]\npriority : -1\n\n[e]\npriority : 10\n')
+os.environ['CONFIGFILE'] = configfile
+
+from grs import Dispatcher
+
+if __name__ == "__main__":
+    # Highest priority first, else in the order of systems.conf.
+    assert(Dispatcher.order(range(5)) == [1, 4, 0, 2, 3])
+    assert(Dispatcher.order([0, 2, 3]) == [0, 2, 3])
+
+    # Each system runs for two polls.  With two jobs, never more than two
+    # run at once and the next starts as soon as a slot is free.
+    polls = {}
+    started = []
+    def start(count):
+        started.append(count)
+        polls[count] = 2
+    def running(count):
+        polls[count] -= 1
+        return polls[count] > 0
+    def concurrent():
+        return len([count for count in polls if polls[count] > 0])
+    dp = Dispatcher(2, interval=0)
+    peak = []
+    def watched(count):
+        start(count)
+        peak.append(concurrent())
+    dp.run(range(5), watched, running)
+    assert(started == [1, 4, 0, 2, 3])
+    assert(max(peak) == 2)
+
+    # No limit starts everything at once.
+    started = []
+    Dispatcher(0).run(range(5), start, lambda count: True)
+    assert(started == [1, 4, 0, 2, 3])
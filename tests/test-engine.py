@@ -0,0 +1,115 @@
+#!/usr/bin/python
+#
+#    test-engine.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import json
+import re
+import shutil
+import subprocess
+import time
+from grs import Directive, Engine, Trace
+
+logdir = '/tmp/test-engine'
+
+def run(cmd, logfile, timeout=5):
+    """ Run cmd through the Engine as Execute does and return how long the
+        drain took.
+    """
+    engine = Engine.get()
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    pump = engine.attach([('stdout', proc.stdout), ('stderr', proc.stderr)], logfile)
+    proc.wait()
+    start = time.monotonic()
+    engine.drain(pump, logfile, timeout)
+    return time.monotonic() - start
+
+def lines(logfile):
+    """ The lines of logfile with their monotonic stamps dropped. """
+    with open(logfile, 'r') as _file:
+        return [re.sub(r'^\[\d+\.\d+ ', '[', line.rstrip('\n')) for line in _file]
+
+if __name__ == "__main__":
+    shutil.rmtree(logdir, ignore_errors=True)
+    os.makedirs(logdir)
+
+    # Output is split into lines however it arrives, and a last line without
+    # a newline isn't lost.
+    logfile = os.path.join(logdir, 'split.log')
+    run('printf "fir"; sleep 0.2; printf "st\\nsec"; sleep 0.2; printf "ond\\n\\nthird"', logfile)
+    assert(lines(logfile) == ['[--] first', '[--] second', '[--] ', '[--] third'])
+
+    # Lines are stamped with the directive of the thread that ran the command,
+    # and stdout and stderr both go to the logfile.
+    logfile = os.path.join(logdir, 'context.log')
+    _tr = Trace(os.path.join(logdir, 'trace.jsonl'))
+    _tr.begin(Directive(7, 'tarit', 'tarit', [], False, None))
+    run('echo out; sleep 0.2; echo err >&2', logfile)
+    _tr.end()
+    assert(lines(logfile) == ['[07] out', '[07] err'])
+
+    # Our own messages are in order with the output of commands.
+    Engine.get().emit(logfile, 'grs', 'EXIT CODE: 0')
+    Engine.get().flush(logfile)
+    assert(lines(logfile)[-1] == 'EXIT CODE: 0')
+
+    # A grandchild holding the pipes open doesn't hold up the drain for
+    # longer than its timeout, and what was written before is kept.
+    logfile = os.path.join(logdir, 'drain.log')
+    assert(run('sleep 3 & echo started', logfile, timeout=0.5) < 2)
+    assert(lines(logfile) == ['[--] started'])
+
+    # In json mode, each record says where it came from.
+    logfile = os.path.join(logdir, 'json.log')
+    Engine.get().configure(logfile, system='desktop', json=True, sync='flush')
+    _tr.begin(Directive(3, 'emerge x', 'emerge', ['x'], False, None))
+    run('echo out', logfile)
+    Engine.get().emit(logfile, 'log', 'one\ntwo')
+    _tr.end()
+    with open(logfile, 'r') as _file:
+        records = [json.loads(line) for line in _file]
+    assert([(r['stream'], r['msg']) for r in records] == [('stdout', 'out'), ('log', 'one'), ('log', 'two')])
+    for record in records:
+        assert(record['system'] == 'desktop' and record['line'] == 3 and record['directive'] == 'emerge x')
+
+    # With sync flush, a record is in the file as soon as emit() returns, but
+    # with batch, only once we flush, which we'd do within a second anyway.
+    logfile = os.path.join(logdir, 'sync.log')
+    Engine.get().configure(logfile, sync='flush')
+    Engine.get().emit(logfile, 'log', 'flushed')
+    assert(lines(logfile) == ['flushed'])
+    Engine.get().configure(logfile, sync='batch')
+    Engine.get().emit(logfile, 'log', 'batched')
+    assert(lines(logfile) == ['flushed'])
+    time.sleep(1.5)
+    assert(lines(logfile) == ['flushed', 'batched'])
+
+    # Past max_size, the logfile is rotated and we're told about it.
+    logfile = os.path.join(logdir, 'size.log')
+    rotations = []
+    Engine.get().configure(logfile, sync='flush', max_size=100, keep=2, after_rotate=lambda: rotations.append(1))
+    for i in range(10):
+        Engine.get().emit(logfile, 'log', '%02d %s' % (i, 'x' * 47))
+    assert(len(rotations) == 5)
+    assert(lines(logfile) == [])
+    assert(lines(logfile + '.0') == ['08 %s' % ('x' * 47), '09 %s' % ('x' * 47)])
+    assert(lines(logfile + '.1')[0].startswith('06'))
+    assert(lines(logfile + '.2')[0].startswith('04'))
+    assert(not os.path.exists(logfile + '.3'))
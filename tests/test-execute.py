@@ -0,0 +1,94 @@
+#!/usr/bin/python
+#
+#    test-execute.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import shutil
+import signal
+import time
+from grs import Directive, Engine, Execute, ExecuteBatch, Trace
+
+testdir = '/tmp/test-execute'
+logfile = os.path.join(testdir, 'test.log')
+
+class Terminated(Exception):
+    pass
+
+def handler(signum, frame):
+    raise Terminated()
+
+def log():
+    with open(logfile, 'r') as _file:
+        return _file.read()
+
+if __name__ == "__main__":
+    shutil.rmtree(testdir, ignore_errors=True)
+    os.makedirs(testdir)
+    signal.signal(signal.SIGTERM, handler)
+    Engine.get().configure(logfile, sync='flush')
+
+    # A failed command is logged and SIGTERMs us, unless it's ok to fail.
+    _ex = Execute('false', failok=True, logfile=logfile)
+    assert(_ex.returncode == 1)
+    assert('EXIT CODE: 1' in log() and 'SENDING SIGTERM' not in log())
+    assert(Execute('sleep 5', timeout=0.2, failok=True, logfile=logfile).returncode is None)
+    assert('TIMEOUT ERROR: sleep 5' in log())
+    try:
+        Execute('false', logfile=logfile)
+        assert(False)
+    except Terminated:
+        pass
+    assert('SENDING SIGTERM: %d' % os.getpid() in log())
+
+    # A batch runs no more than jobs commands at once.
+    start = time.monotonic()
+    _eb = ExecuteBatch([['sleep', '0.5']] * 4, jobs=2, logfile=logfile)
+    assert(0.9 < time.monotonic() - start < 1.9)
+    assert(_eb.returncodes == [0] * 4 and _eb.failed == [])
+
+    # All the commands of a batch are run, even after one fails, and then the
+    # failures are reported together.
+    cmds = [['touch', os.path.join(testdir, str(i))] for i in range(8)]
+    cmds[2] = ['false']
+    cmds[5] = 'sh -c "exit 3"'
+    _eb = ExecuteBatch(cmds, jobs=3, failok=True, logfile=logfile)
+    assert(_eb.returncodes == [0, 0, 1, 0, 0, 3, 0, 0])
+    assert(_eb.failed == [(['false'], 1), ('sh -c "exit 3"', 3)])
+    for i in [0, 1, 3, 4, 6, 7]:
+        assert(os.path.isfile(os.path.join(testdir, str(i))))
+    assert('BATCH FAILED' not in log())
+
+    # Unless failok, that's followed by a single SIGTERM, and the directive
+    # running the batch is marked failed and has all the commands accounted.
+    _tr = Trace(os.path.join(testdir, 'trace.jsonl'))
+    _tr.begin(Directive(4, 'kernel', 'kernel', [], False, None))
+    try:
+        ExecuteBatch(cmds + [['sleep', '5']], jobs=3, timeout=0.2, logfile=logfile)
+        assert(False)
+    except Terminated:
+        pass
+    assert(Trace.failed())
+    assert(Trace.context()['commands'] == 9)
+    _tr.end()
+    assert('BATCH FAILED: 3 of 9 commands' in log())
+    assert('    EXIT CODE 1: false\n' in log())
+    assert('    EXIT CODE 3: sh -c "exit 3"\n' in log())
+    assert('    TIMEOUT: sleep 5\n' in log())
+    assert(log().count('SENDING SIGTERM') == 2)
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+#
+#    test-hashit.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import hashlib
+import io
+import shutil
+import signal
+from grs import Engine, HashIt
+
+testdir = '/tmp/test-hashit'
+
+class Medium(HashIt):
+    """ A medium in testdir, with only the digests hashlib always has. """
+    digests = HashIt.digests[:3]
+
+    def __init__(self, medium_name):
+        self.portage_configroot = os.path.join(testdir, 'system')
+        self.medium_name = medium_name
+        self.digest_name = '%s.DIGESTS' % medium_name
+        self.logfile = os.path.join(testdir, 'test.log')
+
+class Terminated(Exception):
+    pass
+
+def handler(signum, frame):
+    raise Terminated()
+
+def expected(data, algorithms):
+    return dict((a, hashlib.new(a, data).hexdigest()) for a in algorithms)
+
+if __name__ == "__main__":
+    shutil.rmtree(testdir, ignore_errors=True)
+    os.makedirs(os.path.join(testdir, 'system'))
+    algorithms = ['md5', 'sha1', 'sha512']
+    data = os.urandom(1000000)
+
+    # However the stream is chunked, we get the same digests as hashlib.
+    for size, chunk_size in [(5000, 1), (len(data), 4096), (len(data), 333333), (len(data), len(data)), (len(data), 2000000)]:
+        hexdigests = HashIt.digest_stream(io.BytesIO(data[:size]), algorithms, chunk_size=chunk_size)
+        assert(hexdigests == expected(data[:size], algorithms))
+    assert(HashIt.digest_stream(io.BytesIO(b''), algorithms) == expected(b'', algorithms))
+
+    # The medium is read once for all the digests.
+    medium_path = os.path.join(testdir, 'stage3.tar.xz')
+    with open(medium_path, 'wb') as _file:
+        _file.write(data)
+    assert(HashIt.multidigest(medium_path, algorithms) == expected(data, algorithms))
+
+    # The DIGESTS file is in the format of md5sum and friends.
+    _medium = Medium('stage3.tar.xz')
+    assert(_medium.algorithms() == algorithms)
+    _medium.hashit()
+    hexdigests = expected(data, algorithms)
+    with open(os.path.join(testdir, 'stage3.tar.xz.DIGESTS'), 'r') as _file:
+        assert(_file.read() == ''.join(
+            '# %s HASH\n%s  stage3.tar.xz\n' % (header, hexdigests[algorithm])
+            for header, algorithm, _fallback in Medium.digests
+        ))
+
+    # Every chunk can also be written out while it's hashed.
+    _out = io.BytesIO()
+    assert(HashIt.digest_stream(io.BytesIO(data), algorithms, [_out], chunk_size=4096) == expected(data, algorithms))
+    assert(_out.getvalue() == data)
+
+    # A medium written through hashed_write() has its digests on hand, so
+    # hashit() doesn't read it back, but only for that medium.
+    _medium = Medium('stage4.tar')
+    medium_path = os.path.join(testdir, 'stage4.tar')
+    _medium.hashed_write('head -c 3000000 /dev/urandom', medium_path)
+    with open(medium_path, 'rb') as _file:
+        written = _file.read()
+    assert(len(written) == 3000000)
+    assert(_medium.hexdigests == ('stage4.tar', expected(written, algorithms)))
+    with open(medium_path, 'wb') as _file:
+        _file.write(b'changed')
+    _medium.hashit()
+    with open(os.path.join(testdir, 'stage4.tar.DIGESTS'), 'r') as _file:
+        assert(expected(written, ['sha512'])['sha512'] in _file.read())
+    _medium.medium_name = 'stage3.tar.xz'
+    _medium.digest_name = 'stage3.tar.xz.DIGESTS'
+    _medium.hashit()
+    with open(os.path.join(testdir, 'stage3.tar.xz.DIGESTS'), 'r') as _file:
+        assert(expected(data, ['sha512'])['sha512'] in _file.read())
+
+    # A failed command SIGTERMs us like Execute, with its stderr logged.
+    signal.signal(signal.SIGTERM, handler)
+    Engine.get().configure(_medium.logfile, sync='flush')
+    try:
+        _medium.hashed_write('sh -c "echo oops >&2; exit 2"', medium_path)
+        assert(False)
+    except Terminated:
+        pass
+    with open(_medium.logfile, 'r') as _file:
+        log = _file.read()
+    assert('oops' in log and 'EXIT CODE: 2' in log)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+#    test-journal.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import shutil
+from grs import BuildScript, Journal, Scheduler
+
+libdir = '/tmp/test-journal'
+journalfile = '/tmp/test-journal.log'
+
+script = """log stamp
+populate 1
+runscript a
+log stamp
+runscript b
+tarit
+hashit
+"""
+
+def write(path, content):
+    path = os.path.join(libdir, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as _file:
+        _file.write(content)
+
+def keys(jo):
+    directives = BuildScript(libdir).compile()
+    return jo.keys(directives, Scheduler(directives).dependencies)
+
+if __name__ == "__main__":
+    shutil.rmtree(libdir, ignore_errors=True)
+    if os.path.exists(journalfile):
+        os.unlink(journalfile)
+    write('build', script)
+    write('scripts/a', 'echo a\n')
+    write('scripts/b', 'echo b\n')
+    write('core/etc/portage/make.conf', 'USE=""\n')
+    write('core/etc/portage/package.use/x.CYCLE.1', 'a\n')
+    write('core/etc/portage/package.use/x.CYCLE.2', 'b\n')
+
+    jo = Journal(journalfile, libdir)
+    first = keys(jo)
+    assert(len(set(first)) == 7)
+    for key, _dir in zip(first, BuildScript(libdir).compile()):
+        jo.record(key, _dir)
+
+    # The journal survives a restart.
+    jo = Journal(journalfile, libdir)
+    assert(all(jo.done(key) for key in first))
+    assert(keys(jo) == first)
+
+    # Files for other cycles are not inputs to populate 1.
+    write('core/etc/portage/package.use/x.CYCLE.2', 'c\n')
+    assert(keys(jo) == first)
+
+    # Inserting a comment or a + changes nothing.
+    write('build', '# A comment\n' + script.replace('runscript a', '+runscript a'))
+    assert(keys(jo) == first)
+
+    # Nor does inserting a log line, even before what writes the root.
+    write('build', script.replace('runscript a', 'log hello\nrunscript a'))
+    inserted = keys(jo)
+    assert(inserted[:2] + inserted[3:] == first)
+    write('build', script)
+
+    # Changing a script redoes it and what follows from it, but not what
+    # came before.
+    write('scripts/b', 'echo B\n')
+    changed = keys(jo)
+    assert(changed[:4] == first[:4])
+    assert(all(c != f for c, f in zip(changed[4:], first[4:])))
+
+    # So does changing a file in core/ for the cycle.
+    write('scripts/b', 'echo b\n')
+    write('core/etc/portage/package.use/x.CYCLE.1', 'd\n')
+    changed = keys(jo)
+    assert(changed[0] == first[0])
+    assert(all(c != f for c, f in zip(changed[1:], first[1:])))
+
+    # Resetting, eg. after a reseed, forgets everything, even across a restart.
+    jo.reset()
+    assert(not any(jo.done(key) for key in first))
+    jo = Journal(journalfile, libdir)
+    assert(not any(jo.done(key) for key in first))
+
+    # The stamps of older versions seed a new journal, and are then removed,
+    # but not the sync and seed stamps.
+    os.unlink(journalfile)
+    stampdir = os.path.join(libdir, 'tmp')
+    os.makedirs(stampdir)
+    for stamp in ['sync', 'seed', '01', '02', '03']:
+        open(os.path.join(stampdir, '.completed_%s' % stamp), 'w').close()
+    directives = BuildScript(libdir).compile()
+    first = dict(zip([_dir.line_number for _dir in directives], keys(jo)))
+    jo = Journal(journalfile, libdir)
+    jo.migrate(stampdir, directives, first, persist=False)
+    assert([jo.done(first[i]) for i in range(1, 8)] == [True] * 3 + [False] * 4)
+    assert(not os.path.exists(journalfile))
+    assert(len(os.listdir(stampdir)) == 5)
+    jo = Journal(journalfile, libdir)
+    jo.migrate(stampdir, directives, first)
+    assert(sorted(os.listdir(stampdir)) == ['.completed_seed', '.completed_sync'])
+    jo = Journal(journalfile, libdir)
+    assert([jo.done(first[i]) for i in range(1, 8)] == [True] * 3 + [False] * 4)
+
+    # Once we have a journal, leftover stamps are just removed.
+    open(os.path.join(stampdir, '.completed_05'), 'w').close()
+    jo.migrate(stampdir, directives, first)
+    assert(not jo.done(first[5]))
+    assert(sorted(os.listdir(stampdir)) == ['.completed_seed', '.completed_sync'])
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+#
+#    test-kernel.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import shutil
+from grs import Kernel
+
+testdir = '/tmp/test-kernel'
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as _file:
+        _file.write(content)
+
+if __name__ == "__main__":
+    if os.path.isdir(testdir):
+        shutil.rmtree(testdir)
+    kernel_config = '#\n# Automatically generated file; DO NOT EDIT.\n# Linux/x86 4.0.6-hardened-r2 Kernel Configuration\n'
+    for system in ['one', 'two']:
+        write(os.path.join(testdir, system, 'lib/scripts/kernel-config'), kernel_config)
+        write(os.path.join(testdir, system, 'system/lib/firmware/blob'), 'blob\n')
+    kernels = []
+    for system in ['one', 'two']:
+        kernels.append(Kernel(
+            libdir=os.path.join(testdir, system, 'lib'),
+            portage_configroot=os.path.join(testdir, system, 'system'),
+            kernelroot=os.path.join(testdir, system, 'kernel'),
+            package=os.path.join(testdir, system, 'packages'),
+            logfile='/dev/null',
+            kernelcache=os.path.join(testdir, 'kernels')
+        ))
+
+    (gentoo_version, pkg_name, has_modules) = kernels[0].parse_kernel_config()
+    assert(gentoo_version == '4.0.6-hardened-r2')
+    assert(pkg_name == '=sys-kernel/hardened-sources-4.0.6-r2')
+    firmware_dirs = [os.path.join(_ke.portage_configroot, 'lib/firmware') for _ke in kernels]
+
+    # The same configs give the same key in any system.
+    key = kernels[0].key(pkg_name, 'x86_64', firmware_dirs[0])
+    assert(key == kernels[1].key(pkg_name, 'x86_64', firmware_dirs[1]))
+    assert(key != kernels[0].key(pkg_name, 'arm', firmware_dirs[0]))
+
+    # But not if the config changes, even with the same version.
+    write(kernels[1].kernel_config, kernel_config + 'CONFIG_MODULES=y\n')
+    assert(key != kernels[1].key(pkg_name, 'x86_64', firmware_dirs[1]))
+    write(kernels[1].kernel_config, kernel_config)
+
+    # The firmware counts by content, not by when it was installed.
+    os.utime(os.path.join(firmware_dirs[1], 'blob'), ns=(10**18, 10**18))
+    assert(key == kernels[1].key(pkg_name, 'x86_64', firmware_dirs[1]))
+
+    # So changing it changes the key.
+    write(os.path.join(firmware_dirs[1], 'blob'), 'new blob\n')
+    assert(key != kernels[1].key(pkg_name, 'x86_64', firmware_dirs[1]))
+
+    # A saved build is a hardlink of the tarball and a copy of the image.
+    image_dir = os.path.join(kernels[0].kernelroot, gentoo_version)
+    tarball_path = os.path.join(kernels[0].package, 'linux-images/linux-image-%s.tar.xz' % gentoo_version)
+    write(os.path.join(image_dir, 'boot/kernel'), 'kernel\n')
+    write(tarball_path, 'tarball\n')
+    cached = os.path.join(testdir, 'kernels', key)
+    os.makedirs(os.path.dirname(cached))
+    kernels[0].save(cached, image_dir, tarball_path)
+    assert(os.path.isfile(os.path.join(cached, 'image/boot/kernel')))
+    assert(os.stat(os.path.join(cached, os.path.basename(tarball_path))).st_ino == os.stat(tarball_path).st_ino)
@@ -20,6 +20,7 @@ import os
 import sys
 sys.path.append(os.path.abspath('..'))
 
+import gzip
 import hashlib
 import shutil
 from grs import Log
@@ -70,3 +71,37 @@ if __name__ == "__main__":
     assert(not os.path.isfile(logfile+'.3'))
     assert(not os.path.isfile(logfile+'.4'))
     assert(not os.path.isfile(logfile+'.5'))
+
+    # Compress the rotated logs in the background and keep them within budget.
+    shutil.rmtree(logdir)
+    os.makedirs(logdir)
+    lo = Log(logfile, compression='gzip', keep=5, budget=0)
+    for i in range(4):
+        lo.log('third %d' % i)
+        lo.rotate_logs()
+    lo.tidy()
+    for i in range(4):
+        assert(not os.path.isfile(logfile+'.%d' % i))
+        assert(os.path.isfile(logfile+'.%d.gz' % i))
+    lo.rotate_logs()
+    lo.tidy()
+    assert(os.path.isfile(logfile+'.0.gz'))
+    assert(os.path.isfile(logfile+'.4.gz'))
+    assert(not os.path.isfile(logfile+'.5.gz'))
+    with gzip.open(logfile+'.4.gz', 'rt') as f:
+        assert(f.read().strip().endswith('third 0'))
+
+    lo.budget = os.path.getsize(logfile+'.0.gz') + os.path.getsize(logfile+'.1.gz')
+    lo.tidy()
+    assert(os.path.isfile(logfile+'.1.gz'))
+    assert(not os.path.isfile(logfile+'.2.gz'))
+
+    # Sizes may be fractional, and a bad codec is caught up front.
+    assert(Log.size('1.5G') == 3 * 1024**3 // 2)
+    assert(Log.size('500m') == 500 * 1024**2)
+    assert(Log.size('') == 0)
+    try:
+        Log(logfile, compression='lzma')
+        assert(False)
+    except Exception as err:
+        assert('lzma' in str(err))
@@ -70,3 +70,43 @@ if __name__ == "__main__":
     some_mounted, all_mounted = md.are_mounted()
     assert(some_mounted == False)
     assert(all_mounted == False)
+
+    # The mount table escapes spaces, which we must undo to match.
+    spaced = os.path.join(configroot, 'with space')
+    os.makedirs(spaced, exist_ok=True)
+    md.mount(package, spaced, flags=md.MS_BIND)
+    assert(md.ismounted(spaced) == True)
+    assert(os.path.isfile(os.path.join(spaced, 'empty')) == True)
+    md.umount(spaced)
+    assert(md.ismounted(spaced) == False)
+
+    # In our own mount namespace, the mounts never show up on the host and
+    # go away when we exit.
+    pid = os.fork()
+    if pid == 0:
+        assert(md.unshare() == True)
+        md.mount_all()
+        some_mounted, all_mounted = md.are_mounted()
+        os._exit(0 if all_mounted else 1)
+    _, status = os.waitpid(pid, 0)
+    assert(status == 0)
+    some_mounted, all_mounted = md.are_mounted()
+    assert(some_mounted == False)
+
+    # Extra bind and tmpfs mounts from systems.conf come after the others.
+    extra = MountDirectories.parse('%s:/opt/pkgs' % package, 'var/tmp/portage:16M', '/tmp/test-ccache')
+    assert(extra == [
+        [package, 'opt/pkgs'],
+        {'var/tmp/portage' : ('tmpfs', 'tmpfs', 'size=16M')},
+        ['/tmp/test-ccache', 'var/cache/ccache']
+    ])
+    md = MountDirectories(portage_configroot=configroot, package=package, logfile='/dev/null', extra=extra)
+    md.mount_all()
+    some_mounted, all_mounted = md.are_mounted()
+    assert(all_mounted == True)
+    assert(os.path.isfile(os.path.join(configroot, 'opt/pkgs/empty')) == True)
+    assert(os.statvfs(os.path.join(configroot, 'var/tmp/portage')).f_blocks * \
+        os.statvfs(os.path.join(configroot, 'var/tmp/portage')).f_frsize == 16*1024*1024)
+    md.umount_all()
+    some_mounted, all_mounted = md.are_mounted()
+    assert(some_mounted == False)
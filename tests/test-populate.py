@@ -0,0 +1,95 @@
+#!/usr/bin/python
+#
+#    test-populate.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import shutil
+from grs import Populate
+
+testdir = '/tmp/test-populate'
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as _file:
+        _file.write(content)
+
+def read(path):
+    with open(path, 'r') as _file:
+        return _file.read()
+
+if __name__ == "__main__":
+    if os.path.isdir(testdir):
+        shutil.rmtree(testdir)
+    libdir = os.path.join(testdir, 'lib')
+    workdir = os.path.join(testdir, 'work')
+    root = os.path.join(testdir, 'system')
+    core = os.path.join(libdir, 'core')
+    os.makedirs(root)
+
+    write(os.path.join(core, 'etc/plain'), 'plain\n')
+    write(os.path.join(core, 'etc/make.conf'), 'plain\n')
+    write(os.path.join(core, 'etc/make.conf.CYCLE.1'), 'one\n')
+    write(os.path.join(core, 'etc/make.conf.CYCLE.2'), 'two\n')
+    write(os.path.join(core, 'etc/only.CYCLE.1'), 'one\n')
+    write(os.path.join(core, '.git/config'), 'git\n')
+    os.symlink('plain', os.path.join(core, 'etc/link'))
+    write(os.path.join(core, 'usr/real/file'), 'real\n')
+    os.symlink('real', os.path.join(core, 'usr/alias'))
+    os.chmod(os.path.join(core, 'etc/plain'), 0o600)
+
+    _po = Populate(libdir, workdir, root, '/dev/null')
+
+    # The cycle is selected and .git is left out.
+    _po.populate(1)
+    assert(read(os.path.join(root, 'etc/plain')) == 'plain\n')
+    assert(read(os.path.join(root, 'etc/make.conf')) == 'one\n')
+    assert(read(os.path.join(root, 'etc/only')) == 'one\n')
+    assert(os.readlink(os.path.join(root, 'etc/link')) == 'plain')
+    assert(os.stat(os.path.join(root, 'etc/plain')).st_mode & 0o777 == 0o600)
+    assert(os.readlink(os.path.join(root, 'usr/alias')) == 'real')
+    assert(read(os.path.join(root, 'usr/alias/file')) == 'real\n')
+    assert(not os.path.exists(os.path.join(root, 'etc/make.conf.CYCLE.1')))
+    assert(not os.path.exists(os.path.join(root, '.git')))
+
+    # Nothing changed, so nothing is copied.
+    inode = os.stat(os.path.join(root, 'etc/plain')).st_ino
+    _po.populate(1)
+    assert(os.stat(os.path.join(root, 'etc/plain')).st_ino == inode)
+
+    # A file changed in the root is put back, as is a changed source.
+    write(os.path.join(root, 'etc/plain'), 'changed\n')
+    write(os.path.join(core, 'etc/make.conf.CYCLE.1'), 'uno\n')
+    _po.populate(1)
+    assert(read(os.path.join(root, 'etc/plain')) == 'plain\n')
+    assert(read(os.path.join(root, 'etc/make.conf')) == 'uno\n')
+
+    # The next cycle, a file not in it is left as it was.
+    _po.populate(2)
+    assert(read(os.path.join(root, 'etc/make.conf')) == 'two\n')
+    assert(read(os.path.join(root, 'etc/only')) == 'one\n')
+
+    # A file gone from core/ is removed, unless something changed it since.
+    os.unlink(os.path.join(core, 'etc/plain'))
+    os.unlink(os.path.join(core, 'etc/link'))
+    os.symlink('make.conf', os.path.join(root, 'etc/link.new'))
+    os.replace(os.path.join(root, 'etc/link.new'), os.path.join(root, 'etc/link'))
+    _po.populate(2)
+    assert(not os.path.exists(os.path.join(root, 'etc/plain')))
+    assert(os.readlink(os.path.join(root, 'etc/link')) == 'make.conf')
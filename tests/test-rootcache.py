@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+#
+#    test-rootcache.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import shutil
+import time
+from grs import Directive, RootCache, Snapshot
+
+testdir = '/tmp/test-rootcache'
+rootcache = os.path.join(testdir, 'roots')
+root = os.path.join(testdir, 'system')
+package = os.path.join(testdir, 'packages')
+logfile = os.path.join(testdir, 'test.log')
+
+def directive(i, line):
+    verb, *objs = line.split()
+    return Directive(i, line, verb, objs, False)
+
+if __name__ == "__main__":
+    shutil.rmtree(testdir, ignore_errors=True)
+    for directory in [root, package]:
+        os.makedirs(directory)
+
+    script = ['populate 1', 'mount', 'runscript a', 'unmount', 'log stamp', 'kernel c', 'runscript b']
+    directives = [directive(i + 1, line) for i, line in enumerate(script)]
+    prefix = RootCache.prefix(directives)
+    assert([_dir.verb for _dir in prefix] == ['populate', 'mount', 'runscript', 'unmount', 'log'])
+
+    # Without cheap clones, we only snapshot if we're told to copy.
+    _rc = RootCache(rootcache, root, package, logfile)
+    cheap = Snapshot(logfile).cheap(root, rootcache) and Snapshot(logfile).cheap(package, rootcache)
+    assert(_rc.worthwhile() == cheap)
+    _rc.save('key0')
+    assert(_rc.has('key0') == cheap)
+    shutil.rmtree(rootcache)
+    assert(not [f for f in os.listdir(testdir) if f.startswith('.reflink-probe')])
+
+    _rc = RootCache(rootcache, root, package, logfile, copy=True, keep=2)
+    with open(os.path.join(root, 'world'), 'w') as _file:
+        _file.write('one\n')
+    os.makedirs(os.path.join(package, 'sys-apps'))
+    _rc.save('key1')
+    assert(_rc.has('key1'))
+    assert(not _rc.has('key2'))
+    assert(sorted(os.listdir(rootcache)) == ['.lock', 'key1'])
+
+    # Saving again is a noop.
+    with open(os.path.join(root, 'world'), 'w') as _file:
+        _file.write('two\n')
+    _rc.save('key1')
+    with open(os.path.join(rootcache, 'key1/root/world'), 'r') as _file:
+        assert(_file.read() == 'one\n')
+
+    # Restoring rotates the root and package out of the way.
+    _rc.restore('key1')
+    with open(os.path.join(root, 'world'), 'r') as _file:
+        assert(_file.read() == 'one\n')
+    with open(os.path.join(root + '.0', 'world'), 'r') as _file:
+        assert(_file.read() == 'two\n')
+    assert(os.path.isdir(os.path.join(package, 'sys-apps')))
+    assert(os.path.isdir(package + '.0'))
+
+    # Only the most recently saved or restored snapshots are kept.
+    for key in ['key2', 'key3']:
+        time.sleep(0.05)
+        _rc.save(key)
+    assert(sorted(os.listdir(rootcache)) == ['.lock', 'key2', 'key3'])
+    time.sleep(0.05)
+    _rc.restore('key2')
+    time.sleep(0.05)
+    _rc.save('key4')
+    assert(sorted(os.listdir(rootcache)) == ['.lock', 'key2', 'key4'])
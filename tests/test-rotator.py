@@ -0,0 +1,90 @@
+#!/usr/bin/python
+#
+#    test-rotator.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import shutil
+import time
+from grs import Rotator
+
+testdir = '/tmp/test-rotator'
+
+def populate(directory, generation):
+    os.makedirs(os.path.join(directory, 'usr/bin'))
+    with open(os.path.join(directory, 'generation'), 'w') as _file:
+        _file.write('%d\n' % generation)
+
+def generation(directory):
+    with open(os.path.join(directory, 'generation'), 'r') as _file:
+        return int(_file.read())
+
+if __name__ == "__main__":
+    if os.path.isdir(testdir):
+        shutil.rmtree(testdir)
+    os.makedirs(testdir)
+    system = os.path.join(testdir, 'system')
+    _ro = Rotator()
+
+    # Nothing to rotate the first time.
+    assert(_ro.generation_rotate(system, upper_limit=3) is None)
+
+    # Each rotation moves system to the next generation number.
+    for i in range(5):
+        populate(system, i)
+        assert(_ro.generation_rotate(system, upper_limit=3) == '%s.%d' % (system, i))
+        assert(not os.path.exists(system))
+
+    # Only the newest three are kept, the rest went to the trash.
+    assert(sorted(os.listdir(testdir)) == ['.system.generations', '.trash', 'system.2', 'system.3', 'system.4'])
+    for i in [2, 3, 4]:
+        assert(generation('%s.%d' % (system, i)) == i)
+
+    # And the trash is emptied in the background.
+    trashdir = os.path.join(testdir, '.trash')
+    for i in range(100):
+        if not os.listdir(trashdir):
+            break
+        time.sleep(0.1)
+    assert(os.listdir(trashdir) == [])
+
+    # Directories past the upper limit of an ordinary rotation go to the trash too.
+    populate(system, 5)
+    _ro.full_rotate(system, upper_limit=3)
+    assert(sorted(os.listdir(testdir)) == ['.system.generations', '.trash', 'system.0', 'system.3'])
+
+    # Roots left by full_rotate(), where system.0 is the newest, are renumbered
+    # the first time, so the newest legacy root is kept and the oldest trashed.
+    shutil.rmtree(testdir)
+    os.makedirs(testdir)
+    for i in [0, 1, 3]:
+        populate('%s.%d' % (system, i), 10 - i)
+    populate(system, 11)
+    assert(_ro.generation_rotate(system, upper_limit=3) == '%s.8' % system)
+    assert(sorted(os.listdir(testdir)) == ['.system.generations', '.trash', 'system.6', 'system.7', 'system.8'])
+    assert([generation('%s.%d' % (system, i)) for i in [6, 7, 8]] == [9, 10, 11])
+
+    # Even once all the legacy roots are gone, new ones are numbered above them.
+    for i in [6, 7, 8]:
+        shutil.rmtree('%s.%d' % (system, i))
+    populate(system, 12)
+    assert(_ro.generation_rotate(system, upper_limit=3) == '%s.4' % system)
+    populate(system, 13)
+    assert(_ro.generation_rotate(system, upper_limit=3) == '%s.5' % system)
+    assert(generation('%s.4' % system) == 12)
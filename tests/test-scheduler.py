@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+#    test-scheduler.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import queue
+import threading
+import time
+from grs import Directive, Scheduler
+
+script = [
+    'populate 1', 'mount', 'runscript a', 'unmount', 'tarit', 'hashit',
+    'isoit', 'hashit', 'netbootit', 'hashit', 'kernel c', 'runscript b'
+]
+
+def make_plan():
+    plan = []
+    medium = None
+    for i, line in enumerate(script):
+        verb, *objs = line.split()
+        if verb in ['tarit', 'isoit', 'netbootit']:
+            medium = verb
+        plan.append(Directive(i + 1, line, verb, objs, False, medium if verb == 'hashit' else None))
+    return plan
+
+if __name__ == "__main__":
+    plan = make_plan()
+    sc = Scheduler(plan, 4)
+    waits = [sorted(plan[j].line_number for j in d) for d in sc.dependencies]
+    assert(waits[1] == [1])
+    assert(waits[4] == [1, 2, 3, 4])
+    assert(waits[5] == [5])
+    assert(waits[6] == [1, 2, 3, 4])
+    # kernel writes into the root, so it waits for the media made from it.
+    assert(waits[10] == [1, 2, 3, 4, 5, 7, 9])
+    assert(waits[11] == [1, 2, 3, 4, 5, 7, 9, 11])
+
+    # Every directive starts only after those it waits for are done, and the
+    # media are made concurrently.
+    lock = threading.Lock()
+    finished = []
+    overlap = []
+    active = set()
+    def execute(_dir):
+        with lock:
+            i = _dir.line_number - 1
+            assert(all(plan[j].line_number in finished for j in sc.dependencies[i]))
+            active.add(_dir.verb)
+            if {'tarit', 'isoit', 'netbootit'} <= active:
+                overlap.append(True)
+        time.sleep(0.1)
+        with lock:
+            active.discard(_dir.verb)
+    done = []
+    def stamp(_dir):
+        finished.append(_dir.line_number)
+        done.append(_dir.line_number)
+    sc.run(execute, stamp)
+    assert(sorted(done) == list(range(1, 13)))
+    assert(overlap)
+
+    # One job means just do it in order.
+    done = []
+    Scheduler(plan, 1).run(lambda _dir: None, lambda _dir: done.append(_dir.line_number))
+    assert(done == list(range(1, 13)))
+
+    # A netbootit which makes a cd, named like the isoit's, waits for isoit.
+    script[8] = 'netbootit cd'
+    plan = make_plan()
+    sc = Scheduler(plan, 4)
+    waits = [sorted(plan[j].line_number for j in d) for d in sc.dependencies]
+    assert(waits[8] == [1, 2, 3, 4, 7, 8])
+
+    # A failed directive, one whose execute() returns False, is not done.
+    done = []
+    Scheduler(plan, 1).run(lambda _dir: _dir.verb != 'isoit', lambda _dir: done.append(_dir.line_number))
+    assert(7 not in done)
+
+    # A failed directive SIGTERMs us while others may have just finished.
+    # The handler drains those, along with any which run() had yet to do().
+    sc = Scheduler(plan, 4)
+    sc.finished = queue.Queue()
+    sc.completed.add(0)
+    sc.finished.put((4, None))
+    sc.finished.put((6, RuntimeError()))
+    recorded = []
+    sc.drain(lambda _dir: recorded.append(_dir.line_number))
+    assert(recorded == [1, 5])
+    sc.drain(lambda _dir: recorded.append(_dir.line_number))
+    assert(recorded == [1, 5])
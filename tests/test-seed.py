@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#
+#    test-seed.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import hashlib
+import http.server
+import re
+import shutil
+import signal
+import subprocess
+import threading
+from grs import Seed
+
+testdir = '/tmp/test-seed'
+servedir = os.path.join(testdir, 'serve')
+stagename = 'stage3-test.tar.xz'
+stagepath = os.path.join(servedir, stagename)
+
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """ A stand in for distfiles.gentoo.org which honors Range requests. """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=servedir, **kwargs)
+
+    # The paths of all the GETs of the stage tarball.
+    fetches = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.endswith(stagename):
+            self.fetches.append(self.path)
+        _match = re.search(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        path = self.translate_path(self.path)
+        if not _match or not os.path.isfile(path):
+            return super().do_GET()
+        with open(path, 'rb') as f:
+            data = f.read()[int(_match.group(1)):]
+        self.send_response(206)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def make_stage(rootdir=os.path.join(testdir, 'stage')):
+    # Make a small stage tarball and its DIGESTS file to serve.
+    os.makedirs(os.path.join(rootdir, 'etc'))
+    for i in range(10):
+        with open(os.path.join(rootdir, 'etc', 'file-%d' % i), 'wb') as f:
+            f.write(os.urandom(100000))
+    os.makedirs(servedir, exist_ok=True)
+    subprocess.check_call(['tar', '-Jcf', stagepath, '-C', rootdir, '.'])
+    with open(stagepath, 'rb') as f:
+        sha512 = hashlib.sha512(f.read()).hexdigest()
+    with open('%s.DIGESTS' % stagepath, 'w') as f:
+        f.write('# SHA512 HASH\n%s  %s\n' % (sha512, stagename))
+
+
+def seedit(uri, system='tmp', cached=True):
+    tmpdir = os.path.join(testdir, system)
+    configroot = os.path.join(tmpdir, 'system')
+    package = os.path.join(tmpdir, 'packages')
+    seedcache = os.path.join(testdir, 'seeds') if cached else ''
+    stagedir = os.path.join(testdir, 'stages')
+    os.makedirs(tmpdir, exist_ok=True)
+    se = Seed(uri, tmpdir, configroot, package, os.path.join(testdir, 'test.log'), seedcache, stagedir)
+    return se
+
+
+def forget():
+    # Throw away all we downloaded or unpacked.
+    for directory in ['seeds', 'stages']:
+        shutil.rmtree(os.path.join(testdir, directory), ignore_errors=True)
+
+
+terminated = []
+
+def handler(signum, frame):
+    terminated.append(signum)
+
+
+if __name__ == "__main__":
+    if os.path.isdir(testdir):
+        shutil.rmtree(testdir)
+    make_stage()
+    signal.signal(signal.SIGTERM, handler)
+
+    server = http.server.HTTPServer(('127.0.0.1', 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    uri = 'http://127.0.0.1:%d/%s' % (server.server_port, stagename)
+
+    # A fresh download is extracted and kept.
+    se = seedit(uri)
+    assert(se.upstream_digest()[0] == 'sha512')
+    se.seed()
+    assert(not terminated)
+    assert(os.path.isfile(os.path.join(se.portage_configroot, 'etc/file-9')))
+    assert(os.path.isfile(se.filepath))
+    assert(not os.path.isfile(se.partpath))
+
+    # Resume from a partial download.
+    forget()
+    os.makedirs(os.path.dirname(se.partpath))
+    with open(stagepath, 'rb') as f:
+        data = f.read()
+    with open(se.partpath, 'wb') as f:
+        f.write(data[:len(data)//2])
+    se.seed()
+    assert(not terminated)
+    assert(os.path.isfile(os.path.join(se.portage_configroot, 'etc/file-9')))
+    with open(se.filepath, 'rb') as f:
+        assert(f.read() == data)
+
+    # With the stage in the seed cache, we don't even need the tarball.
+    os.unlink(se.filepath)
+    se.seed()
+    assert(not terminated)
+    assert(os.path.isfile(os.path.join(se.portage_configroot, 'etc/file-9')))
+    assert(not os.path.isfile(se.filepath))
+    assert(not os.path.isfile(se.partpath))
+
+    # A corrupt download is caught and thrown away.
+    forget()
+    os.makedirs(os.path.dirname(se.partpath))
+    with open(se.partpath, 'wb') as f:
+        f.write(b'\0' * 1000)
+    se.seed()
+    assert(terminated)
+    assert(not os.path.isfile(se.filepath))
+    assert(not os.path.isfile(se.partpath))
+
+    # Systems sharing a stage_uri, seeded at the same time, download it once,
+    # whether or not they unpack it into the seed cache.
+    for cached in [True, False]:
+        forget()
+        del RangeHandler.fetches[:]
+        pids = []
+        for system in ['system-a', 'system-b', 'system-c']:
+            pid = os.fork()
+            if not pid:
+                se = seedit(uri, system, cached)
+                se.seed()
+                os._exit(0 if os.path.isfile(os.path.join(se.portage_configroot, 'etc/file-9')) else 1)
+            pids.append(pid)
+        for pid in pids:
+            assert(os.waitpid(pid, 0)[1] == 0)
+        assert(len(RangeHandler.fetches) == 1)
+        assert(os.path.isdir(os.path.join(testdir, 'seeds')) == cached)
+
+    # A tarball downloaded into tmpdir, before we had a stagedir, is reused.
+    forget()
+    se = seedit(uri, 'system-a', False)
+    shutil.copy(stagepath, se.legacypath)
+    del RangeHandler.fetches[:]
+    se.seed()
+    assert(not RangeHandler.fetches)
+    assert(os.path.isfile(se.filepath) and not os.path.exists(se.legacypath))
+    with open(se.digestpath, 'r') as f:
+        assert(f.read().strip() == 'sha512:%s' % se.upstream_digest()[1])
+
+    # When upstream publishes a new stage at the same uri, the one we have
+    # is stale and downloaded again rather than failing its digest check.
+    with open(stagepath, 'rb') as f:
+        old = f.read()
+    make_stage(os.path.join(testdir, 'stage-new'))
+    se = seedit(uri, 'system-a', False)
+    del RangeHandler.fetches[:]
+    del terminated[:]
+    se.seed()
+    assert(not terminated)
+    assert(len(RangeHandler.fetches) == 1)
+    with open(se.filepath, 'rb') as f:
+        assert(f.read() != old)
+    with open(se.digestpath, 'r') as f:
+        assert(f.read().strip() == 'sha512:%s' % se.upstream_digest()[1])
+
+    # A stage is identified by its upstream digest, so a new stage at the
+    # same uri is a different one.
+    with open(stagepath, 'rb') as f:
+        sha512 = hashlib.sha512(f.read()).hexdigest()
+    assert(se.identity() == 'sha512:%s' % sha512)
+    with open('%s.DIGESTS' % stagepath, 'w') as f:
+        f.write('# SHA512 HASH\n%s  %s\n' % ('0' * 128, stagename))
+    assert(se.identity() == 'sha512:%s' % sha512)
+    se = seedit(uri, 'system-a')
+    assert(se.identity() == 'sha512:%s' % ('0' * 128))
+
+    # Without a DIGESTS file, by the tarball we have, else by its uri.
+    os.unlink('%s.DIGESTS' % stagepath)
+    se = seedit(uri, 'system-a')
+    assert(se.identity() == 'sha512:%s' % sha512)
+    os.unlink(se.filepath)
+    assert(se.identity() == uri)
+
+    server.shutdown()
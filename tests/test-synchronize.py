@@ -0,0 +1,129 @@
+#!/usr/bin/python
+#
+#    test-synchronize.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import shutil
+import subprocess
+from grs import Synchronize
+
+testdir = '/tmp/test-synchronize'
+remote = os.path.join(testdir, 'remote')
+gitcache = os.path.join(testdir, 'git')
+logfile = os.path.join(testdir, 'test.log')
+
+def git(repo, *args):
+    return subprocess.check_output(
+        ['git', '-C', repo, '-c', 'user.name=grs', '-c', 'user.email=grs@localhost'] + list(args),
+        universal_newlines=True, stderr=subprocess.DEVNULL
+    ).strip()
+
+def commit(content):
+    with open(os.path.join(remote, 'build'), 'w') as _file:
+        _file.write(content)
+    git(remote, 'add', 'build')
+    git(remote, 'commit', '-q', '-m', content)
+    return git(remote, 'rev-parse', 'HEAD')
+
+def logged():
+    with open(logfile, 'r') as _file:
+        return _file.read()
+
+if __name__ == "__main__":
+    # Let git clone submodules from local paths.
+    os.environ.update({
+        'GIT_CONFIG_COUNT' : '1', 'GIT_CONFIG_KEY_0' : 'protocol.file.allow', 'GIT_CONFIG_VALUE_0' : 'always'
+    })
+    if os.path.isdir(testdir):
+        shutil.rmtree(testdir)
+    os.makedirs(remote)
+    git(remote, 'init', '-q', '-b', 'test')
+    first = commit('log one\n')
+
+    systems = []
+    for name in ['a', 'b']:
+        libdir = os.path.join(testdir, name)
+        systems.append(Synchronize(remote, 'test', libdir, logfile, gitcache))
+
+    # Both systems are cloned from the one mirror, which is all that talks to
+    # the remote, but don't borrow its objects.
+    for _sy in systems:
+        _sy.sync()
+        assert(git(_sy.local_repo, 'rev-parse', 'HEAD') == first)
+        assert(git(_sy.local_repo, 'remote', 'get-url', 'origin') == _sy.mirror)
+        assert(not os.path.isfile(os.path.join(_sy.local_repo, '.git/objects/info/alternates')))
+    mirror = systems[0].mirror
+    assert(systems[1].mirror == mirror)
+    assert(os.path.isdir(mirror))
+    assert(git(mirror, 'config', 'gc.pruneExpire') == 'never')
+
+    # When nothing changed, a sync runs nothing that logs, eg. no fetch.
+    size = len(logged())
+    systems[0].sync()
+    assert(len(logged()) == size)
+
+    # A new commit upstream is picked up, and local changes thrown away.
+    second = commit('log two\n')
+    with open(os.path.join(systems[0].local_repo, 'junk'), 'w') as _file:
+        _file.write('junk\n')
+    systems[0].sync()
+    assert(git(systems[0].local_repo, 'rev-parse', 'HEAD') == second)
+    assert(not os.path.exists(os.path.join(systems[0].local_repo, 'junk')))
+
+    # Rewriting history upstream and gc'ing the mirror doesn't pull objects
+    # out from under a clone which still has the old commit.
+    systems[1].sync()
+    git(remote, 'reset', '-q', '--hard', first)
+    third = commit('log three\n')
+    systems[0].sync()
+    git(mirror, 'gc', '-q')
+    assert(git(systems[1].local_repo, 'rev-parse', 'HEAD') == second)
+    git(systems[1].local_repo, 'fsck', '--no-dangling')
+    systems[1].sync()
+    assert(git(systems[1].local_repo, 'rev-parse', 'HEAD') == third)
+
+    # Nor does losing the mirror altogether.
+    shutil.rmtree(mirror)
+    for _sy in systems:
+        git(_sy.local_repo, 'fsck', '--no-dangling')
+
+    # A submodule following a remote branch is updated, even when the
+    # superproject itself hasn't moved.
+    subremote = os.path.join(testdir, 'subremote')
+    os.makedirs(subremote)
+    git(subremote, 'init', '-q', '-b', 'main')
+    with open(os.path.join(subremote, 'script'), 'w') as _file:
+        _file.write('one\n')
+    git(subremote, 'add', 'script')
+    git(subremote, 'commit', '-q', '-m', 'one')
+    git(remote, 'submodule', '-q', 'add', '-b', 'main', subremote, 'scripts')
+    git(remote, 'commit', '-q', '-m', 'scripts')
+    _sy = Synchronize(remote, 'test', os.path.join(testdir, 'c'), logfile)
+    _sy.sync()
+    submodule = os.path.join(_sy.local_repo, 'scripts')
+    assert(git(submodule, 'rev-parse', 'HEAD') == git(subremote, 'rev-parse', 'HEAD'))
+    size = len(logged())
+    _sy.sync()
+    assert(len(logged()) == size)
+    with open(os.path.join(subremote, 'script'), 'w') as _file:
+        _file.write('two\n')
+    git(subremote, 'commit', '-q', '-a', '-m', 'two')
+    _sy.sync()
+    assert(git(submodule, 'rev-parse', 'HEAD') == git(subremote, 'rev-parse', 'HEAD'))
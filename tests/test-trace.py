@@ -0,0 +1,92 @@
+#!/usr/bin/python
+#
+#    test-trace.py: this file is part of the GRS suite
+#    Copyright (C) 2015  Anthony G. Basile
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+sys.path.append(os.path.abspath('..'))
+
+import json
+import shutil
+import signal
+import subprocess
+import threading
+from grs import Directive, Trace
+
+tracedir = '/tmp/test-trace'
+tracefile = os.path.join(tracedir, 'trace.jsonl')
+
+def records(path=tracefile):
+    with open(path, 'r') as _file:
+        return [json.loads(line) for line in _file]
+
+if __name__ == "__main__":
+    shutil.rmtree(tracedir, ignore_errors=True)
+    os.makedirs(tracedir)
+    _tr = Trace(tracefile)
+
+    # A directive's commands are accounted to its record, with the first
+    # non-zero exit code as its status.
+    _tr.begin(Directive(1, 'pivot_root', 'pivot_root', [], False, None))
+    for cmd in ['true', 'false', 'true']:
+        Trace.wait(subprocess.Popen([cmd]))
+    assert(not Trace.failed())
+    _tr.end()
+    record = records()[0]
+    assert(record['line'] == 1 and record['directive'] == 'pivot_root')
+    assert(record['commands'] == 3 and record['status'] == 1)
+    assert(record['wall'] >= 0 and record['maxrss'] > 0)
+
+    # Nothing is accounted outside of a directive.
+    assert(Trace.context() is None)
+    Trace.wait(subprocess.Popen(['true']))
+    assert(len(records()) == 1)
+
+    # A helper thread may adopt the record of the thread it works for.
+    _tr.begin(Directive(2, 'tarit', 'tarit', [], False, None))
+    record = Trace.context()
+    def helper():
+        Trace.adopt(record)
+        Trace.wait(subprocess.Popen(['true']))
+    thread = threading.Thread(target=helper)
+    thread.start()
+    thread.join()
+    Trace.fail()
+    assert(Trace.failed())
+    _tr.end()
+    assert(not Trace.failed())
+    record = records()[1]
+    assert(record['commands'] == 1 and record['failed'])
+
+    # On abort, directives in progress are written with the signal, once.
+    _tr.begin(Directive(3, 'kernel', 'kernel', [], False, None))
+    _tr.abort(signal.SIGTERM)
+    _tr.abort(signal.SIGTERM)
+    _tr.totals({'cpu_usec' : 1000})
+    assert([r['line'] for r in records()] == [1, 2, 3, 0])
+    assert(records()[2]['status'] == 128 + signal.SIGTERM)
+    assert(records()[3]['cpu_usec'] == 1000 and records()[3]['directive'] == 'run')
+
+    # Each run starts a new tracefile and the old ones are rotated.
+    _tr.rotate_traces(upper_limit=2)
+    assert(not os.path.exists(tracefile))
+    assert(len(records(tracefile + '.0')) == 4)
+    for i in range(3):
+        _tr.rotate_traces(upper_limit=2)
+        _tr = Trace(tracefile)
+        _tr.totals({})
+    assert(sorted(os.listdir(tracedir)) == ['trace.jsonl', 'trace.jsonl.0', 'trace.jsonl.1'])